@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import paderbox as pb
+
+
+def get_cache_key(
+        speech, model_tag, decoding_kwargs, segmentation_kwargs,
+        espnet_version, batched
+):
+    """
+    Get the key of a transcription, which changes if the audio samples, the
+    ASR model, the decoding parameters, the segmentation of long signals,
+    the version of ESPnet or the decoding mode change
+
+    Args:
+        speech (numpy.ndarray):
+            Signal to be transcribed
+        model_tag (str):
+            Tag of the ASR model
+        decoding_kwargs (dict):
+            Decoding parameters of the ASR model
+        segmentation_kwargs (dict):
+            Parameters of segment_audio (max_len, min_pause, min_seg_len)
+        espnet_version (str):
+            Version of ESPnet, which might change the decoding
+        batched (bool):
+            Whether the segments are decoded in batches (see
+            ESPnetASR.apply_asr_batch), whose transcriptions might differ
+            from the ones of the unbatched decoding due to the padding
+
+    Returns:
+        Hex digest of the key
+    """
+    speech = np.ascontiguousarray(speech)
+    key = hashlib.sha256()
+    key.update(json.dumps(
+        [
+            model_tag, decoding_kwargs, segmentation_kwargs, espnet_version,
+            batched, speech.dtype.str, speech.shape
+        ],
+        sort_keys=True
+    ).encode())
+    key.update(speech.data)
+    return key.hexdigest()
+
+
+class TranscriptionCache:
+    def __init__(self, cache_dir):
+        """
+        Persistent cache of transcriptions, such that unchanged signals are
+        not decoded again if the transcription is repeated (e.g., after
+        changing only a part of the processing). Each transcription is
+        stored in its own file, which is written atomically, such that
+        several processes can use the same cache.
+
+        Args:
+            cache_dir (str, Path):
+                Directory where the transcriptions are stored
+        """
+        self.cache_dir = Path(cache_dir)
+        self.num_hits = 0
+        self.num_misses = 0
+
+    def _get_file(self, key):
+        return self.cache_dir / key[:2] / f'{key}.json'
+
+    def get(self, key):
+        """
+        Get a transcription from the cache
+
+        Args:
+            key (str):
+                Key of the transcription (see get_cache_key)
+
+        Returns:
+            The transcription or None if it is not cached
+        """
+        file = self._get_file(key)
+        if not file.exists():
+            self.num_misses += 1
+            return None
+        self.num_hits += 1
+        return pb.io.load_json(file)['text']
+
+    def put(self, key, text):
+        """
+        Store a transcription in the cache
+
+        Args:
+            key (str):
+                Key of the transcription (see get_cache_key)
+            text (str):
+                Transcription
+        """
+        file = self._get_file(key)
+        file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = file.with_name(f'{file.name}.{os.getpid()}.tmp')
+        try:
+            pb.io.dump_json({'text': text}, tmp_file)
+            os.replace(tmp_file, file)
+        finally:
+            # Only left if writing the transcription failed
+            tmp_file.unlink(missing_ok=True)
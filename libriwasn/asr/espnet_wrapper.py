@@ -1,4 +1,5 @@
-import itertools
+from importlib.metadata import version
+import inspect
 import socket
 
 import dlp_mpi
@@ -9,6 +10,9 @@ import paderbox as pb
 from paderwasn.synchronization.utils import VoiceActivityDetector
 import torch
 
+from libriwasn.asr.cache import TranscriptionCache, get_cache_key
+from libriwasn.utils import get_max_min_cuts
+
 
 def segment_audio(sig, max_len=192000, min_pause=4000, min_seg_len=16000):
     """
@@ -77,20 +81,13 @@ def segment_audio(sig, max_len=192000, min_pause=4000, min_seg_len=16000):
                 return [sig, ]
             return segments
         else:
-            combinations = []
-            min_lens = []
-            cs = itertools.combinations(poss_points_2_cut, r=num_cuts)
-            for combination in cs:
-                combination = [0, ] + list(combination) + [len(sig), ]
-                cost = np.min([combination[i] - combination[i - 1] for i in
-                               range(1, len(combination))])
-                min_lens.append(cost)
-                combinations.append(combination)
-            choice = np.argmax(min_lens)
-            points_2_cut = combinations[choice]
+            # Choose the cuts which maximize the length of the shortest
+            # segment (see get_max_min_cuts)
+            cuts, cost = \
+                get_max_min_cuts(poss_points_2_cut, num_cuts, len(sig))
+            points_2_cut = [0, ] + cuts + [len(sig), ]
             segments = [sig[points_2_cut[i]:points_2_cut[i + 1]]
                         for i in range(len(points_2_cut) - 1)]
-            cost = min_lens[choice]
             if cost < min_seg_len:
                 num_cuts -= 1
                 if num_cuts == 0:
@@ -99,8 +96,69 @@ def segment_audio(sig, max_len=192000, min_pause=4000, min_seg_len=16000):
                 return segments
 
 
+def get_batches(lengths, batch_size=16, max_batch_samples=1920000):
+    """
+    Group signals of similar length into batches (length bucketing), such
+    that only little padding is needed if the signals of a batch are
+    processed together.
+
+    Args:
+        lengths (list):
+            Length of each signal
+        batch_size (int):
+            Maximum number of signals per batch
+        max_batch_samples (int):
+            Maximum number of samples of a batch including the padding, i.e.,
+            the number of signals times the length of the longest signal of
+            the batch. A signal which is longer forms a batch on its own.
+
+    Returns:
+        List of batches, each given as list of indices of the signals
+    """
+    batches = []
+    batch = []
+    # The longest signals come first. Hence, the first signal of a batch
+    # determines its padded length.
+    for index in np.argsort(lengths, kind='stable')[::-1]:
+        if len(batch) > 0 and (
+                len(batch) == batch_size
+                or (len(batch) + 1) * lengths[batch[0]] > max_batch_samples
+        ):
+            batches.append(batch)
+            batch = []
+        batch.append(int(index))
+    if len(batch) > 0:
+        batches.append(batch)
+    return batches
+
+
+def supports_batch_decoding(speech2text):
+    """
+    Check whether the installed version of ESPnet supports the batched
+    decoding (see ESPnetASR.apply_asr_batch). The batched decoding relies on
+    Speech2Text._decode_single_sample(enc), which is not part of the public
+    interface of ESPnet and might be changed or removed by any version.
+
+    Args:
+        speech2text (Speech2Text):
+            Loaded ESPnet model
+
+    Returns:
+        True if Speech2Text._decode_single_sample exists and only takes the
+        encoder output of a single signal
+    """
+    decode = getattr(speech2text, '_decode_single_sample', None)
+    if decode is None:
+        return False
+    try:
+        parameters = list(inspect.signature(decode).parameters)
+    except (TypeError, ValueError):
+        return False
+    return parameters == ['enc']
+
+
 class ESPnetASR:
-    def __init__(self, model_dir=None, enable_gpu=False):
+    def __init__(self, model_dir=None, enable_gpu=False, cache_dir=None):
         """
         Wrapper around the Espnet to  use the pretrained model from [watanabe201]
 
@@ -121,12 +179,40 @@ class ESPnetASR:
                  espnet_modelzoo module.
             enable_gpu:
                 If True GPU-based decoding is used if a GPU is available.
+            cache_dir:
+                Directory of a persistent cache of the transcriptions (see
+                TranscriptionCache). Signals whose samples, ASR model,
+                decoding and segmentation parameters, ESPnet version and
+                decoding mode (batched or unbatched) match a cached
+                transcription are not decoded again (see get_cache_key). If
+                None, no cache is used.
         """
-        model_tag = ('Shinji Watanabe/librispeech_asr_train_asr_'
-                     'transformer_e18_raw_bpe_sp_valid.acc.best')
+        self.model_tag = ('Shinji Watanabe/librispeech_asr_train_asr_'
+                          'transformer_e18_raw_bpe_sp_valid.acc.best')
+        # Decoding parameters are not included in the model file
+        self.decoding_kwargs = dict(
+            maxlenratio=0.0,
+            minlenratio=0.0,
+            beam_size=20,
+            ctc_weight=0.3,
+            lm_weight=0.5,
+            penalty=0.0,
+            nbest=1,
+        )
+        # Parameters of segment_audio, which is applied before the decoding
+        self.segmentation_kwargs = dict(
+            max_len=192000,
+            min_pause=4000,
+            min_seg_len=16000,
+        )
+        self.espnet_version = version('espnet')
         d = ModelDownloader(model_dir)
-        self.espnet_model_kwargs = d.download_and_unpack(model_tag)
+        self.espnet_model_kwargs = d.download_and_unpack(self.model_tag)
         self.enable_gpu = enable_gpu
+        if cache_dir is None:
+            self.cache = None
+        else:
+            self.cache = TranscriptionCache(cache_dir)
 
         if not dlp_mpi.IS_MASTER or dlp_mpi.SIZE == 1:
             try:
@@ -164,33 +250,52 @@ class ESPnetASR:
             device = 'cuda'
         speech2text = Speech2Text(  # Speech2Text.from_pretrained
             **self.espnet_model_kwargs,
-            # Decoding parameters are not included in the model file
             device=device,
-            maxlenratio=0.0,
-            minlenratio=0.0,
-            beam_size=20,
-            ctc_weight=0.3,
-            lm_weight=0.5,
-            penalty=0.0,
-            nbest=1,
+            **self.decoding_kwargs,
         )
         return speech2text
 
-    def apply_asr(self, file):
+    def _get_cached(self, speech, batched=False):
+        # Returns the key of the signal and its cached transcription (None if
+        # it is not cached)
+        if self.cache is None:
+            return None, None
+        key = get_cache_key(
+            speech, self.model_tag, self.decoding_kwargs,
+            self.segmentation_kwargs, self.espnet_version, batched
+        )
+        return key, self.cache.get(key)
+
+    def apply_asr(self, file, start=0, stop=None, channel=None):
         """
         Apply the ASR-system
 
         Args:
             file:
                 File in which the signal, to be transcribed, is stored.
+            start:
+                First sample of the signal within the file, e.g., if the
+                file is a container of several segments.
+            stop:
+                Sample after the last sample of the signal within the file.
+                If None, the signal ends with the file.
+            channel:
+                Channel of the file in which the signal is stored, e.g., if
+                the segment is read from a multi-channel recording. If None,
+                the file must be a single-channel file.
 
         Returns:
             The transcription belonging to the signal stored in the file.
         """
-        speech = pb.io.load_audio(file)
+        speech = pb.io.load_audio(
+            file, start=start, stop=stop, channel=channel
+        )
         assert speech.ndim == 1, speech.shape
+        key, text = self._get_cached(speech)
+        if text is not None:
+            return text
         text = ''
-        segments = segment_audio(speech)
+        segments = segment_audio(speech, **self.segmentation_kwargs)
         for seg in segments:
             nbests = self.speech2text(seg)
             text_segment, *_ = nbests[0]
@@ -198,4 +303,129 @@ class ESPnetASR:
                 text += text_segment
             else:
                 text += ' ' + text_segment
+        if self.cache is not None:
+            self.cache.put(key, text)
         return text
+
+    def _decode_batch(self, segments):
+        speech2text = self.speech2text
+        if not supports_batch_decoding(speech2text):
+            # The installed version of ESPnet does not allow to decode the
+            # output of the encoder separately.
+            return [speech2text(seg)[0][0] for seg in segments]
+        lengths = torch.tensor([len(seg) for seg in segments])
+        speech = torch.zeros(
+            (len(segments), int(lengths.max())),
+            dtype=getattr(torch, speech2text.dtype)
+        )
+        for i, seg in enumerate(segments):
+            speech[i, :len(seg)] = torch.from_numpy(np.asarray(seg))
+        with torch.no_grad():
+            enc, enc_lengths = speech2text.asr_model.encode(
+                speech=speech.to(speech2text.device),
+                speech_lengths=lengths.to(speech2text.device)
+            )
+            if isinstance(enc, tuple):
+                # Outputs of intermediate layers are not needed
+                enc = enc[0]
+            texts = []
+            # The beam search is run for each segment on its unpadded encoder
+            # output.
+            for enc_seg, enc_length in zip(enc, enc_lengths):
+                nbests = speech2text._decode_single_sample(
+                    enc_seg[:int(enc_length)]
+                )
+                texts.append(nbests[0][0])
+        return texts
+
+    def apply_asr_batch(
+            self, files, starts=None, stops=None, channels=None,
+            batch_size=16, max_batch_samples=1920000
+    ):
+        """
+        Apply the ASR-system to several signals. The signals are segmented
+        (see segment_audio) and the segments of all signals are grouped into
+        batches of similar length (see get_batches). The encoder processes
+        the zero-padded segments of a batch at once, which is considerably
+        faster than processing them one by one on a CPU. The beam search is
+        run separately for each segment. Signals with a cached transcription
+        (see TranscriptionCache) are not decoded.
+
+        The batched decoding is experimental. It relies on a private method
+        of ESPnet (see supports_batch_decoding) and is only checked against
+        the decoding of each signal on its own (see apply_asr) by
+        test_espnet_wrapper.py with the installed version of ESPnet. If the
+        installed version does not provide this method, the segments are
+        decoded one by one.
+
+        Args:
+            files (list):
+                Files in which the signals are stored (see apply_asr)
+            starts (list):
+                First sample of each signal within its file (see apply_asr).
+                Defaults to 0 for all signals.
+            stops (list):
+                Sample after the last sample of each signal within its file
+                (see apply_asr). Defaults to None for all signals.
+            channels (list):
+                Channel of each file (see apply_asr). Defaults to None for all
+                signals.
+            batch_size (int):
+                Maximum number of segments per batch
+            max_batch_samples (int):
+                Maximum number of samples of a batch including the padding
+                (see get_batches)
+
+        Returns:
+            List of the transcriptions of the signals
+        """
+        if starts is None:
+            starts = [0] * len(files)
+        if stops is None:
+            stops = [None] * len(files)
+        if channels is None:
+            channels = [None] * len(files)
+        assert len(files) == len(starts) == len(stops) == len(channels), \
+            (len(files), len(starts), len(stops), len(channels))
+        texts = [None] * len(files)
+        keys = [None] * len(files)
+        # If the segments are decoded one by one (see _decode_batch), the
+        # transcriptions are identical to the ones of apply_asr and share
+        # their cache entries.
+        batched = supports_batch_decoding(self.speech2text)
+        segments = []
+        utt_ids = []
+        for utt_id, (file, start, stop, channel) in enumerate(
+                zip(files, starts, stops, channels)
+        ):
+            speech = pb.io.load_audio(
+                file, start=start, stop=stop, channel=channel
+            )
+            assert speech.ndim == 1, speech.shape
+            keys[utt_id], texts[utt_id] = self._get_cached(speech, batched)
+            if texts[utt_id] is not None:
+                continue
+            texts[utt_id] = ''
+            for seg in segment_audio(speech, **self.segmentation_kwargs):
+                segments.append(seg)
+                utt_ids.append(utt_id)
+
+        text_segments = [None] * len(segments)
+        for batch in get_batches(
+                [len(seg) for seg in segments], batch_size, max_batch_samples
+        ):
+            for i, text_segment in zip(
+                    batch, self._decode_batch([segments[i] for i in batch])
+            ):
+                text_segments[i] = text_segment
+
+        # The segments of each signal are in their original order
+        for utt_id, text_segment in zip(utt_ids, text_segments):
+            if len(texts[utt_id]) == 0:
+                texts[utt_id] += text_segment
+            else:
+                texts[utt_id] += ' ' + text_segment
+        if self.cache is not None:
+            for utt_id in sorted(set(utt_ids)):
+                self.cache.put(keys[utt_id], texts[utt_id])
+        return texts
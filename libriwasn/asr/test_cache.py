@@ -0,0 +1,104 @@
+"""
+Check that the key of the transcription cache changes with each of its
+inputs and that the cache returns stored transcriptions, counts the hits
+and misses and writes the transcriptions atomically.
+
+python -m pytest libriwasn/asr/test_cache.py
+"""
+import numpy as np
+import paderbox as pb
+import pytest
+
+from libriwasn.asr.cache import TranscriptionCache, get_cache_key
+
+
+_KWARGS = dict(
+    model_tag='model',
+    decoding_kwargs={'beam_size': 20, 'ctc_weight': .3},
+    segmentation_kwargs={
+        'max_len': 192000, 'min_pause': 4000, 'min_seg_len': 16000
+    },
+    espnet_version='202402',
+    batched=False,
+)
+
+
+def _get_speech(seed=0):
+    return np.random.default_rng(seed).uniform(-.5, .5, 16000)
+
+
+def test_key_identical():
+    speech = _get_speech()
+    key = get_cache_key(speech, **_KWARGS)
+    # The key does not depend on the memory layout of the signal
+    speech_view = np.stack([speech, speech], axis=-1)[:, 0]
+    assert not speech_view.flags.c_contiguous
+    assert get_cache_key(speech_view, **_KWARGS) == key
+    assert get_cache_key(speech.copy(), **_KWARGS) == key
+
+
+@pytest.mark.parametrize('name,value', [
+    ('model_tag', 'other_model'),
+    ('decoding_kwargs', {'beam_size': 10, 'ctc_weight': .3}),
+    ('segmentation_kwargs', {
+        'max_len': 160000, 'min_pause': 4000, 'min_seg_len': 16000
+    }),
+    ('segmentation_kwargs', {
+        'max_len': 192000, 'min_pause': 8000, 'min_seg_len': 16000
+    }),
+    ('segmentation_kwargs', {
+        'max_len': 192000, 'min_pause': 4000, 'min_seg_len': 8000
+    }),
+    ('espnet_version', '202412'),
+    ('batched', True),
+])
+def test_key_changes(name, value):
+    speech = _get_speech()
+    key = get_cache_key(speech, **_KWARGS)
+    assert get_cache_key(speech, **{**_KWARGS, name: value}) != key
+
+
+def test_key_changes_with_speech():
+    speech = _get_speech()
+    key = get_cache_key(speech, **_KWARGS)
+    assert get_cache_key(_get_speech(1), **_KWARGS) != key
+    assert get_cache_key(speech.astype(np.float32), **_KWARGS) != key
+    assert get_cache_key(speech[:-1], **_KWARGS) != key
+
+
+def test_hit_and_miss(tmp_path):
+    cache = TranscriptionCache(tmp_path)
+    key = get_cache_key(_get_speech(), **_KWARGS)
+    assert cache.get(key) is None
+    cache.put(key, 'hello world')
+    assert cache.get(key) == 'hello world'
+    assert cache.get(get_cache_key(_get_speech(1), **_KWARGS)) is None
+    assert (cache.num_hits, cache.num_misses) == (1, 2)
+    # The cache is persistent
+    cache = TranscriptionCache(tmp_path)
+    assert cache.get(key) == 'hello world'
+    assert (cache.num_hits, cache.num_misses) == (1, 0)
+
+
+def test_atomic_put(tmp_path, monkeypatch):
+    cache = TranscriptionCache(tmp_path)
+    key = get_cache_key(_get_speech(), **_KWARGS)
+    cache.put(key, 'hello world')
+    cache.put(key, 'hello again')
+    assert cache.get(key) == 'hello again'
+    dump_json = pb.io.dump_json
+
+    def fail(obj, path, *args, **kwargs):
+        # Write a part of the file and fail
+        dump_json(obj, path, *args, **kwargs)
+        with open(path, 'r+') as file:
+            file.truncate(5)
+        raise OSError('No space left on device')
+
+    monkeypatch.setattr(pb.io, 'dump_json', fail)
+    with pytest.raises(OSError, match='No space left'):
+        cache.put(key, 'hello world')
+    # The previous transcription is kept and no temporary file is left
+    assert cache.get(key) == 'hello again'
+    assert [file.name for file in tmp_path.glob('**/*') if file.is_file()] \
+        == [f'{key}.json']
@@ -0,0 +1,104 @@
+"""
+Check that the batched decoding (apply_asr_batch) yields the same
+hypotheses as the decoding of each signal on its own (apply_asr). The
+batched decoding relies on the encoder of the ESPnet model processing
+zero-padded batches and on Speech2Text._decode_single_sample, which is not
+part of the public interface of ESPnet. The pretrained model is downloaded
+into the directory given by the environment variable LIBRIWASN_ASR_MODEL_DIR
+(defaults to the directory of espnet_model_zoo).
+
+python -m pytest libriwasn/asr/test_espnet_wrapper.py
+"""
+import os
+
+import numpy as np
+import paderbox as pb
+import pytest
+
+pytest.importorskip('torch')
+pytest.importorskip('espnet2')
+pytest.importorskip('espnet_model_zoo')
+pytest.importorskip('paderwasn')
+import torch  # noqa: E402
+
+from libriwasn.asr.espnet_wrapper import (  # noqa: E402
+    ESPnetASR,
+    supports_batch_decoding
+)
+from libriwasn.benchmark.synthetic import (  # noqa: E402
+    _get_speech_like_signal
+)
+
+
+@pytest.fixture(scope='module')
+def asr():
+    return ESPnetASR(model_dir=os.environ.get('LIBRIWASN_ASR_MODEL_DIR'))
+
+
+@pytest.fixture(scope='module')
+def files(tmp_path_factory):
+    # The longest signal exceeds the maximum segment length of segment_audio
+    # and is therefore decoded in several segments.
+    rng = np.random.default_rng(0)
+    data_dir = tmp_path_factory.mktemp('asr')
+    files = []
+    for i, duration in enumerate([1.5, 3, 3.5, 7, 15]):
+        file = data_dir / f'utt{i}.wav'
+        sig = _get_speech_like_signal(int(duration * 16000), rng)
+        pb.io.dump_audio(.5 * sig, file)
+        files.append(file)
+    return files
+
+
+def test_supports_batch_decoding(asr):
+    # Otherwise, apply_asr_batch decodes the segments one by one and the
+    # batched decoding is not checked by the following tests.
+    assert supports_batch_decoding(asr.speech2text), asr.espnet_version
+
+
+def _encode(speech2text, speech, lengths):
+    with torch.no_grad():
+        enc, enc_lengths = speech2text.asr_model.encode(
+            speech=speech, speech_lengths=lengths
+        )
+    if isinstance(enc, tuple):
+        # Outputs of intermediate layers are not needed
+        enc = enc[0]
+    return enc, enc_lengths
+
+
+def test_padded_encoding(asr, files):
+    # The encoder outputs of the zero-padded signals of a batch are
+    # identical to the outputs of the signals on their own up to the
+    # numerical precision.
+    speech2text = asr.speech2text
+    sigs = [pb.io.load_audio(file) for file in files[:4]]
+    lengths = torch.tensor([len(sig) for sig in sigs])
+    speech = torch.zeros(
+        (len(sigs), int(lengths.max())),
+        dtype=getattr(torch, speech2text.dtype)
+    )
+    for i, sig in enumerate(sigs):
+        speech[i, :len(sig)] = torch.from_numpy(sig)
+    speech = speech.to(speech2text.device)
+    lengths = lengths.to(speech2text.device)
+    enc, enc_lengths = _encode(speech2text, speech, lengths)
+    for i, sig in enumerate(sigs):
+        enc_ref, _ = _encode(
+            speech2text, speech[i:i + 1, :len(sig)], lengths[i:i + 1]
+        )
+        enc_ref = enc_ref[0].cpu().numpy()
+        enc_seg = enc[i, :int(enc_lengths[i])].cpu().numpy()
+        assert enc_seg.shape == enc_ref.shape, (enc_seg.shape, enc_ref.shape)
+        np.testing.assert_allclose(
+            enc_seg, enc_ref, rtol=0, atol=1e-4 * np.max(np.abs(enc_ref))
+        )
+
+
+@pytest.mark.parametrize('batch_size', [1, 4, 16])
+def test_batched_identical_to_unbatched(asr, files, batch_size):
+    # The signals are segmented and the segments are grouped into batches
+    # of similar length (see apply_asr_batch)
+    texts_ref = [asr.apply_asr(file) for file in files]
+    texts = asr.apply_asr_batch(files, batch_size=batch_size)
+    assert texts == texts_ref
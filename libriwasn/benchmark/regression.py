@@ -0,0 +1,376 @@
+"""
+Performance regression check of the mask estimation and the beamforming.
+Reduced-size workloads on a synthetic meeting (see
+libriwasn.benchmark.synthetic) are run through the entry points and their
+runtime, their peak memory consumption and a fingerprint of their outputs
+are compared against a stored baseline. The report shows which stage
+regressed. The check can also be run via pytest (see test_regression.py).
+
+Baselines depend on the machine and on the versions of the dependencies,
+which are recorded with the baseline (see get_environment). Record a
+baseline on the machine which is used for the check and commit it before
+changing the code. The check fails if there is no baseline (the pytest
+checks are skipped unless LIBRIWASN_REQUIRE_BASELINE=1 is set).
+python -m libriwasn.benchmark.regression --update
+
+Example calls:
+python -m libriwasn.benchmark.regression
+python -m pytest libriwasn/benchmark/test_regression.py
+
+Call 'python -m libriwasn.benchmark.regression --help' to get an overview of all options
+"""
+import os
+from pathlib import Path
+import sys
+import tempfile
+
+import click
+import numpy as np
+import paderbox as pb
+
+from libriwasn.benchmark.run import get_environment
+from libriwasn.benchmark.synthetic import generate_meeting
+from libriwasn.mask_estimation.cacgmm import get_tf_masks
+from libriwasn.mask_estimation.initialization import get_initialization
+from libriwasn import profiling
+from libriwasn.source_extraction.separation import separate_sources
+
+
+# Parameters of the synthetic meeting used for the check (see
+# generate_meeting). A single device is used such that no synchronization is
+# needed.
+WORKLOAD = dict(
+    num_devices=1, num_channels=4, num_speakers=3, duration=30,
+    overlap_ratio=.2, seed=0
+)
+STAGES = [
+    'get_initialization',
+    'get_tf_masks',
+    'separate_sources',
+    'separate_sources_batched'
+]
+# Maximum ratio between the measured and the baseline runtime / peak memory,
+# the relative tolerance of the fingerprints of the outputs and the maximum
+# relative difference between the batched and the non-batched beamforming
+TOLERANCES = {
+    'time': 1.3, 'peak_traced': 1.1, 'fingerprint': 1e-4, 'batched': 1e-6
+}
+# Runtimes below this threshold (in seconds) are too noisy to be compared
+MIN_TIME = .05
+DEFAULT_BASELINE = Path(__file__).parent / 'baselines' / 'regression.json'
+
+
+def get_baseline_path():
+    """
+    Get the path of the baseline, which can be overwritten by the environment
+    variable LIBRIWASN_REGRESSION_BASELINE (e.g., for a baseline of another
+    machine)
+
+    Returns:
+        Path of the baseline
+    """
+    return Path(
+        os.environ.get('LIBRIWASN_REGRESSION_BASELINE', DEFAULT_BASELINE)
+    )
+
+
+def load_baseline(path=None):
+    """
+    Load the baseline
+
+    Args:
+        path (str, Path):
+            Path of the baseline. Defaults to get_baseline_path().
+
+    Returns:
+        Baseline or None if it does not exist
+    """
+    if path is None:
+        path = get_baseline_path()
+    path = Path(path)
+    if not path.exists():
+        return None
+    return pb.io.load_json(path)
+
+
+def get_environment_differences(baseline):
+    """
+    Compare the environment in which the baseline was recorded with the
+    current environment (see get_environment), e.g., to explain deviating
+    runtimes
+
+    Args:
+        baseline (dict):
+            Baseline (see load_baseline)
+
+    Returns:
+        Dictionary with the entries of the environment (except for the git
+        commit) which differ as tuples (baseline, current)
+    """
+    reference = baseline['environment']
+    environment = get_environment()
+    differences = {}
+    for key in environment.keys() - {'commit', 'packages'}:
+        if reference.get(key) != environment[key]:
+            differences[key] = (reference.get(key), environment[key])
+    reference_packages = reference.get('packages', {})
+    for package, package_version in environment['packages'].items():
+        if reference_packages.get(package) != package_version:
+            differences[package] = \
+                (reference_packages.get(package), package_version)
+    return differences
+
+
+def print_environment_differences(baseline):
+    """
+    Print the differences between the environment of the baseline and the
+    current environment (see get_environment_differences)
+
+    Args:
+        baseline (dict):
+            Baseline (see load_baseline)
+    """
+    differences = get_environment_differences(baseline)
+    if len(differences) == 0:
+        return
+    print(
+        'The baseline was recorded in another environment (baseline vs. '
+        'current):', flush=True
+    )
+    for key, (reference, value) in sorted(differences.items()):
+        print(f'  {key}: {reference} vs. {value}', flush=True)
+
+
+def _fingerprint(arrays):
+    # Summary statistics of the outputs, which detect changes of the results
+    # without storing the outputs.
+    arrays = [np.asarray(array, dtype=np.float64) for array in arrays]
+    return {
+        'num_arrays': len(arrays),
+        'num_elements': int(sum([array.size for array in arrays])),
+        'sum': float(sum([np.sum(array) for array in arrays])),
+        'sum_abs': float(sum([np.sum(np.abs(array)) for array in arrays])),
+        'sum_squares': float(sum([np.sum(array ** 2) for array in arrays])),
+    }
+
+
+def prepare_workload(data_dir):
+    """
+    Generate the synthetic meeting used for the check and calculate its STFT
+
+    Args:
+        data_dir (str, Path):
+            Directory where the meeting is stored
+
+    Returns:
+        STFT of the meeting (Shape: number of channels x number of frames x
+        FFT size / 2 + 1)
+    """
+    example = generate_meeting(
+        data_dir, example_id='regression', **WORKLOAD
+    )
+    audio_path = example['audio_path']['observation']['device0']
+    return pb.transform.stft(pb.io.load_audio(audio_path))
+
+
+def _run_stages(y):
+    with profiling.stage('get_initialization'):
+        mm_init, mm_guide = get_initialization(y)
+    with profiling.stage('get_tf_masks'):
+        masks, priors = get_tf_masks(y, mm_init, mm_guide)
+    with profiling.stage('separate_sources'):
+        sig_segments, _ = separate_sources(y, masks, priors)
+    with profiling.stage('separate_sources_batched'):
+        sig_segments_batched, _ = \
+            separate_sources(y, masks, priors, batched=True)
+    return {
+        'get_initialization': [mm_init, mm_guide],
+        'get_tf_masks': [masks, priors],
+        'separate_sources': [
+            segment for segments in sig_segments for segment in segments
+        ],
+        'separate_sources_batched': [
+            segment for segments in sig_segments_batched
+            for segment in segments
+        ],
+    }
+
+
+def run_regression_workload(y, repeat=3):
+    """
+    Run the stages on the workload and measure their runtime (minimum over
+    repeat runs) and their peak memory consumption (traced in a separate run,
+    since tracemalloc slows down the processing)
+
+    Args:
+        y (numpy.ndarray):
+            STFT of the workload (see prepare_workload)
+        repeat (int):
+            Number of runs used to measure the runtime
+
+    Returns:
+        Dictionary with the runtime ('time'), the peak traced memory
+        ('peak_traced') and the fingerprint of the outputs ('fingerprint')
+        per stage. Additionally, the maximum difference between the outputs
+        of the batched and the non-batched beamforming relative to the
+        maximum amplitude of the outputs is given by 'batched_max_rel_diff'.
+    """
+    with profiling.Profiler() as profiler:
+        for _ in range(repeat):
+            outputs = _run_stages(y)
+        times = profiler.report()
+    with profiling.Profiler(trace_memory=True) as profiler:
+        _run_stages(y)
+        memory = profiler.report()
+    results = {
+        stage: {
+            'time': min(times[stage]['times']),
+            'peak_traced': memory[stage]['peak_traced'],
+            'fingerprint': _fingerprint(outputs[stage]),
+        }
+        for stage in STAGES
+    }
+    segments = outputs['separate_sources']
+    segments_batched = outputs['separate_sources_batched']
+    assert len(segments) == len(segments_batched), \
+        (len(segments), len(segments_batched))
+    max_diff = 0.
+    max_amplitude = np.finfo(np.float64).tiny
+    for segment, segment_batched in zip(segments, segments_batched):
+        assert segment.shape == segment_batched.shape, \
+            (segment.shape, segment_batched.shape)
+        if len(segment) == 0:
+            continue
+        max_diff = max(max_diff, np.max(np.abs(segment - segment_batched)))
+        max_amplitude = max(max_amplitude, np.max(np.abs(segment)))
+    results['batched_max_rel_diff'] = float(max_diff / max_amplitude)
+    return results
+
+
+def compare(results, baseline, tolerances=None):
+    """
+    Compare the results of run_regression_workload with a baseline
+
+    Args:
+        results (dict):
+            Output of run_regression_workload
+        baseline (dict):
+            Baseline (see load_baseline)
+        tolerances (dict):
+            Tolerances (see TOLERANCES). Missing entries are taken from
+            TOLERANCES.
+
+    Returns:
+        List of dictionaries with the stage, the metric, the measured
+        value, the baseline value and whether the check passed ('ok')
+    """
+    tolerances = {**TOLERANCES, **(tolerances or {})}
+    assert baseline['workload'] == WORKLOAD, (
+        'The baseline was recorded for another workload. Update it with '
+        '--update.', baseline['workload'], WORKLOAD
+    )
+    comparison = []
+    for stage in STAGES:
+        measured = results[stage]
+        reference = baseline['stages'][stage]
+        time_ok = measured['time'] <= max(
+            tolerances['time'] * reference['time'], MIN_TIME
+        )
+        comparison.append({
+            'stage': stage, 'metric': 'time', 'value': measured['time'],
+            'baseline': reference['time'], 'ok': time_ok
+        })
+        comparison.append({
+            'stage': stage, 'metric': 'peak_traced',
+            'value': measured['peak_traced'],
+            'baseline': reference['peak_traced'],
+            'ok': measured['peak_traced']
+            <= tolerances['peak_traced'] * reference['peak_traced']
+        })
+        for key, value in measured['fingerprint'].items():
+            reference_value = reference['fingerprint'][key]
+            comparison.append({
+                'stage': stage, 'metric': f'fingerprint.{key}',
+                'value': value, 'baseline': reference_value,
+                'ok': bool(np.isclose(
+                    value, reference_value, rtol=tolerances['fingerprint'],
+                    atol=0
+                ))
+            })
+    return comparison
+
+
+def print_report(comparison):
+    """
+    Print the comparison of compare with the failed checks marked
+
+    Args:
+        comparison (list):
+            Output of compare
+    """
+    for entry in comparison:
+        status = 'ok' if entry['ok'] else 'REGRESSION'
+        ratio = entry['value'] / entry['baseline'] \
+            if entry['baseline'] != 0 else float('nan')
+        print(
+            f'{status:>10} {entry["stage"]:<26} {entry["metric"]:<24} '
+            f'{entry["value"]:.6g} (baseline {entry["baseline"]:.6g}, '
+            f'ratio {ratio:.3f})',
+            flush=True
+        )
+
+
+@click.command()
+@click.option(
+    '--update',
+    is_flag=True,
+    help='Store the results as new baseline instead of comparing them.'
+)
+@click.option(
+    '--baseline',
+    type=str,
+    default=None,
+    help=('Path of the baseline. Defaults to the environment variable '
+          'LIBRIWASN_REGRESSION_BASELINE or the baseline of this package.')
+)
+@click.option(
+    '--repeat',
+    type=int,
+    default=3,
+    help='Number of runs used to measure the runtime.'
+)
+def main(update, baseline, repeat):
+    baseline_path = \
+        get_baseline_path() if baseline is None else Path(baseline)
+    with tempfile.TemporaryDirectory() as data_dir:
+        y = prepare_workload(data_dir)
+    results = run_regression_workload(y, repeat=repeat)
+    print(
+        f'Maximum relative difference between batched and non-batched '
+        f'beamforming: {results["batched_max_rel_diff"]:.3g}', flush=True
+    )
+    assert results['batched_max_rel_diff'] <= TOLERANCES['batched'], \
+        results['batched_max_rel_diff']
+    if update:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        pb.io.dump_json({
+            'environment': get_environment(),
+            'workload': WORKLOAD,
+            'repeat': repeat,
+            'stages': {stage: results[stage] for stage in STAGES},
+        }, baseline_path)
+        print(f'Wrote {baseline_path}', flush=True)
+        return
+    baseline = load_baseline(baseline_path)
+    assert baseline is not None, (
+        f'There is no baseline at {baseline_path}. Create it with --update.'
+    )
+    print_environment_differences(baseline)
+    comparison = compare(results, baseline)
+    print_report(comparison)
+    if not all([entry['ok'] for entry in comparison]):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+"""
+Benchmark the processing stages of the reference system on synthetic
+meetings (see libriwasn.benchmark.synthetic) of several sizes. The results
+are written to a json file, such that they can be compared across versions.
+
+Example calls:
+python -m libriwasn.benchmark.run --output benchmark.json
+python -m libriwasn.benchmark.run --sizes small --sizes medium --repeat 3 --output benchmark.json
+
+Call 'python -m libriwasn.benchmark.run --help' to get an overview of all options
+"""
+from importlib.metadata import PackageNotFoundError, version
+import os
+from pathlib import Path
+import platform
+import subprocess
+import tempfile
+import time
+
+import click
+import numpy as np
+import paderbox as pb
+
+from libriwasn.benchmark.synthetic import generate_meeting
+from libriwasn.io.audioread import load_signals
+from libriwasn.mask_estimation.cacgmm import get_tf_masks
+from libriwasn.mask_estimation.initialization import get_initialization
+from libriwasn import profiling
+from libriwasn.source_extraction.separation import separate_sources
+from libriwasn.synchronization.sro import compensate_for_sro, estimate_sros
+
+
+# Packages whose versions are recorded with the results (see
+# get_environment), since they affect the runtime or the outputs
+PACKAGES = [
+    'numpy', 'scipy', 'einops', 'paderbox', 'pb_bss', 'paderwasn', 'torch',
+    'espnet'
+]
+# Parameters of the synthetic meetings (see generate_meeting)
+SIZES = {
+    'tiny': dict(
+        num_devices=2, num_channels=2, num_speakers=2, duration=20,
+        overlap_ratio=.2
+    ),
+    'small': dict(
+        num_devices=2, num_channels=4, num_speakers=4, duration=60,
+        overlap_ratio=.2
+    ),
+    'medium': dict(
+        num_devices=4, num_channels=4, num_speakers=6, duration=180,
+        overlap_ratio=.2
+    ),
+    'large': dict(
+        num_devices=4, num_channels=4, num_speakers=8, duration=600,
+        overlap_ratio=.2
+    ),
+}
+
+
+def _get_segment_audio():
+    # The ASR dependencies are optional (see setup.py)
+    try:
+        from libriwasn.asr.espnet_wrapper import segment_audio
+    except ImportError:
+        return None
+    return segment_audio
+
+
+def get_environment():
+    """
+    Get information about the software and the hardware, which is needed to
+    compare benchmark results
+
+    Returns:
+        Dictionary with the versions of libriwasn, Python and the packages
+        in PACKAGES (None if not installed), the git commit of libriwasn (if
+        available), the platform, the processor and the number of CPU cores
+    """
+    try:
+        libriwasn_version = version('libriwasn')
+    except PackageNotFoundError:
+        libriwasn_version = None
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+            cwd=Path(__file__).parent, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    packages = {}
+    for package in PACKAGES:
+        try:
+            packages[package] = version(package)
+        except PackageNotFoundError:
+            packages[package] = None
+    return {
+        'libriwasn': libriwasn_version,
+        'commit': commit,
+        'python': platform.python_version(),
+        'packages': packages,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def run_pipeline(example, num_channels):
+    """
+    Run the processing stages of the reference system on a (synthetic)
+    meeting. Each stage is recorded if a profiler is active (see
+    libriwasn.profiling).
+
+    Args:
+        example (dict):
+            Meeting generated by generate_meeting
+        num_channels (int):
+            Number of channels per device
+
+    Returns:
+        Dictionary with the outputs of the stages
+    """
+    devices = list(example['audio_path']['observation'].keys())
+    with profiling.stage('load_signals'):
+        sigs = load_signals(
+            example, ref_device=devices[0], single_ch=False, same_len=True
+        )
+    # The SROs are estimated between the first channels of the devices and
+    # all channels of a device are compensated with its SRO (see
+    # load_synchronized_signals).
+    with profiling.stage('estimate_sros'):
+        sros = estimate_sros(sigs[::num_channels])
+    with profiling.stage('compensate_for_sros'):
+        synced_sigs = np.zeros_like(sigs)
+        synced_sigs[:num_channels] = sigs[:num_channels]
+        for device_id, sro in enumerate(sros, 1):
+            for ch in range(
+                    device_id * num_channels, (device_id + 1) * num_channels
+            ):
+                compensate_for_sro(sigs[ch], sro, out=synced_sigs[ch])
+    del sigs
+    with profiling.stage('stft'):
+        y = pb.transform.stft(synced_sigs)
+    with profiling.stage('get_initialization'):
+        mm_init, mm_guide = get_initialization(y)
+    with profiling.stage('get_tf_masks'):
+        masks, priors = get_tf_masks(y, mm_init, mm_guide)
+    del mm_init, mm_guide
+    with profiling.stage('separate_sources'):
+        sig_segments, segment_onsets = separate_sources(y, masks, priors)
+    outputs = {
+        'sros': sros,
+        'synced_sigs': synced_sigs,
+        'masks': masks,
+        'priors': priors,
+        'sig_segments': sig_segments,
+        'segment_onsets': segment_onsets,
+    }
+    segment_audio = _get_segment_audio()
+    if segment_audio is not None:
+        # The whole meeting is longer than the maximum segment length of the
+        # ASR system and contains many pauses to cut at.
+        with profiling.stage('segment_audio'):
+            outputs['asr_segments'] = segment_audio(synced_sigs[0])
+    return outputs
+
+
+def run_benchmarks(
+        sizes=('tiny', 'small'), repeat=1, data_dir=None, trace_memory=False,
+        seed=0
+):
+    """
+    Benchmark the processing stages (see run_pipeline) on synthetic meetings
+    of several sizes
+
+    Args:
+        sizes (list):
+            Names of the sizes (see SIZES)
+        repeat (int):
+            Number of runs per size
+        data_dir (str, Path):
+            Directory where the synthetic meetings are stored. Defaults to a
+            temporary directory, which is removed afterwards.
+        trace_memory (bool):
+            If True, trace the memory allocations (see Profiler)
+        seed (int):
+            Seed used to generate the meetings
+
+    Returns:
+        Dictionary with the environment (see get_environment) and the results
+        per size containing the parameters of the meeting and the report of
+        the profiler (see Profiler.report) extended by the median duration
+        ('median_time') and the minimum duration ('min_time') of each stage
+    """
+    results = {
+        'environment': get_environment(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'repeat': repeat,
+        'trace_memory': trace_memory,
+        'results': {},
+    }
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if data_dir is None:
+            data_dir = tmp_dir
+        for size in sizes:
+            params = SIZES[size]
+            print(f'Benchmark {size}: {params}', flush=True)
+            example = generate_meeting(
+                Path(data_dir) / size, seed=seed, example_id=size, **params
+            )
+            with profiling.Profiler(trace_memory=trace_memory) as profiler:
+                for _ in range(repeat):
+                    run_pipeline(example, params['num_channels'])
+                report = profiler.report()
+            for stats in report.values():
+                stats['median_time'] = float(np.median(stats['times']))
+                stats['min_time'] = float(np.min(stats['times']))
+            results['results'][size] = {
+                'params': params,
+                'num_samples': max(
+                    example['num_samples']['observation'].values()
+                ),
+                'stages': report,
+            }
+            profiling.print_summary(profiling.summarize_reports(
+                {size: report}
+            ))
+    return results
+
+
+@click.command()
+@click.option(
+    '--sizes',
+    type=click.Choice(list(SIZES.keys())),
+    multiple=True,
+    default=['tiny', 'small'],
+    help='Sizes of the synthetic meetings. Can be given several times.'
+)
+@click.option(
+    '--repeat',
+    type=int,
+    default=1,
+    help='Number of runs per size.'
+)
+@click.option(
+    '--output',
+    type=str,
+    default='benchmark.json',
+    help='Path of the json file the results are written to.'
+)
+@click.option(
+    '--data_dir',
+    type=str,
+    default=None,
+    help=('Directory where the synthetic meetings are stored. Defaults to a '
+          'temporary directory.')
+)
+@click.option(
+    '--trace_memory',
+    type=bool,
+    default=False,
+    help=('Trace the memory allocations via tracemalloc, which slows down '
+          'the processing.')
+)
+@click.option(
+    '--seed',
+    type=int,
+    default=0,
+    help='Seed used to generate the synthetic meetings.'
+)
+def main(sizes, repeat, output, data_dir, trace_memory, seed):
+    results = run_benchmarks(
+        sizes=sizes, repeat=repeat, data_dir=data_dir,
+        trace_memory=trace_memory, seed=seed
+    )
+    output = Path(output).absolute()
+    output.parent.mkdir(parents=True, exist_ok=True)
+    pb.io.dump_json(results, output)
+    print(f'Wrote {output}', flush=True)
+
+
+if __name__ == '__main__':
+    main()
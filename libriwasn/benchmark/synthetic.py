@@ -0,0 +1,183 @@
+from pathlib import Path
+
+import numpy as np
+import paderbox as pb
+import scipy.signal
+
+
+def _get_speech_like_signal(num_samples, rng, sample_rate=16000):
+    # White noise shaped by three random resonances (formants) and modulated
+    # by a syllable-rate envelope with short pauses, such that the VAD-based
+    # processing (e.g., the SRO estimation) behaves similar as for speech.
+    denominator = np.ones(1)
+    for formant in rng.uniform(300, 3000, 3):
+        omega = 2 * np.pi * formant / sample_rate
+        denominator = np.convolve(
+            denominator, [1, -2 * .7 * np.cos(omega), .7 ** 2]
+        )
+    sig = scipy.signal.lfilter(
+        [1], denominator, rng.standard_normal(num_samples)
+    )
+    envelope = []
+    while len(envelope) < num_samples:
+        syllable_len = int(rng.uniform(.1, .4) * sample_rate)
+        amplitude = 0 if rng.uniform() < .2 else rng.uniform(.2, 1)
+        envelope += [amplitude] * syllable_len
+    envelope = np.convolve(envelope[:num_samples], np.hanning(401), 'same')
+    sig *= envelope
+    return sig / np.max(np.abs(sig))
+
+
+def _get_rir(distance, rng, sample_rate=16000, rir_len=2048, t60=.3):
+    # Direct path with the delay and the attenuation given by the distance
+    # followed by an exponentially decaying random reverberation tail
+    delay = int(round(distance / 343 * sample_rate))
+    rir = np.zeros(delay + rir_len)
+    rir[delay] = 1 / max(distance, .1)
+    decay = np.exp(-6.9 * np.arange(1, rir_len) / (t60 * sample_rate))
+    rir[delay + 1:] = .01 * rng.standard_normal(rir_len - 1) * decay
+    return rir
+
+
+def _get_schedule(duration, num_speakers, overlap_ratio, rng, sample_rate):
+    # The utterances follow each other such that each utterance overlaps with
+    # the previous one by overlap_ratio of its length or is separated from it
+    # by a short pause.
+    onsets = []
+    num_samples = []
+    speaker_ids = []
+    offset = 0
+    speaker_id = None
+    while True:
+        utt_len = int(rng.uniform(2, 8) * sample_rate)
+        if len(onsets) == 0:
+            onset = int(rng.uniform(.1, .5) * sample_rate)
+        elif overlap_ratio > 0 and num_speakers > 1:
+            overlap = min(int(overlap_ratio * utt_len), num_samples[-1] // 2)
+            onset = offset - overlap
+        else:
+            onset = offset + int(rng.uniform(.1, 1) * sample_rate)
+        if onset + utt_len > duration * sample_rate:
+            break
+        speaker_id = rng.choice(
+            [spk for spk in range(num_speakers) if spk != speaker_id]
+            if num_speakers > 1 else [0]
+        )
+        onsets.append(onset)
+        num_samples.append(utt_len)
+        speaker_ids.append(int(speaker_id))
+        offset = onset + utt_len
+    return onsets, num_samples, speaker_ids
+
+
+def generate_meeting(
+        storage_dir, num_devices=4, num_channels=4, num_speakers=4,
+        duration=60, overlap_ratio=.2, sros=None, snr=40, sample_rate=16000,
+        seed=0, example_id='synthetic'
+):
+    """
+    Generate a synthetic meeting recorded by several asynchronous devices.
+    The speakers and the devices are placed randomly in a room. The speech
+    of each speaker is replaced by speech-like noise (see
+    _get_speech_like_signal) and convolved with a synthetic room impulse
+    response per channel. Each device samples the meeting with a sampling
+    rate offset (SRO) w.r.t. the first device. This allows to run (and
+    benchmark) the processing without downloading LibriWASN / LibriCSS.
+
+    Args:
+        storage_dir (str, Path):
+            Directory where the recordings of the devices are stored
+        num_devices (int):
+            Number of devices
+        num_channels (int):
+            Number of channels per device
+        num_speakers (int):
+            Number of speakers
+        duration (float):
+            Duration of the meeting in seconds
+        overlap_ratio (float):
+            Fraction of each utterance which overlaps with the previous
+            utterance (0 means no overlap)
+        sros (list):
+            SRO of each device w.r.t. the first device in parts per million
+            (ppm). The SRO of the first device has to be 0. Defaults to SROs
+            evenly spaced between 0 and 100 ppm.
+        snr (float):
+            Signal-to-noise ratio of the sensor noise in dB
+        sample_rate (int):
+            Sampling rate
+        seed (int):
+            Seed of the random number generator
+        example_id (str):
+            ID of the meeting
+
+    Returns:
+        Entry of the meeting in the style of the libriwasn json (see
+        libriwasn.database.create_json). The devices are named 'device0',
+        'device1', ... with 'device0' being the reference device. The
+        injected SROs are given by 'sro'.
+    """
+    if sros is None:
+        sros = np.linspace(0, 100, num_devices)
+    assert len(sros) == num_devices, (len(sros), num_devices)
+    assert sros[0] == 0, sros
+    rng = np.random.default_rng(seed)
+    storage_dir = Path(storage_dir)
+    storage_dir.mkdir(parents=True, exist_ok=True)
+
+    onsets, num_samples, speaker_ids = _get_schedule(
+        duration, num_speakers, overlap_ratio, rng, sample_rate
+    )
+    room_size = np.array([6., 5.])
+    speaker_pos = rng.uniform(.5, room_size - .5, (num_speakers, 2))
+    device_pos = rng.uniform(.5, room_size - .5, (num_devices, 2))
+    # The channels of a device are arranged in a circle with a radius of 5cm
+    angles = 2 * np.pi * np.arange(num_channels) / num_channels
+    mic_offsets = .05 * np.stack([np.cos(angles), np.sin(angles)], -1)
+
+    total_len = int(duration * sample_rate)
+    devices = [f'device{device_id}' for device_id in range(num_devices)]
+    example = {
+        'example_id': example_id,
+        'session': example_id,
+        'overlap_condition': 'synthetic',
+        'audio_path': {'observation': {}},
+        'onset': {'original_source': onsets},
+        'num_samples': {'original_source': num_samples, 'observation': {}},
+        'speaker_id': [str(spk) for spk in speaker_ids],
+        'sro': {},
+    }
+    utterances = [
+        _get_speech_like_signal(utt_len, rng, sample_rate)
+        for utt_len in num_samples
+    ]
+    for device_id, device in enumerate(devices):
+        image = np.zeros((num_channels, total_len))
+        for ch in range(num_channels):
+            mic_pos = device_pos[device_id] + mic_offsets[ch]
+            rirs = [
+                _get_rir(np.linalg.norm(pos - mic_pos), rng, sample_rate)
+                for pos in speaker_pos
+            ]
+            for utt, onset, spk in zip(utterances, onsets, speaker_ids):
+                reverberant = scipy.signal.fftconvolve(utt, rirs[spk])
+                reverberant = reverberant[:total_len - onset]
+                image[ch, onset:onset + len(reverberant)] += reverberant
+        noise_power = np.mean(image ** 2) / 10 ** (snr / 10)
+        image += np.sqrt(noise_power) * rng.standard_normal(image.shape)
+
+        # Sample the meeting with the clock of the device
+        sro = sros[device_id]
+        if sro != 0:
+            time = np.arange(total_len) * (1 + sro * 1e-6)
+            time = time[time <= total_len - 1]
+            image = np.stack([
+                np.interp(time, np.arange(total_len), image_ch)
+                for image_ch in image
+            ])
+        audio_path = storage_dir / f'{example_id}_{device}.wav'
+        pb.io.dump_audio(image, audio_path)
+        example['audio_path']['observation'][device] = str(audio_path)
+        example['num_samples']['observation'][device] = image.shape[-1]
+        example['sro'][device] = float(sro)
+    return example
@@ -0,0 +1,73 @@
+"""
+Performance regression check of the mask estimation and the beamforming for
+pytest (see libriwasn.benchmark.regression). The checks are skipped if no
+baseline was recorded. Set the environment variable
+LIBRIWASN_REQUIRE_BASELINE=1 (e.g., in a CI job on the machine of the
+baseline) such that they fail instead.
+
+python -m pytest libriwasn/benchmark/test_regression.py
+"""
+import os
+
+import pytest
+
+pytest.importorskip('pb_bss')
+from libriwasn.benchmark import regression  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def baseline():
+    baseline = regression.load_baseline()
+    if baseline is None:
+        msg = (
+            f'There is no baseline at {regression.get_baseline_path()}. '
+            f'Create it with: python -m libriwasn.benchmark.regression '
+            f'--update'
+        )
+        if os.environ.get('LIBRIWASN_REQUIRE_BASELINE', '0') == '1':
+            pytest.fail(msg)
+        pytest.skip(msg)
+    return baseline
+
+
+@pytest.fixture(scope='module')
+def results(tmp_path_factory):
+    y = regression.prepare_workload(tmp_path_factory.mktemp('regression'))
+    return regression.run_regression_workload(y)
+
+
+@pytest.fixture(scope='module')
+def comparison(baseline, results):
+    regression.print_environment_differences(baseline)
+    comparison = regression.compare(results, baseline)
+    regression.print_report(comparison)
+    return comparison
+
+
+def _check(comparison, stage, metric):
+    failed = [
+        entry for entry in comparison
+        if entry['stage'] == stage and entry['metric'].startswith(metric)
+        and not entry['ok']
+    ]
+    assert len(failed) == 0, failed
+
+
+@pytest.mark.parametrize('stage', regression.STAGES)
+def test_runtime(comparison, stage):
+    _check(comparison, stage, 'time')
+
+
+@pytest.mark.parametrize('stage', regression.STAGES)
+def test_peak_memory(comparison, stage):
+    _check(comparison, stage, 'peak_traced')
+
+
+@pytest.mark.parametrize('stage', regression.STAGES)
+def test_outputs(comparison, stage):
+    _check(comparison, stage, 'fingerprint')
+
+
+def test_batched_beamforming_is_equivalent(results):
+    assert results['batched_max_rel_diff'] \
+        <= regression.TOLERANCES['batched'], results['batched_max_rel_diff']
@@ -0,0 +1,28 @@
+"""
+Check that segment_audio stays fast for long, pause-rich signals and that
+the segments cover the signal. The choice of the cuts is checked in
+libriwasn/test_utils.py (see get_max_min_cuts).
+
+python -m pytest libriwasn/benchmark/test_segment_audio.py
+"""
+import time
+
+import numpy as np
+import pytest
+
+
+def test_segment_audio_long_input():
+    espnet_wrapper = pytest.importorskip('libriwasn.asr.espnet_wrapper')
+    # One hour of bursts of noise separated by pauses
+    rng = np.random.default_rng(0)
+    sig = []
+    while sum([len(part) for part in sig]) < 3600 * 16000:
+        sig.append(rng.standard_normal(int(rng.uniform(.5, 4) * 16000)))
+        sig.append(np.zeros(int(rng.uniform(.3, 1) * 16000)))
+    sig = np.concatenate(sig)
+    start = time.perf_counter()
+    segments = espnet_wrapper.segment_audio(sig)
+    duration = time.perf_counter() - start
+    np.testing.assert_equal(np.concatenate(segments), sig)
+    assert min([len(segment) for segment in segments]) >= 16000
+    assert duration < 60, duration
@@ -1,6 +1,9 @@
 import paderbox as pb
 import numpy as np
 
+from libriwasn.profiling import stage
+
+
 def load_signals(
         example, devices=None, ref_device=None,
         single_ch=True, return_devices=False, same_len=False
@@ -95,4 +98,243 @@ def load_signals(
 
     if return_devices:
         return sigs, _devices
-    return sigs
\ No newline at end of file
+    return sigs
+
+
+def _resolve_devices(audio_paths, devices):
+    if devices is None:
+        return [device_id for device_id in audio_paths.keys()]
+    if isinstance(devices, str):
+        assert devices in audio_paths.keys()
+        return [devices, ]
+    return devices.copy()
+
+
+def _to_index(channels):
+    # Use a slice for contiguous channels such that indexing yields a view
+    if len(channels) > 0 and \
+            list(channels) == list(range(channels[0], channels[-1] + 1)):
+        return slice(channels[0], channels[-1] + 1)
+    return np.asarray(channels, dtype=int)
+
+
+def _read_channels(path, channels, out, block_size=2 ** 20):
+    # Read the given channels of an audio file block by block into out
+    # (Shape: number of channels x number of samples), such that only one
+    # block of all channels of the file is held in memory. Samples exceeding
+    # the length of out are dropped.
+    num_samples = min(pb.io.audioread.audio_length(path), out.shape[-1])
+    for start in range(0, num_samples, block_size):
+        stop = min(start + block_size, num_samples)
+        block = pb.io.load_audio(path, start=start, stop=stop)
+        if block.ndim == 1:
+            block = block[None]
+        out[:, start:stop] = block[channels]
+    return out
+
+
+def load_synchronized_signals(
+        example, device_selections, ref_device='asnupb4', memmap_path=None,
+        sros=None, return_sros=False, allocate=None
+):
+    """
+    Load the union of several device selections only once and synchronize
+    all signals w.r.t. the first channel of the reference device. The
+    channels belonging to each selection are obtained by indexing the
+    returned signals. This avoids loading and synchronizing devices twice
+    if, e.g., different devices are used for mask estimation and
+    beamforming.
+
+    Args:
+        example (dict):
+            Entry of libriwasn json specifying the parameters of the current
+            example which needs to include the pathes to the audio files.
+        device_selections (list):
+            List of tuples (devices, single_ch), where devices and single_ch
+            are defined as for load_signals.
+        ref_device (str):
+            Reference device used for synchronization. Its signals are
+            placed first.
+        memmap_path (str, Path):
+            If given, the synchronized signals are written into a
+            memory-mapped .npy file at this path instead of being kept in
+            memory. The audio files are then read block-wise and the signals
+            are synchronized channel by channel, such that only a few
+            single-channel signals (the reference signal and the channel
+            which is currently synchronized) are held in memory at full
+            length.
+        allocate (callable):
+            If given, the synchronized signals are written into the float64
+            array returned by allocate(shape), e.g., an array in shared
+            memory, instead of being kept in memory. The signals are read as
+            for memmap_path.
+        sros (dict):
+            Previously estimated SROs per device (see return_sros). The SROs
+            are only estimated for devices which are not contained.
+        return_sros (bool):
+            If True, additionally return the SROs per device w.r.t. the
+            reference device.
+
+    Returns:
+        sigs (numpy.ndarray):
+            Synchronized signals of all loaded channels (Shape: number of
+            channels x length of the reference signal)
+        channels (list):
+            Indices of the channels of each device selection with the
+            reference device in the first place. A slice is used if the
+            channels are contiguous, such that indexing yields a view.
+        sros (dict):
+            SRO of each device except for the reference device. Only returned
+            if return_sros is True.
+    """
+    # Imported here such that load_signals can be used without paderwasn,
+    # which is only required for the synchronization
+    from libriwasn.synchronization.sro import (
+        compensate_for_sro,
+        estimate_sros
+    )
+
+    assert isinstance(example['audio_path']['observation'], dict)
+    audio_paths = example['audio_path']['observation']
+
+    # Decide which channels have to be loaded per device. The reference
+    # device is always needed for the synchronization.
+    load_all_channels = {ref_device: False}
+    selections = []
+    for devices, single_ch in device_selections:
+        devices = _resolve_devices(audio_paths, devices)
+        if ref_device in devices:
+            devices.remove(ref_device)
+            devices = [ref_device, ] + devices
+        if type(single_ch) != list:
+            single_ch = [single_ch for i in range(len(devices))]
+        assert len(single_ch) == len(devices)
+        for device, use_single_channel in zip(devices, single_ch):
+            load_all_channels[device] = \
+                load_all_channels.get(device, False) or not use_single_channel
+        selections.append(list(zip(devices, single_ch)))
+
+    in_memory = memmap_path is None and allocate is None
+    if in_memory:
+        device_sigs = {}
+        for device, all_channels in load_all_channels.items():
+            with stage('load'):
+                sigs_device = pb.io.load_audio(audio_paths[device])
+            if sigs_device.ndim == 1:
+                sigs_device = sigs_device[None]
+            elif not all_channels:
+                sigs_device = sigs_device[:1]
+            device_sigs[device] = sigs_device
+        num_device_channels = {
+            device: len(sigs_device)
+            for device, sigs_device in device_sigs.items()
+        }
+        num_samples = device_sigs[ref_device].shape[-1]
+    else:
+        # Only the shapes are read here. The signals are read channel by
+        # channel below.
+        num_device_channels = {
+            device: pb.io.audioread.audio_channels(audio_paths[device])
+            if all_channels else 1
+            for device, all_channels in load_all_channels.items()
+        }
+        num_samples = pb.io.audioread.audio_length(audio_paths[ref_device])
+
+    first_channel = {}
+    num_channels = 0
+    for device, num_channels_device in num_device_channels.items():
+        first_channel[device] = num_channels
+        num_channels += num_channels_device
+    shape = (num_channels, num_samples)
+    if allocate is not None:
+        sigs = allocate(shape)
+        assert sigs.shape == shape and sigs.dtype == np.float64, \
+            (sigs.shape, sigs.dtype)
+    elif memmap_path is None:
+        sigs = np.zeros(shape)
+    else:
+        sigs = np.lib.format.open_memmap(
+            memmap_path, mode='w+', dtype=np.float64, shape=shape
+        )
+
+    # All channels of a device are compensated with the SRO which is
+    # estimated between its first channel and the reference channel.
+    sros = {} if sros is None else dict(sros)
+    if in_memory:
+        ref_sig = device_sigs[ref_device][0]
+        devices = [
+            device for device in device_sigs
+            if device != ref_device and device not in sros
+        ]
+        if len(devices) > 0:
+            with stage('sro_estimation'):
+                sros.update(zip(devices, estimate_sros(
+                    [ref_sig] + [device_sigs[device][0] for device in devices]
+                )))
+        for device in list(device_sigs.keys()):
+            sigs_device = device_sigs.pop(device)
+            ch = first_channel[device]
+            if device == ref_device:
+                length = min(sigs_device.shape[-1], shape[-1])
+                sigs[ch:ch + len(sigs_device), :length] = \
+                    sigs_device[:, :length]
+            else:
+                # Each channel is compensated directly into its row of sigs,
+                # such that neither the reference signal nor the synchronized
+                # signals of the device are copied.
+                with stage('sro_compensation'):
+                    for i, sig in enumerate(sigs_device):
+                        compensate_for_sro(
+                            sig, sros[device], out=sigs[ch + i]
+                        )
+            del sigs_device  # reduce memory consumption
+    else:
+        # The signals are written into the memory-mapped file (or the
+        # allocated array) one channel at a time. Hence, besides one block of
+        # a file, only the reference signal and one channel of another device
+        # are held in memory at full length, which are needed for the SRO
+        # estimation and compensation.
+        ch = first_channel[ref_device]
+        with stage('load'):
+            _read_channels(
+                audio_paths[ref_device],
+                list(range(num_device_channels[ref_device])),
+                out=sigs[ch:ch + num_device_channels[ref_device]]
+            )
+        ref_sig = np.array(sigs[ch])
+        for device, num_channels_device in num_device_channels.items():
+            if device == ref_device:
+                continue
+            path = audio_paths[device]
+            ch = first_channel[device]
+            for i in range(num_channels_device):
+                with stage('load'):
+                    sig = _read_channels(
+                        path, [i],
+                        out=np.zeros((1, pb.io.audioread.audio_length(path)))
+                    )[0]
+                if i == 0 and device not in sros:
+                    with stage('sro_estimation'):
+                        sros[device] = estimate_sros([ref_sig, sig])[0]
+                with stage('sro_compensation'):
+                    compensate_for_sro(sig, sros[device], out=sigs[ch + i])
+                del sig  # reduce memory consumption
+        del ref_sig
+    sros = {
+        device: sro for device, sro in sros.items()
+        if device in num_device_channels and device != ref_device
+    }
+
+    channels = []
+    for selection in selections:
+        selected = []
+        for device, use_single_channel in selection:
+            ch = first_channel[device]
+            if use_single_channel:
+                selected.append(ch)
+            else:
+                selected += list(range(ch, ch + num_device_channels[device]))
+        channels.append(_to_index(selected))
+    if return_sros:
+        return sigs, channels, sros
+    return sigs, channels
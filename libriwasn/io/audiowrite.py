@@ -0,0 +1,168 @@
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+import os
+from pathlib import Path
+import threading
+
+import numpy as np
+import paderbox as pb
+
+
+class AudioWriter:
+    def __init__(self, num_workers=4, max_pending=64):
+        """
+        Write audio files in background threads such that the encoding and
+        the writing of the files overlap with the processing of the next
+        example. The number of pending writes is bounded, which also bounds
+        the memory held by signals that were not written yet: submit blocks
+        until a slot is free.
+
+        Args:
+            num_workers (int):
+                Number of threads used to write the files. If 0, the files
+                are written synchronously when they are submitted.
+            max_pending (int):
+                Maximum number of submitted but not yet written files
+        """
+        assert max_pending >= 1, max_pending
+        self.num_workers = num_workers
+        if num_workers > 0:
+            self._executor = ThreadPoolExecutor(num_workers)
+        else:
+            self._executor = None
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._futures = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        elif self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    def _write(self, sig, path, kwargs):
+        # Write to a temporary file first, such that an interrupted run never
+        # leaves a truncated audio file behind.
+        path = Path(path)
+        tmp_path = path.with_name(f'.{path.name}')
+        try:
+            pb.io.dump_audio(sig, tmp_path, **kwargs)
+            os.replace(tmp_path, path)
+        finally:
+            self._slots.release()
+
+    def submit(self, sig, path, **kwargs):
+        """
+        Schedule writing a signal to an audio file
+
+        Args:
+            sig (numpy.ndarray):
+                Signal to be written. It must not be modified until the
+                returned future is done.
+            path (str, Path):
+                Path of the audio file
+            **kwargs:
+                Additional arguments of paderbox.io.dump_audio
+
+        Returns:
+            concurrent.futures.Future of the write
+        """
+        self._slots.acquire()
+        if self._executor is None:
+            future = Future()
+            try:
+                self._write(sig, path, kwargs)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(None)
+        else:
+            future = self._executor.submit(self._write, sig, path, kwargs)
+        future.path = path
+        # Only keep the futures which are pending or failed
+        self._futures = [
+            _future for _future in self._futures
+            if not _future.done() or _future.exception() is not None
+        ]
+        self._futures.append(future)
+        return future
+
+    def wait(self, futures=None):
+        """
+        Wait until the given writes (defaults to all submitted writes) are
+        finished and raise an error if any of them failed. All failed
+        writes are reported before the error is raised.
+
+        Args:
+            futures (list):
+                Futures returned by submit
+        """
+        if futures is None:
+            futures = self._futures
+        wait(futures)
+        failed = [future for future in futures if future.exception()]
+        for future in failed:
+            print(
+                f'Failed to write {future.path}: {future.exception()!r}',
+                flush=True
+            )
+        done = set(futures)
+        self._futures = [
+            future for future in self._futures if future not in done
+        ]
+        if len(failed) > 0:
+            raise RuntimeError(
+                f'{len(failed)} of {len(futures)} audio files could not be '
+                f'written'
+            ) from failed[0].exception()
+
+    def flush(self):
+        """
+        Wait until all submitted writes are finished (see wait)
+        """
+        self.wait()
+
+    def close(self):
+        """
+        Wait until all submitted writes are finished (see wait) and stop the
+        threads
+        """
+        try:
+            self.flush()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+
+
+def pack_segments(segments):
+    """
+    Concatenate signal segments such that they can be stored in a single
+    audio file (container) instead of one file per segment. Each segment is
+    normalized individually as paderbox.io.dump_audio would do it, hence the
+    container has to be written with normalize=False.
+
+    Args:
+        segments (list):
+            List of signal segments
+
+    Returns:
+        container (numpy.ndarray):
+            Concatenated normalized segments
+        offsets (numpy.ndarray):
+            Start and stop sample of each segment within the container
+            (Shape: number of segments x 2)
+    """
+    # Correction, because the allowed values of int16 audio files are in the
+    # range [-1, 1) (see paderbox.io.dump_audio).
+    correction = (2 ** 15 - 1) / (2 ** 15)
+    lengths = np.array([len(segment) for segment in segments], dtype=np.int64)
+    offsets = np.stack(
+        [np.cumsum(lengths) - lengths, np.cumsum(lengths)], axis=-1
+    ).reshape(-1, 2)
+    container = np.zeros(np.sum(lengths))
+    for segment, (start, stop) in zip(segments, offsets):
+        max_abs = np.amax(np.abs(segment)) if len(segment) > 0 else 0
+        if max_abs > 0:
+            container[start:stop] = segment * (correction / max_abs)
+    return container, offsets
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import paderbox as pb
+
+
+def get_checkpoint_dir(storage_dir, example_id):
+    """
+    Get the directory where the checkpoints of an example are stored
+
+    Args:
+        storage_dir (str, Path):
+            Storage directory of the experiment
+        example_id (str):
+            ID of the example
+
+    Returns:
+        Checkpoint directory of the example
+    """
+    return Path(storage_dir) / 'checkpoints' / example_id
+
+
+def validate_checkpoints(checkpoint_dir, config):
+    """
+    Ensure that the checkpoints of an example were created with the given
+    configuration. A hash of the configuration is stored in the checkpoint
+    directory. If the checkpoints were created with another configuration
+    (or without a stored configuration), they are removed, such that the
+    example is processed again instead of reusing stale results.
+
+    Args:
+        checkpoint_dir (Path):
+            Checkpoint directory of the example (see get_checkpoint_dir)
+        config (dict):
+            JSON-serializable parameters which affect the checkpoints
+
+    Returns:
+        True if existing checkpoints were removed and False otherwise
+    """
+    config_hash = hashlib.sha256(
+        json.dumps(config, sort_keys=True).encode()
+    ).hexdigest()
+    file = checkpoint_dir / 'config.json'
+    if file.exists() and pb.io.load_json(file)['hash'] == config_hash:
+        return False
+    removed = False
+    if checkpoint_dir.exists():
+        for stale_file in checkpoint_dir.iterdir():
+            if stale_file.is_file():
+                stale_file.unlink()
+                removed = True
+    checkpoint_dir.mkdir(parents=True, exist_ok=True)
+    tmp_file = checkpoint_dir / 'config.json.tmp'
+    pb.io.dump_json({'hash': config_hash, 'config': config}, tmp_file)
+    os.replace(tmp_file, file)
+    return removed
+
+
+def dump_stage(checkpoint_dir, stage, **arrays):
+    """
+    Store the results of a processing stage of an example. The file is first
+    written to a temporary file which is renamed afterwards, such that an
+    interrupted run never leaves a corrupted checkpoint.
+
+    Args:
+        checkpoint_dir (Path):
+            Checkpoint directory of the example (see get_checkpoint_dir)
+        stage (str):
+            Name of the stage, e.g., 'sros' or 'masks'
+        **arrays:
+            Arrays to be stored
+    """
+    checkpoint_dir.mkdir(parents=True, exist_ok=True)
+    file = checkpoint_dir / f'{stage}.npz'
+    tmp_file = checkpoint_dir / f'{stage}.npz.tmp'
+    with open(tmp_file, 'wb') as fid:
+        np.savez(fid, **arrays)
+    os.replace(tmp_file, file)
+
+
+def load_stage(checkpoint_dir, stage):
+    """
+    Load the results of a processing stage of an example
+
+    Args:
+        checkpoint_dir (Path):
+            Checkpoint directory of the example (see get_checkpoint_dir)
+        stage (str):
+            Name of the stage
+
+    Returns:
+        Dictionary of the stored arrays or None if the stage was not
+        completed yet
+    """
+    file = checkpoint_dir / f'{stage}.npz'
+    if not file.exists():
+        return None
+    with np.load(file) as data:
+        return {key: data[key] for key in data.files}
+
+
+def dump_record(checkpoint_dir, record):
+    """
+    Store the final record of an example (e.g., the entries of its segments
+    for the per_utt.json), which also marks the example as completed
+
+    Args:
+        checkpoint_dir (Path):
+            Checkpoint directory of the example (see get_checkpoint_dir)
+        record (dict):
+            Record of the example
+    """
+    tmp_file = checkpoint_dir / 'record.json.tmp'
+    pb.io.dump_json(record, tmp_file)
+    os.replace(tmp_file, checkpoint_dir / 'record.json')
+
+
+def load_record(checkpoint_dir):
+    """
+    Load the final record of an example
+
+    Args:
+        checkpoint_dir (Path):
+            Checkpoint directory of the example (see get_checkpoint_dir)
+
+    Returns:
+        Record of the example or None if the example was not completed yet
+    """
+    file = checkpoint_dir / 'record.json'
+    if not file.exists():
+        return None
+    return pb.io.load_json(file)
@@ -0,0 +1,298 @@
+import contextlib
+import fcntl
+import hashlib
+import json
+from multiprocessing import resource_tracker, shared_memory
+from pathlib import Path
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from libriwasn.io.audioread import _to_index, load_synchronized_signals
+
+
+_HEADER_SIZE = 4096
+_PREFIX = 'libriwasn_'
+_SHM_DIR = Path('/dev/shm')
+
+
+def _open(name, create=False, size=0):
+    # The segments have to outlive the process which created them, such that
+    # they can be used by subsequent runs. Hence, they must not be unlinked
+    # by the resource tracker when the process terminates.
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(
+            name, create=create, size=size, track=False
+        )
+    shm = shared_memory.SharedMemory(name, create=create, size=size)
+    # Before Python 3.13, each segment is registered at the resource tracker.
+    # Only this segment is unregistered again.
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+def _unlink(shm):
+    if sys.version_info < (3, 13):
+        # Before Python 3.13, unlink unregisters the segment at the resource
+        # tracker, which requires that it is registered.
+        resource_tracker.register(shm._name, 'shared_memory')
+    shm.unlink()
+
+
+def _attach(name):
+    try:
+        shm = _open(name)
+    except FileNotFoundError:
+        return None
+    except ValueError:
+        # The segment was created but its size was not set yet, such that
+        # it cannot be mapped ('cannot mmap an empty file')
+        return None
+    if shm.size < _HEADER_SIZE or shm.buf[0] != 1:
+        # The segment is still being written
+        shm.close()
+        return None
+    return shm
+
+
+def _get_lock_file(name):
+    return Path(tempfile.gettempdir()) / f'{name}.lock'
+
+
+@contextlib.contextmanager
+def _lock(name, timeout):
+    # An advisory lock on a file is released by the kernel if the process
+    # holding it terminates. Hence, a killed process does not block the
+    # other processes. The (empty) lock file is kept, because removing it
+    # while another process waits for the lock would break the mutual
+    # exclusion (see remove_shared_signals).
+    start = time.time()
+    with open(_get_lock_file(name), 'a') as file:
+        while True:
+            try:
+                fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.time() - start > timeout:
+                    raise TimeoutError(
+                        f'The signals of the shared memory segment {name} '
+                        f'were not published within {timeout}s.'
+                    )
+                time.sleep(.1)
+        try:
+            yield
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+
+def _remove_incomplete(name):
+    # Remove a segment which was not completely written, e.g., because the
+    # loading process was killed. Must only be called while holding the lock.
+    try:
+        shm = _open(name)
+    except FileNotFoundError:
+        return
+    except ValueError:
+        # The size of the segment was never set, such that it cannot be
+        # opened. POSIX shared memory segments are files in /dev/shm on
+        # Linux (see remove_shared_signals).
+        (_SHM_DIR / name).unlink(missing_ok=True)
+        return
+    shm.close()
+    _unlink(shm)
+
+
+def get_shared_memory_name(example_id, device_selections, ref_device):
+    """
+    Get the name of the shared memory segment which holds the synchronized
+    signals of an example for a device selection
+
+    Args:
+        example_id (str):
+            ID of the example
+        device_selections (list):
+            See load_synchronized_signals
+        ref_device (str):
+            See load_synchronized_signals
+
+    Returns:
+        Name of the shared memory segment
+    """
+    key = json.dumps([example_id, device_selections, ref_device])
+    # POSIX limits the length of the names on some systems to 31 characters
+    return _PREFIX + hashlib.sha1(key.encode()).hexdigest()[:20]
+
+
+class _SharedSignals:
+    # Allocates the synchronized signals (see load_synchronized_signals) in
+    # a new shared memory segment, such that they are written directly into
+    # the segment without an intermediate copy.
+    def __init__(self, name):
+        self.name = name
+        self.shm = None
+
+    def __call__(self, shape):
+        nbytes = int(np.prod(shape)) * np.dtype(np.float64).itemsize
+        self.shm = _open(self.name, create=True, size=_HEADER_SIZE + nbytes)
+        return np.ndarray(
+            shape, np.float64, buffer=self.shm.buf, offset=_HEADER_SIZE
+        )
+
+
+def _publish(name, example, device_selections, ref_device, sros):
+    allocate = _SharedSignals(name)
+    try:
+        sigs, channels, sros = load_synchronized_signals(
+            example, device_selections, ref_device=ref_device, sros=sros,
+            return_sros=True, allocate=allocate
+        )
+        header = json.dumps({
+            'shape': sigs.shape,
+            'dtype': sigs.dtype.str,
+            'channels': [
+                np.arange(len(sigs))[_channels].tolist()
+                for _channels in channels
+            ]
+        }).encode()
+        assert len(header) + 16 <= _HEADER_SIZE, len(header)
+        del sigs
+        shm = allocate.shm
+        shm.buf[8:16] = len(header).to_bytes(8, 'little')
+        shm.buf[16:16 + len(header)] = header
+        # Mark the segment as complete
+        shm.buf[0] = 1
+    except BaseException:
+        # Other processes must not attach to an incomplete segment. The
+        # segment is only unlinked, because the traceback might still
+        # reference views of it.
+        if allocate.shm is not None:
+            _unlink(allocate.shm)
+        raise
+    return shm, sros
+
+
+def load_shared_synchronized_signals(
+        example, device_selections, ref_device='asnupb4', sros=None,
+        timeout=3600
+):
+    """
+    Load and synchronize the signals of an example (see
+    load_synchronized_signals) and publish them in POSIX shared memory.
+    Processes on the same node which need the same signals (e.g., other ranks
+    or subsequent runs with another config) attach to the published signals
+    without copying them instead of decoding and synchronizing them again.
+    If another process is currently loading the signals, this function waits
+    until they are published. The signals are written directly into the
+    shared memory, i.e., they are not held in memory twice while they are
+    published. If the loading process is killed, its lock is released and
+    the incomplete signals are loaded again by the next process.
+
+    The shared memory is not released when the processes terminate. Use
+    release_shared_signals with unlink=True, when the signals are not needed
+    anymore. Segments which were left behind, e.g., by killed processes or
+    runs with unlink=False, are removed by remove_shared_signals.
+
+    Args:
+        example (dict):
+            See load_synchronized_signals
+        device_selections (list):
+            See load_synchronized_signals
+        ref_device (str):
+            See load_synchronized_signals
+        sros (dict):
+            See load_synchronized_signals
+        timeout (float):
+            Maximum time in seconds to wait for another (running) process
+            loading the signals
+
+    Returns:
+        sigs (numpy.ndarray):
+            Read-only view of the synchronized signals in shared memory
+        channels (list):
+            See load_synchronized_signals
+        sros (dict):
+            SROs per device if the signals were loaded by this process and
+            None if they were published by another process
+        shm (SharedMemory):
+            Shared memory segment which has to be passed to
+            release_shared_signals after all views of it were deleted
+    """
+    name = get_shared_memory_name(
+        example['example_id'], device_selections, ref_device
+    )
+    loaded = False
+    shm = _attach(name)
+    if shm is None:
+        # Only the process which holds the lock loads the signals
+        with _lock(name, timeout):
+            # The signals might have been published in the meantime
+            shm = _attach(name)
+            if shm is None:
+                _remove_incomplete(name)
+                shm, sros = _publish(
+                    name, example, device_selections, ref_device, sros
+                )
+                loaded = True
+
+    header_len = int.from_bytes(shm.buf[8:16], 'little')
+    header = json.loads(bytes(shm.buf[16:16 + header_len]))
+    sigs = np.ndarray(
+        header['shape'], np.dtype(header['dtype']), buffer=shm.buf,
+        offset=_HEADER_SIZE
+    )
+    sigs.flags.writeable = False
+    channels = [_to_index(_channels) for _channels in header['channels']]
+    if not loaded:
+        sros = None
+    return sigs, channels, sros, shm
+
+
+def release_shared_signals(shm, unlink=False):
+    """
+    Detach from the shared memory segment returned by
+    load_shared_synchronized_signals. All views of the signals have to be
+    deleted before.
+
+    Args:
+        shm (SharedMemory):
+            Shared memory segment
+        unlink (bool):
+            If True, additionally remove the segment, e.g., if this is the
+            last run which needs the signals. Processes which are still
+            attached can continue to use the signals.
+    """
+    shm.close()
+    if unlink:
+        try:
+            _unlink(shm)
+        except FileNotFoundError:
+            # Already removed by another process
+            pass
+
+
+def remove_shared_signals():
+    """
+    Remove all shared memory segments published by
+    load_shared_synchronized_signals on this node and their lock files,
+    e.g., segments which were kept for subsequent runs (unlink=False) or left
+    behind by killed processes. Must not be called while other processes
+    use the shared signals. Processes which are still attached can continue
+    to use the signals, but processes which are loading signals are not
+    excluded anymore.
+
+    Returns:
+        Names of the removed shared memory segments
+    """
+    names = []
+    # POSIX shared memory segments are files in /dev/shm on Linux
+    for file in _SHM_DIR.glob(_PREFIX + '*'):
+        try:
+            file.unlink()
+        except FileNotFoundError:
+            continue
+        names.append(file.name)
+    for file in Path(tempfile.gettempdir()).glob(_PREFIX + '*.lock'):
+        file.unlink(missing_ok=True)
+    return names
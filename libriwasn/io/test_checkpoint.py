@@ -0,0 +1,56 @@
+"""
+Check that checkpoints are only reused if they were created with the same
+configuration.
+
+python -m pytest libriwasn/io/test_checkpoint.py
+"""
+import numpy as np
+
+from libriwasn.io.checkpoint import (
+    dump_record,
+    dump_stage,
+    get_checkpoint_dir,
+    load_record,
+    load_stage,
+    validate_checkpoints
+)
+
+
+_CONFIG = {'devices_cacgmm': None, 'num_spk': 8}
+
+
+def _dump_checkpoints(checkpoint_dir):
+    dump_stage(checkpoint_dir, 'sros', device1=np.ones(3))
+    dump_record(checkpoint_dir, {'utt': {'audio_path': 'utt.wav'}})
+
+
+def test_same_config(tmp_path):
+    checkpoint_dir = get_checkpoint_dir(tmp_path, 'ex')
+    assert not validate_checkpoints(checkpoint_dir, _CONFIG)
+    _dump_checkpoints(checkpoint_dir)
+    # The order of the parameters does not matter
+    config = dict(reversed(list(_CONFIG.items())))
+    assert not validate_checkpoints(checkpoint_dir, config)
+    np.testing.assert_equal(
+        load_stage(checkpoint_dir, 'sros')['device1'], np.ones(3)
+    )
+    assert load_record(checkpoint_dir) is not None
+
+
+def test_other_config(tmp_path):
+    checkpoint_dir = get_checkpoint_dir(tmp_path, 'ex')
+    validate_checkpoints(checkpoint_dir, _CONFIG)
+    _dump_checkpoints(checkpoint_dir)
+    assert validate_checkpoints(checkpoint_dir, {**_CONFIG, 'num_spk': 6})
+    assert load_stage(checkpoint_dir, 'sros') is None
+    assert load_record(checkpoint_dir) is None
+    # The new configuration is stored
+    assert not validate_checkpoints(checkpoint_dir, {**_CONFIG, 'num_spk': 6})
+
+
+def test_without_config(tmp_path):
+    # Checkpoints of a run which did not store its configuration
+    checkpoint_dir = get_checkpoint_dir(tmp_path, 'ex')
+    _dump_checkpoints(checkpoint_dir)
+    assert validate_checkpoints(checkpoint_dir, _CONFIG)
+    assert load_record(checkpoint_dir) is None
@@ -0,0 +1,165 @@
+"""
+Check that the signals published in shared memory are identical to the
+signals loaded by load_synchronized_signals, that they outlive the process
+which published them and that incomplete segments (e.g., of a killed
+process) are loaded again.
+
+python -m pytest libriwasn/io/test_shared_memory.py
+"""
+import multiprocessing
+import os
+
+import numpy as np
+import paderbox as pb
+import pytest
+
+pytest.importorskip('paderwasn')
+from libriwasn.io import audioread  # noqa: E402
+from libriwasn.io.shared_memory import (  # noqa: E402
+    _HEADER_SIZE,
+    _attach,
+    _open,
+    _unlink,
+    get_shared_memory_name,
+    load_shared_synchronized_signals,
+    release_shared_signals,
+    remove_shared_signals
+)
+
+# Only the reference device is loaded, such that no SROs are estimated
+_DEVICE_SELECTIONS = [('ref', False)]
+
+
+@pytest.fixture
+def example(tmp_path, request):
+    sigs = np.random.default_rng(0).uniform(-.5, .5, size=(3, 16000))
+    pb.io.dump_audio(sigs, tmp_path / 'ref.wav')
+    example = {
+        # Unique per test, such that the tests do not share segments
+        'example_id': f'{request.node.name}_{tmp_path.name}',
+        'audio_path': {'observation': {'ref': str(tmp_path / 'ref.wav')}}
+    }
+    name = get_shared_memory_name(
+        example['example_id'], _DEVICE_SELECTIONS, 'ref'
+    )
+    yield example, name
+    try:
+        shm = _open(name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    _unlink(shm)
+
+
+def _load(example):
+    return audioread.load_synchronized_signals(
+        example, _DEVICE_SELECTIONS, ref_device='ref'
+    )
+
+
+def _publish(example):
+    # Publish the signals in another process, which terminates afterwards
+    sigs, _, _, shm = load_shared_synchronized_signals(
+        example, _DEVICE_SELECTIONS, ref_device='ref'
+    )
+    del sigs
+    release_shared_signals(shm)
+
+
+def test_identical_to_load(example):
+    example, _ = example
+    sigs_ref, channels_ref = _load(example)
+    sigs, channels, sros, shm = load_shared_synchronized_signals(
+        example, _DEVICE_SELECTIONS, ref_device='ref'
+    )
+    np.testing.assert_equal(sigs, sigs_ref)
+    assert channels == channels_ref
+    assert sros == {}
+    assert not sigs.flags.writeable
+    # A second call attaches to the published signals
+    sigs_attached, _, sros, shm_attached = load_shared_synchronized_signals(
+        example, _DEVICE_SELECTIONS, ref_device='ref'
+    )
+    assert sros is None
+    np.testing.assert_equal(sigs_attached, sigs_ref)
+    del sigs, sigs_attached
+    release_shared_signals(shm)
+    release_shared_signals(shm_attached, unlink=True)
+
+
+def test_outlives_process(example, monkeypatch):
+    example, _ = example
+    process = multiprocessing.get_context('spawn').Process(
+        target=_publish, args=(example,)
+    )
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+
+    def fail(*args, **kwargs):
+        raise AssertionError('The signals are loaded again')
+
+    monkeypatch.setattr(audioread, '_read_channels', fail)
+    sigs, _, sros, shm = load_shared_synchronized_signals(
+        example, _DEVICE_SELECTIONS, ref_device='ref'
+    )
+    assert sros is None
+    monkeypatch.undo()
+    np.testing.assert_equal(sigs, _load(example)[0])
+    del sigs
+    release_shared_signals(shm, unlink=True)
+
+
+def test_incomplete_segment(example):
+    # Segment of a process which was killed while writing the signals
+    example, name = example
+    _open(name, create=True, size=_HEADER_SIZE + 100).close()
+    sigs, _, sros, shm = load_shared_synchronized_signals(
+        example, _DEVICE_SELECTIONS, ref_device='ref', timeout=1
+    )
+    assert sros == {}
+    np.testing.assert_equal(sigs, _load(example)[0])
+    del sigs
+    release_shared_signals(shm, unlink=True)
+
+
+def test_empty_segment(example):
+    # Segment which was created by another process, whose size was not set
+    # yet
+    example, name = example
+    fd = os.open(
+        f'/dev/shm/{name}', os.O_CREAT | os.O_EXCL | os.O_RDWR
+    )
+    os.close(fd)
+    assert _attach(name) is None
+    sigs, _, sros, shm = load_shared_synchronized_signals(
+        example, _DEVICE_SELECTIONS, ref_device='ref', timeout=1
+    )
+    assert sros == {}
+    np.testing.assert_equal(sigs, _load(example)[0])
+    del sigs
+    release_shared_signals(shm, unlink=True)
+
+
+def test_failed_loading(example, monkeypatch):
+    example, name = example
+
+    def fail(*args, **kwargs):
+        raise RuntimeError('Reading failed')
+
+    monkeypatch.setattr(audioread, '_read_channels', fail)
+    with pytest.raises(RuntimeError, match='Reading failed'):
+        load_shared_synchronized_signals(
+            example, _DEVICE_SELECTIONS, ref_device='ref'
+        )
+    # The incomplete segment is removed
+    with pytest.raises(FileNotFoundError):
+        _open(name)
+
+
+def test_remove_shared_signals(example):
+    example, name = example
+    _publish(example)
+    assert name in remove_shared_signals()
+    with pytest.raises(FileNotFoundError):
+        _open(name)
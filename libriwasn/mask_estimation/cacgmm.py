@@ -12,6 +12,8 @@ from pb_bss.distribution.mixture_model_utils import (
 )
 from pb_bss.permutation_alignment import DHTVPermutationAlignment
 
+from libriwasn.profiling import stage
+
 
 def _cacgmm_e_step(y, models, inline_permutation_aligner):
     posteriors = []
@@ -100,17 +102,19 @@ def get_tf_masks(
             guide = guide
         else:
             guide = None
-        if models is not None:
-            posteriors, quadratic_forms = \
-                _cacgmm_e_step(y, models, permutation_alignment)
-        if guide is not None:
-            posteriors *= guide[None]
-            denominator = np.maximum(
-                np.sum(posteriors, axis=-2, keepdims=True),
-                np.finfo(posteriors.dtype).tiny,
-            )
-            posteriors /= denominator
-        models, priors = _cacgmm_m_step(y, posteriors, quadratic_forms)
+        # Each EM-iteration is recorded individually if profiling is enabled
+        with stage('em_iteration'):
+            if models is not None:
+                posteriors, quadratic_forms = \
+                    _cacgmm_e_step(y, models, permutation_alignment)
+            if guide is not None:
+                posteriors *= guide[None]
+                denominator = np.maximum(
+                    np.sum(posteriors, axis=-2, keepdims=True),
+                    np.finfo(posteriors.dtype).tiny,
+                )
+                posteriors /= denominator
+            models, priors = _cacgmm_m_step(y, posteriors, quadratic_forms)
 
     tf_masks, _ = _cacgmm_e_step(y, models, permutation_alignment)
     tf_masks = rearrange(tf_masks, 'f c t  -> c f t')
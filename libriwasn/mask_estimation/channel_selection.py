@@ -0,0 +1,120 @@
+import numpy as np
+import scipy.signal
+
+
+def get_frame_energies(sig, frame_size=1024, frame_shift=256):
+    """
+    Calculate the energy of each frame of the one-sided STFT of a signal
+    (see pb.transform.stft with its default parameters) in the time domain.
+    Due to Parseval's theorem the energy of a frame of the one-sided
+    spectrum is given by the windowed energy of the frame and the squared
+    magnitudes of the DC and the Nyquist bin, which can all be calculated
+    as correlations of the signal with the (modulated) window. Thus, the
+    STFT of the signal is not needed.
+
+    Args:
+        sig (numpy.ndarray):
+            Time domain signal (Shape: (number of samples,))
+        frame_size (int):
+            Frame size of the STFT (even)
+        frame_shift (int):
+            Frame shift of the STFT
+
+    Returns:
+        Energy of each frame (Shape: (number of frames,))
+    """
+    assert frame_size % 2 == 0, frame_size
+    window = scipy.signal.windows.blackman(frame_size, sym=False)
+    # Padding of the STFT (fading and padding at the end)
+    pad_len = frame_size - frame_shift
+    num_frames = int(np.ceil(
+        max(len(sig) + 2 * pad_len - frame_size, 0) / frame_shift
+    )) + 1
+    sig = np.pad(np.asarray(sig, dtype=np.float64), (
+        pad_len, (num_frames - 1) * frame_shift + frame_size
+        - len(sig) - pad_len
+    ))
+    modulation = (-1.) ** np.arange(frame_size)
+
+    def _correlate(x, w):
+        return scipy.signal.fftconvolve(x, w[::-1], mode='valid')[
+            ::frame_shift
+        ]
+
+    windowed_energy = _correlate(sig ** 2, window ** 2)
+    dc = _correlate(sig, window)
+    nyquist = _correlate(sig * np.resize(modulation, len(sig)), window)
+    return (frame_size * windowed_energy + dc ** 2 + nyquist ** 2) / 2
+
+
+def estimate_channel_snrs(
+        sigs, noise_percentile=10, frame_size=1024, frame_shift=256
+):
+    """
+    Estimate the signal-to-noise ratio (SNR) of each channel based on the
+    frame-wise energies of the STFT (see get_frame_energies). The noise
+    power is estimated as a lower percentile of the frame energies and the
+    signal power as the mean frame energy.
+
+    Args:
+        sigs (array-like):
+            Time domain signals (Shape: (number of channels x number of
+            samples))
+        noise_percentile (float):
+            Percentile of the frame energies used as estimate of the noise
+            power
+        frame_size (int):
+            Frame size of the STFT
+        frame_shift (int):
+            Frame shift of the STFT
+
+    Returns:
+        SNR estimate in dB for each channel (Shape: (number of channels,))
+    """
+    # The channels are processed one after another to keep the memory
+    # consumption low.
+    energy = np.stack([
+        get_frame_energies(sig, frame_size, frame_shift) for sig in sigs
+    ])
+    eps = np.finfo(energy.dtype).tiny
+    noise_power = np.maximum(
+        np.percentile(energy, noise_percentile, axis=-1), eps
+    )
+    signal_power = np.maximum(np.mean(energy, axis=-1), eps)
+    return 10 * np.log10(signal_power / noise_power)
+
+
+def select_channels(sigs, max_num_channels, ref_channel=0):
+    """
+    Select a subset of channels for the mask estimation. The cost of the
+    cACGMM grows with the number of channels (channels x channels spatial
+    covariance matrices have to be estimated and inverted per class and
+    frequency). Therefore, at most max_num_channels channels are selected.
+    The channels are ranked by their estimated SNR, whereby the reference
+    channel, which was used for synchronization, is always kept. The
+    selection is based on the time domain signals, such that the STFT only
+    has to be calculated for the selected channels.
+
+    Args:
+        sigs (array-like):
+            Time domain signals (Shape: (number of channels x number of
+            samples))
+        max_num_channels (int):
+            Maximum number of channels to be selected
+        ref_channel (int, None):
+            Channel which is always part of the selection. If None, the
+            selection is only based on the SNR.
+
+    Returns:
+        Sorted indices of the selected channels
+    """
+    assert max_num_channels >= 1, max_num_channels
+    num_channels = len(sigs)
+    if num_channels <= max_num_channels:
+        return np.arange(num_channels)
+    order = np.argsort(estimate_channel_snrs(sigs))[::-1]
+    if ref_channel is not None:
+        order = np.concatenate(
+            [[ref_channel], order[order != ref_channel]]
+        )
+    return np.sort(order[:max_num_channels])
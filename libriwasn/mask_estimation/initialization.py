@@ -153,11 +153,9 @@ def activities_to_soft_masks(
 
     # Smooth the activities using a dialtion and a erosion operation. This is
     # basically used to bridge short pauses of the activities
-    activities_smoothed = np.zeros_like(activities)
-    for i, activity in enumerate(activities):
-        activities_smoothed[i] = \
-            erode(dilate(activity, kernel_size_dilation), kernel_size_erosion)
-    activities = activities_smoothed
+    activities = erode(
+        dilate(activities, kernel_size_dilation), kernel_size_erosion
+    ).astype(activities.dtype)
 
     # If there are less sources given by activities than num_classes, add
     # additional classes, which are always inactive.
@@ -0,0 +1,96 @@
+"""
+Check that the channel selection, which works on the time domain signals,
+yields the same frame energies and hence the same selection as an
+evaluation of the STFT of all channels.
+
+python -m pytest libriwasn/mask_estimation/test_channel_selection.py
+"""
+import numpy as np
+import paderbox as pb
+import pytest
+
+from libriwasn.mask_estimation.channel_selection import (
+    estimate_channel_snrs,
+    get_frame_energies,
+    select_channels
+)
+
+
+def _estimate_channel_snrs_stft(sigs, noise_percentile=10):
+    # Previous implementation, which evaluates the STFT of all channels
+    y = pb.transform.stft(np.asarray(sigs))
+    energy = np.sum(y.real ** 2 + y.imag ** 2, axis=-1)
+    eps = np.finfo(energy.dtype).tiny
+    noise_power = np.maximum(
+        np.percentile(energy, noise_percentile, axis=-1), eps
+    )
+    signal_power = np.maximum(np.mean(energy, axis=-1), eps)
+    return 10 * np.log10(signal_power / noise_power)
+
+
+def _get_signals(rng, num_channels, num_samples):
+    # Bursts of a common source with a different noise level per channel
+    activity = np.repeat(
+        rng.uniform(size=num_samples // 4000 + 1) > .4, 4000
+    )[:num_samples]
+    source = rng.standard_normal(num_samples) * activity
+    noise_levels = rng.uniform(.01, 2, num_channels)
+    return source + noise_levels[:, None] * rng.standard_normal(
+        (num_channels, num_samples)
+    )
+
+
+@pytest.mark.parametrize(
+    'num_samples', [1, 255, 256, 768, 1023, 1024, 1025, 16000, 48007]
+)
+def test_frame_energies_identical_to_stft(num_samples):
+    rng = np.random.default_rng(num_samples)
+    sig = rng.standard_normal(num_samples)
+    y = pb.transform.stft(sig)
+    energy = np.sum(np.abs(y) ** 2, axis=-1)
+    np.testing.assert_allclose(
+        get_frame_energies(sig), energy, rtol=1e-10, atol=1e-10
+    )
+
+
+@pytest.mark.parametrize('frame_size,frame_shift', [(512, 128), (256, 64)])
+def test_frame_energies_other_frame_sizes(frame_size, frame_shift):
+    sig = np.random.default_rng(0).standard_normal(10000)
+    y = pb.transform.stft(sig, size=frame_size, shift=frame_shift)
+    np.testing.assert_allclose(
+        get_frame_energies(sig, frame_size, frame_shift),
+        np.sum(np.abs(y) ** 2, axis=-1), rtol=1e-10
+    )
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_identical_to_stft_based_selection(seed):
+    rng = np.random.default_rng(seed)
+    num_channels = int(rng.integers(2, 12))
+    sigs = _get_signals(rng, num_channels, int(rng.integers(8000, 64000)))
+    np.testing.assert_allclose(
+        estimate_channel_snrs(sigs), _estimate_channel_snrs_stft(sigs),
+        rtol=1e-9
+    )
+    max_num_channels = int(rng.integers(1, num_channels + 1))
+    order = np.argsort(_estimate_channel_snrs_stft(sigs))[::-1]
+    order = np.concatenate([[0], order[order != 0]])
+    np.testing.assert_equal(
+        select_channels(sigs, max_num_channels),
+        np.sort(order[:max_num_channels])
+    )
+
+
+def test_select_channels():
+    rng = np.random.default_rng(0)
+    source = rng.standard_normal(32000) * np.repeat(
+        rng.uniform(size=8) > .4, 4000
+    )
+    noise_levels = np.array([1., .01, 2., .02, .5])
+    sigs = source + noise_levels[:, None] * rng.standard_normal((5, 32000))
+    # The reference channel is kept although it is noisy
+    np.testing.assert_equal(select_channels(sigs, 3), [0, 1, 3])
+    np.testing.assert_equal(select_channels(sigs, 2, ref_channel=None), [1, 3])
+    np.testing.assert_equal(select_channels(sigs, 5), np.arange(5))
+    # A list of channels (e.g., views of a larger array) can be passed
+    np.testing.assert_equal(select_channels(list(sigs), 3), [0, 1, 3])
@@ -0,0 +1,407 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import contextlib
+import multiprocessing
+import os
+import time
+
+import dlp_mpi
+import numpy as np
+
+
+_BLAS_ENV_VARIABLES = [
+    'OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+    'BLIS_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS'
+]
+
+
+def get_example_duration(example):
+    """
+    Get the duration of an example of the database json in samples, e.g.,
+    to schedule the longest examples first (see longest_first)
+
+    Args:
+        example (dict):
+            Entry of libriwasn json
+
+    Returns:
+        Number of samples of the longest recording of the example
+    """
+    num_samples = example['num_samples']
+    if 'observation' in num_samples:
+        num_samples = num_samples['observation']
+        if isinstance(num_samples, dict):
+            return max(num_samples.values())
+        return num_samples
+    return max([
+        onset + length for onset, length in zip(
+            example['onset']['original_source'],
+            num_samples['original_source']
+        )
+    ])
+
+
+def get_segment_duration(segment):
+    """
+    Get the duration of an entry of a per_utt.json in samples
+
+    Args:
+        segment (dict):
+            Entry of a per_utt.json
+
+    Returns:
+        Number of samples of the segment
+    """
+    if 'audio_stop' in segment:
+        return segment['audio_stop'] - segment.get('audio_start', 0)
+    return segment['stop_sample'] - segment['start_sample']
+
+
+def longest_first(data, get_duration):
+    """
+    Sort the work items by their duration in descending order. If the items
+    are handed out dynamically (e.g., by the map method of the backends), this
+    corresponds to the longest processing time first rule, which avoids that
+    a long item which is handed out last keeps a single worker busy while
+    all others are idle.
+
+    Args:
+        data (iterable):
+            Work items, e.g., a dataset of the database json
+        get_duration (callable):
+            Function returning the duration of a work item (see
+            get_example_duration and get_segment_duration)
+
+    Returns:
+        List of the work items with the longest item first
+    """
+    data = list(data)
+    # A stable sort keeps the order identical on all ranks
+    order = np.argsort([-get_duration(item) for item in data], kind='stable')
+    return [data[i] for i in order]
+
+
+def _timed_call(function, item):
+    start = time.perf_counter()
+    result = function(item)
+    return result, time.perf_counter() - start
+
+
+def report_utilisation(backend):
+    """
+    Print the utilisation of each worker on the master, i.e., the time spent
+    on processing work items (see the map method of the backends) relative
+    to the total time. This shows how well the work is balanced. Has to be
+    called by all ranks.
+
+    Args:
+        backend (MPIBackend, ProcessBackend):
+            Backend which was used to process the work items
+
+    Returns:
+        List of the statistics (number of items, busy time and wall time) of
+        all workers on the master and None on all other ranks
+    """
+    all_stats = backend.get_utilisation()
+    if not backend.is_master:
+        return None
+    wall_time = max([s['wall_time'] for s in all_stats] + [0.])
+    print('Utilisation per worker:', flush=True)
+    for worker, s in enumerate(all_stats):
+        if s['num_items'] == 0:
+            # The master of dlp_mpi.split_managed only distributes the work
+            continue
+        print(
+            f'  worker {worker}: {s["num_items"]} items, '
+            f'busy {s["busy_time"]:.1f}s / {wall_time:.1f}s '
+            f'({100 * s["busy_time"] / max(wall_time, 1e-12):.1f}%)',
+            flush=True
+        )
+    return all_stats
+
+
+def limit_blas_threads(num_threads):
+    """
+    Limit the number of threads used by BLAS/OpenMP to avoid an
+    oversubscription of the CPU cores if several workers run on one node.
+    The environment variables only take effect for libraries which are
+    loaded afterwards, e.g., in subprocesses. The thread pools of already
+    loaded libraries are limited via threadpoolctl if it is installed.
+
+    Args:
+        num_threads (int):
+            Maximum number of threads per worker
+    """
+    for variable in _BLAS_ENV_VARIABLES:
+        os.environ[variable] = str(num_threads)
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    threadpool_limits(num_threads)
+
+
+@contextlib.contextmanager
+def limited_blas_threads(num_threads):
+    """
+    Temporarily limit the number of threads of the thread pools of the
+    loaded BLAS/OpenMP libraries, e.g., while several threads of this process
+    call BLAS concurrently. Has no effect if threadpoolctl is not installed.
+
+    Args:
+        num_threads (int):
+            Maximum number of threads of each thread pool
+    """
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        yield
+        return
+    with threadpool_limits(num_threads):
+        yield
+
+
+class MPIBackend:
+    def __init__(self, blas_threads=None):
+        """
+        Distribute the work items via MPI (see dlp_mpi). The processes are
+        started by mpiexec and the master only distributes the work items
+        if more than one process is used.
+
+        Args:
+            blas_threads (int):
+                Maximum number of BLAS threads per process. If None, the
+                number of threads is not limited.
+        """
+        self.blas_threads = blas_threads
+        self.rank = dlp_mpi.RANK
+        self.size = dlp_mpi.SIZE
+        self.is_master = dlp_mpi.IS_MASTER
+        self._stats = {'num_items': 0, 'busy_time': 0., 'wall_time': 0.}
+
+    def start(self):
+        if self.blas_threads is not None:
+            limit_blas_threads(self.blas_threads)
+        return self
+
+    def finish(self):
+        pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.finish()
+
+    def map(self, function, sequence):
+        """
+        Apply a function to the work items assigned to this process. Each
+        process takes the next unprocessed item when it has finished its
+        previous item (see dlp_mpi.split_managed).
+
+        Args:
+            function (callable):
+                Function which is applied to each work item
+            sequence (sequence):
+                Work items, which have to be identical on all processes
+
+        Yields:
+            The results of the work items of this process
+        """
+        start = time.perf_counter()
+        try:
+            for item in dlp_mpi.split_managed(
+                    sequence, allow_single_worker=True
+            ):
+                result, busy_time = _timed_call(function, item)
+                self._stats['num_items'] += 1
+                self._stats['busy_time'] += busy_time
+                yield result
+        finally:
+            self._stats['wall_time'] += time.perf_counter() - start
+
+    def gather(self, obj):
+        """
+        Gather an object from all processes on the master
+
+        Args:
+            obj:
+                Object of this process
+
+        Returns:
+            List of the objects of all processes on the master and None on
+            all other processes
+        """
+        return dlp_mpi.gather(obj, root=dlp_mpi.MASTER)
+
+    def get_utilisation(self):
+        """
+        Gather the statistics of map from all processes on the master. Has to
+        be called by all processes.
+
+        Returns:
+            List of the statistics of all processes on the master and None
+            on all other processes
+        """
+        return self.gather(self._stats)
+
+
+# Function applied to the work items by a worker process of a
+# ProcessBackend (see _initialize_worker)
+_worker_function = None
+
+
+def _initialize_worker(function, blas_threads):
+    # The function is transferred to each worker process only once, such
+    # that state which it creates lazily (e.g., a loaded model) is kept for
+    # all work items of the worker.
+    global _worker_function
+    limit_blas_threads(blas_threads)
+    _worker_function = function
+
+
+def _apply_worker_function(item):
+    result, busy_time = _timed_call(_worker_function, item)
+    return result, os.getpid(), busy_time
+
+
+class ProcessBackend:
+    def __init__(self, num_workers=None, blas_threads=None):
+        """
+        Distribute the work items to worker processes on a single node
+        without MPI (see concurrent.futures.ProcessPoolExecutor). The workers
+        are started via the spawn method, i.e., as new interpreters which
+        neither inherit the threads nor the locks of the calling process.
+        Only the calling process runs the script. Hence, it is the master and
+        the only rank, and map returns the results of all work items.
+
+        Args:
+            num_workers (int):
+                Number of worker processes. Defaults to the number of CPU
+                cores.
+            blas_threads (int):
+                Maximum number of BLAS threads per worker process. Defaults
+                to the number of CPU cores divided by the number of workers.
+        """
+        cpu_count = os.cpu_count() or 1
+        if num_workers is None:
+            num_workers = cpu_count
+        assert num_workers >= 1, num_workers
+        if blas_threads is None:
+            blas_threads = max(cpu_count // num_workers, 1)
+        self.num_workers = num_workers
+        self.blas_threads = blas_threads
+        self.rank = 0
+        self.size = 1
+        self.is_master = True
+        self._stats = {}
+        self._wall_time = 0.
+
+    def start(self):
+        return self
+
+    def finish(self):
+        pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.finish()
+
+    def map(self, function, sequence):
+        """
+        Apply a function to all work items in num_workers worker processes.
+        The items are handed out in the order of the sequence and each worker
+        takes the next unprocessed item when it has finished its previous
+        item. If an item fails, the items which were not started yet are
+        cancelled and the exception is raised here.
+
+        Args:
+            function (callable):
+                Picklable function (e.g., a module-level function or a
+                functools.partial of it), which is applied to each work item.
+                It is transferred to each worker only once, such that state
+                which it creates lazily is kept for all items of a worker.
+            sequence (iterable):
+                Picklable work items
+
+        Yields:
+            The results of all work items in the order in which they are
+            finished
+        """
+        start = time.perf_counter()
+        executor = ProcessPoolExecutor(
+            self.num_workers, mp_context=multiprocessing.get_context('spawn'),
+            initializer=_initialize_worker,
+            initargs=(function, self.blas_threads)
+        )
+        try:
+            futures = [
+                executor.submit(_apply_worker_function, item)
+                for item in sequence
+            ]
+            for future in as_completed(futures):
+                result, pid, busy_time = future.result()
+                stats = self._stats.setdefault(
+                    pid, {'num_items': 0, 'busy_time': 0.}
+                )
+                stats['num_items'] += 1
+                stats['busy_time'] += busy_time
+                yield result
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            self._wall_time += time.perf_counter() - start
+
+    def gather(self, obj):
+        """
+        Counterpart of MPIBackend.gather. The calling process is the only
+        rank.
+
+        Args:
+            obj:
+                Object of this process
+
+        Returns:
+            List containing obj
+        """
+        return [obj]
+
+    def get_utilisation(self):
+        """
+        Get the statistics of map per worker process
+
+        Returns:
+            List of the statistics of all worker processes
+        """
+        return [
+            dict(stats, wall_time=self._wall_time)
+            for stats in self._stats.values()
+        ]
+
+
+def get_backend(name='mpi', num_workers=None, blas_threads=None):
+    """
+    Get the backend used to distribute the work items. Both backends provide
+    the same interface (start, finish, rank, size, is_master, map, gather,
+    get_utilisation). All ranks execute the code between start and finish,
+    and the work items are processed via map.
+
+    Args:
+        name (str):
+            'mpi' (see MPIBackend) or 'processes' (see ProcessBackend)
+        num_workers (int):
+            Number of worker processes of the 'processes' backend. Ignored
+            for 'mpi', where the number of processes is given by mpiexec.
+        blas_threads (int):
+            Maximum number of BLAS threads per process
+
+    Returns:
+        The backend
+    """
+    if name == 'mpi':
+        return MPIBackend(blas_threads=blas_threads)
+    elif name == 'processes':
+        return ProcessBackend(
+            num_workers=num_workers, blas_threads=blas_threads
+        )
+    raise ValueError(f'Unknown backend: {name}')
@@ -0,0 +1,238 @@
+import contextlib
+import resource
+import sys
+import time
+import tracemalloc
+
+import paderbox as pb
+
+
+# Profiler which records the stages (see stage). If it is None, stage returns
+# a no-op context manager such that the instrumentation of the pipeline has
+# a negligible overhead.
+_active_profiler = None
+_DISABLED = contextlib.nullcontext()
+
+
+def stage(name):
+    """
+    Context manager which measures the time and the memory consumption of a
+    processing stage if a profiler is active (see Profiler) and does nothing
+    otherwise. Stages may be nested and a stage may be entered several times
+    (e.g., once per EM iteration), in which case each call is recorded.
+
+    Args:
+        name (str):
+            Name of the stage, e.g., 'stft'
+
+    Returns:
+        Context manager
+    """
+    if _active_profiler is None:
+        return _DISABLED
+    return _active_profiler.stage(name)
+
+
+def _get_peak_rss():
+    # Peak resident set size of the process in bytes. ru_maxrss is given in
+    # kilobytes on Linux and in bytes on macOS.
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        peak_rss *= 1024
+    return peak_rss
+
+
+class Profiler:
+    def __init__(self, enabled=True, trace_memory=False):
+        """
+        Record the duration and the memory consumption of the stages of the
+        pipeline (see stage) while the profiler is active, i.e., between
+        start and stop or inside of a with statement. For each call of a
+        stage, the duration and the peak resident set size (RSS) of the
+        process at its end are recorded. Since the peak RSS never decreases,
+        the stage which increases it causes the peak memory consumption. If
+        trace_memory is True, the peak of the memory allocated via Python
+        (including numpy arrays) during the stage is additionally recorded
+        via tracemalloc, which slows down the processing noticeably.
+
+        Args:
+            enabled (bool):
+                If False, the profiler is never activated and report returns
+                None, such that the profiling can be switched off without
+                changing the calling code.
+            trace_memory (bool):
+                If True, trace the memory allocations via tracemalloc
+        """
+        self.enabled = enabled
+        self.trace_memory = trace_memory
+        self._stages = {}
+        self._traced_peaks = []
+        self._started_tracing = False
+
+    def start(self):
+        global _active_profiler
+        if not self.enabled:
+            return self
+        assert _active_profiler is None, 'Another profiler is active'
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        _active_profiler = self
+        return self
+
+    def stop(self):
+        global _active_profiler
+        if _active_profiler is self:
+            _active_profiler = None
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _update_outer_peak(self):
+        # The peak of tracemalloc is reset when a stage is entered. Hence,
+        # the peak of the enclosing stage is kept up to date on the stack.
+        if len(self._traced_peaks) > 0:
+            _, peak = tracemalloc.get_traced_memory()
+            self._traced_peaks[-1] = max(self._traced_peaks[-1], peak)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if self.trace_memory:
+            self._update_outer_peak()
+            tracemalloc.reset_peak()
+            self._traced_peaks.append(0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            stats = self._stages.setdefault(
+                name, {'times': [], 'peak_rss': 0}
+            )
+            stats['times'].append(duration)
+            stats['peak_rss'] = max(stats['peak_rss'], _get_peak_rss())
+            if self.trace_memory:
+                _, peak = tracemalloc.get_traced_memory()
+                peak = max(peak, self._traced_peaks.pop())
+                stats['peak_traced'] = max(stats.get('peak_traced', 0), peak)
+                self._update_outer_peak()
+                tracemalloc.reset_peak()
+
+    def report(self, reset=True):
+        """
+        Get the recorded statistics, e.g., of one example
+
+        Args:
+            reset (bool):
+                If True, discard the recorded statistics afterwards such that
+                the next report only contains the subsequent stages
+
+        Returns:
+            Dictionary with an entry per stage containing the number of calls
+            ('num_calls'), the total duration in seconds ('time'), the
+            duration of each call in seconds ('times'), the peak RSS in bytes
+            ('peak_rss') and, if trace_memory is True, the peak of the traced
+            memory in bytes ('peak_traced'). None if the profiler is disabled.
+        """
+        if not self.enabled:
+            return None
+        report = {}
+        for name, stats in self._stages.items():
+            report[name] = {
+                'num_calls': len(stats['times']),
+                'time': sum(stats['times']),
+                **stats
+            }
+        if reset:
+            self._stages = {}
+        return report
+
+
+def summarize_reports(reports):
+    """
+    Aggregate the reports of several examples (see Profiler.report)
+
+    Args:
+        reports (dict):
+            Report per example
+
+    Returns:
+        Dictionary with an entry per stage containing the number of
+        examples ('num_examples') and calls ('num_calls'), the total
+        duration ('time'), the mean duration per call ('mean_time'), the
+        maximum duration of a call ('max_time'), and the maximum of the
+        peak memory consumptions ('peak_rss', 'peak_traced')
+    """
+    summary = {}
+    for report in reports.values():
+        for name, stats in report.items():
+            summary_stage = summary.setdefault(name, {
+                'num_examples': 0, 'num_calls': 0, 'time': 0.,
+                'max_time': 0., 'peak_rss': 0
+            })
+            summary_stage['num_examples'] += 1
+            summary_stage['num_calls'] += stats['num_calls']
+            summary_stage['time'] += stats['time']
+            summary_stage['max_time'] = \
+                max(summary_stage['max_time'], max(stats['times']))
+            for key in ['peak_rss', 'peak_traced']:
+                if key in stats:
+                    summary_stage[key] = \
+                        max(summary_stage.get(key, 0), stats[key])
+    for summary_stage in summary.values():
+        summary_stage['mean_time'] = \
+            summary_stage['time'] / summary_stage['num_calls']
+    return summary
+
+
+def print_summary(summary):
+    """
+    Print the summary of summarize_reports with the most time-consuming
+    stage first
+
+    Args:
+        summary (dict):
+            Output of summarize_reports
+    """
+    print('Time and memory per stage:', flush=True)
+    stages = sorted(summary.items(), key=lambda item: -item[1]['time'])
+    for name, stats in stages:
+        line = (
+            f'  {name}: {stats["time"]:.1f}s in {stats["num_calls"]} calls '
+            f'(mean {stats["mean_time"]:.3f}s, max {stats["max_time"]:.3f}s),'
+            f' peak RSS {stats["peak_rss"] / 1024 ** 2:.0f} MiB'
+        )
+        if 'peak_traced' in stats:
+            line += f', peak traced {stats["peak_traced"] / 1024 ** 2:.0f} MiB'
+        print(line, flush=True)
+
+
+def dump_reports(all_reports, path):
+    """
+    Store the reports of all examples together with their summary (see
+    summarize_reports) in a json file and print the summary
+
+    Args:
+        all_reports (list):
+            Reports per example (dict) of each process, e.g., the output of
+            gather on the master
+        path (str, Path):
+            Path of the json file
+    """
+    reports = {}
+    for reports_process in all_reports:
+        reports.update(reports_process)
+    if len(reports) == 0:
+        # Keep the reports of a previous run if all examples were skipped
+        print('No examples were profiled', flush=True)
+        return
+    summary = summarize_reports(reports)
+    print_summary(summary)
+    pb.io.dump_json({'summary': summary, 'examples': reports}, path)
+    print(f'Wrote: {path}', flush=True)
@@ -10,18 +10,26 @@ python -m libriwasn.reference_system.segment_meetings with libricss db_json=/pat
 python -m libriwasn.reference_system.segment_meetings with libriwasn200 db_json=/path/to/libriwasn.json
 python -m libriwasn.reference_system.segment_meetings with libriwasn800 db_json=/path/to/libriwasn.json
 """
+import functools
 from pathlib import Path
 
-import dlp_mpi
 from lazy_dataset.database import JsonDatabase
 import numpy as np
 import paderbox as pb
 from paderwasn.synchronization.utils import VoiceActivityDetector
 from sacred import Experiment
 
+from libriwasn.io.audiowrite import AudioWriter, pack_segments
+from libriwasn.parallel import (
+    get_backend,
+    get_example_duration,
+    longest_first,
+    report_utilisation
+)
+from libriwasn import profiling
 from libriwasn.synchronization.sro import estimate_sros
 from libriwasn.synchronization.utils import ref_time_to_mic_time
-from libriwasn.utils import solve_permutation
+from libriwasn.utils import IntervalActivity, solve_permutation
 
 
 exp = Experiment('Segment meetings')
@@ -35,6 +43,36 @@ def config():
     audio_key = 'observation'
     device = 'Pixel7'
     margin = 320
+    # The segments are written by num_writers background threads while the
+    # remaining segments of the example are cut. At most max_pending_writes
+    # segments wait to be written. If num_writers is 0, the segments are
+    # written synchronously.
+    num_writers = 4
+    max_pending_writes = 64
+    # 'segments': Write each segment into its own audio file.
+    # 'container': Write all segments of a speaker into a single audio file
+    # per session. The entries of the per_utt.json additionally specify the
+    # position of the segment within this file (audio_start, audio_stop).
+    # 'virtual': Do not write any audio. The entries of the per_utt.json
+    # specify the recording (audio_path, device, channel) and the position
+    # of the segment within the recording (audio_start, audio_stop).
+    output_format = 'segments'
+    # 'mpi': Distribute the examples via MPI (start the script with mpiexec).
+    # 'processes': Spawn num_workers worker processes on this node (no MPI
+    # needed).
+    # blas_threads limits the number of BLAS threads per process to avoid an
+    # oversubscription of the CPU cores (None: no limit for 'mpi' and the
+    # number of cores divided by num_workers for 'processes').
+    backend = 'mpi'
+    num_workers = None
+    blas_threads = None
+    # Record the time and the memory consumption of the processing stages
+    # per example (see libriwasn.profiling). The reports of all examples and
+    # a summary are written to storage_dir/profile.json. If trace_memory is
+    # True, the memory allocations are additionally traced via tracemalloc,
+    # which slows down the processing.
+    profile = False
+    trace_memory = False
 
 
 @exp.named_config
@@ -63,33 +101,33 @@ def libriwasn800():
     data_set = 'libriwasn800'
 
 
-@exp.automain
-def segment_audio(
-        db_json, storage_dir, data_set, audio_key, device, margin
+def _segment_example(
+        example, storage_dir, audio_key, device, margin, num_writers,
+        max_pending_writes, output_format, profile, trace_memory
 ):
-    msg = 'You have to specify, where your LibriWASN database-json is stored.'
-    assert db_json is not None, msg
-    msg = (f'data_set ({data_set}) has to be chosen from '
-           f'["libricss", "libriwasn200", "libriwasn800"]')
-    assert data_set in ['libricss', 'libriwasn200', 'libriwasn800'], msg
-    assert storage_dir is not None,\
-        'You have to specify where the signals should be stored.'
-    storage_dir = Path(storage_dir).absolute()
-    segment_json = storage_dir / 'per_utt.json'
-    ds = JsonDatabase(db_json)
-    ds = ds.get_dataset(data_set)
-
-    segmented = {}
+    # Segment a single example (see segment_audio) and return its ID, the
+    # entries of its segments for the per_utt.json and its profile. The
+    # segments are written before the function returns.
+    ex_id = example['example_id']
+    audio_root = storage_dir / example['overlap_condition'] / ex_id
     sro = None
-    for example in dlp_mpi.split_managed(ds, allow_single_worker=True):
-        ex_id = example['example_id']
-        audio_root = storage_dir / example['overlap_condition'] / ex_id
-
+    segmented = {}
+    # All segments are written when the writer is closed at the end of the
+    # with statement
+    with AudioWriter(num_writers, max_pending_writes) as writer, \
+            profiling.Profiler(profile, trace_memory) as profiler:
+        # Recording from which the segments are taken (used for the virtual
+        # segmentation)
+        source_device = None
         if audio_key == 'played_signals':
-            sigs = pb.io.load_audio(example['audio_path']['played_signals'])
+            source_path = example['audio_path']['played_signals']
+            with profiling.stage('load'):
+                sigs = pb.io.load_audio(source_path)
         elif isinstance(example['audio_path'][audio_key], str):
             # LibriCSS and 'clean'
-            sig = pb.io.load_audio(example['audio_path'][audio_key])
+            source_path = example['audio_path'][audio_key]
+            with profiling.stage('load'):
+                sig = pb.io.load_audio(source_path)
             if sig.ndim > 1:
                 sig = sig[0]
         else:
@@ -97,7 +135,10 @@ def segment_audio(
             msg = (f'device ({device}) has to be chosen from '
                    f'{list(example["audio_path"][audio_key].keys())}')
             assert device in list(example['audio_path'][audio_key].keys()), msg
-            sig = pb.io.load_audio(example['audio_path'][audio_key][device])
+            source_path = example['audio_path'][audio_key][device]
+            source_device = device
+            with profiling.stage('load'):
+                sig = pb.io.load_audio(source_path)
             if sig.ndim > 1:
                 sig = sig[0]
             # The onsets and offsets specified in the database json are
@@ -106,13 +147,15 @@ def segment_audio(
             # onsets and offsets have to be adapted to match the recordings
             # of the other devices.
             if device != 'Soundcard':
-                ref_ch = pb.io.load_audio(
-                    example['audio_path'][audio_key]['Soundcard']
-                )
+                with profiling.stage('load'):
+                    ref_ch = pb.io.load_audio(
+                        example['audio_path'][audio_key]['Soundcard']
+                    )
                 if ref_ch.ndim > 1:
                     ref_ch = ref_ch[0]
                 sigs = [ref_ch, sig]
-                sro = estimate_sros(sigs)
+                with profiling.stage('sro_estimation'):
+                    sro = estimate_sros(sigs)
                 sro = sro[0]
 
         onsets = example['onset']['original_source']
@@ -136,8 +179,8 @@ def segment_audio(
             )
 
         if audio_key == 'played_signals':
-            ref_activities = np.zeros_like(sigs, bool)
-            for i, sig in enumerate(sigs):
+            ref_activities = []
+            for sig in sigs:
                 energy = np.sum(
                     pb.array.segment_axis(sig[sig > 0], 1024, 256,
                                           end='cut') ** 2,
@@ -145,45 +188,119 @@ def segment_audio(
                 )
                 th = np.min(energy)
                 vad = VoiceActivityDetector(3 * th)
-                ref_activities[i] = vad(sig)[:len(sig)]
-            activities_ = np.zeros_like(sigs, bool)
-            for i, act_intervals in enumerate(activities.values()):
-                for (onset, offset) in act_intervals:
-                    activities_[i, onset:offset] = 1
-            permutation = solve_permutation(activities_, ref_activities)
+                ref_activities.append(
+                    IntervalActivity.from_dense(vad(sig)[:len(sig)])
+                )
+            activities_ = [
+                IntervalActivity(act_intervals, sigs.shape[-1])
+                for act_intervals in activities.values()
+            ]
+            with profiling.stage('permutation'):
+                permutation = \
+                    solve_permutation(activities_, ref_activities)
             spk_ids = list(activities.keys())
             activities_ = list(activities.values())
             activities = {spk_ids[i]:activities_[i] for i in permutation}
 
         for i, (spk_id, act_intervals) in enumerate(activities.items()):
+            source_channel = 0
             if audio_key == 'played_signals':
                 sig = sigs[i]
+                source_channel = i
             path_sep_sigs_target = audio_root / str(spk_id)
             segments = []
             num_samples = []
             onsets = []
             for (onset, offset) in act_intervals:
-                segments.append(sig[onset:offset])
+                # The margin must not shift the onset before the beginning of
+                # the recording, where slicing would wrap around.
+                segments.append(sig[max(onset, 0):offset])
                 onsets.append(onset)
                 num_samples.append(offset-onset)
+            if output_format == 'container' and len(segments) > 0:
+                audio_root.mkdir(parents=True, exist_ok=True)
+                container_path = audio_root / f'segmented{spk_id}.wav'
+                container, container_offsets = pack_segments(segments)
+                with profiling.stage('write'):
+                    writer.submit(container, container_path, normalize=False)
             for idx, segment in enumerate(segments):
-                path_sep_sigs_target.mkdir(parents=True, exist_ok=True)
                 segment_id = f'{ex_id}_{spk_id}_{idx}'
-                audio_path = \
-                    path_sep_sigs_target / f'segmented{spk_id}_{idx}.wav'
                 short_id = \
                     f'{example["overlap_condition"]}_{example["session"]}'
                 segmented[segment_id] = {
-                    "audio_path": audio_path,
                     "short_id": short_id,
                     "speaker_id": str(spk_id),
                     "start_sample": onsets[idx],
                     "stop_sample": onsets[idx] + num_samples[idx]
                 }
-                pb.io.dump_audio(segment, audio_path)
+                if output_format == 'virtual':
+                    # The segment is read from the recording when needed
+                    start = min(max(onsets[idx], 0), len(sig))
+                    segmented[segment_id].update({
+                        "audio_path": source_path,
+                        "device": source_device,
+                        "channel": source_channel,
+                        "audio_start": int(start),
+                        "audio_stop": int(start + len(segment))
+                    })
+                    continue
+                if output_format == 'container':
+                    segmented[segment_id].update({
+                        "audio_path": container_path,
+                        "audio_start": int(container_offsets[idx, 0]),
+                        "audio_stop": int(container_offsets[idx, 1])
+                    })
+                    continue
+                path_sep_sigs_target.mkdir(parents=True, exist_ok=True)
+                audio_path = \
+                    path_sep_sigs_target / f'segmented{spk_id}_{idx}.wav'
+                segmented[segment_id]["audio_path"] = audio_path
+                with profiling.stage('write'):
+                    writer.submit(segment, audio_path)
+    return ex_id, segmented, profiler.report()
+
 
-    all_segments = dlp_mpi.gather(segmented, root=dlp_mpi.MASTER)
-    if dlp_mpi.IS_MASTER:
+@exp.automain
+def segment_audio(
+        db_json, storage_dir, data_set, audio_key, device, margin,
+        num_writers, max_pending_writes, output_format, backend, num_workers,
+        blas_threads, profile, trace_memory
+):
+    msg = 'You have to specify, where your LibriWASN database-json is stored.'
+    assert db_json is not None, msg
+    msg = (f'data_set ({data_set}) has to be chosen from '
+           f'["libricss", "libriwasn200", "libriwasn800"]')
+    assert data_set in ['libricss', 'libriwasn200', 'libriwasn800'], msg
+    assert output_format in ['segments', 'container', 'virtual'], \
+        output_format
+    assert storage_dir is not None,\
+        'You have to specify where the signals should be stored.'
+    storage_dir = Path(storage_dir).absolute()
+    segment_json = storage_dir / 'per_utt.json'
+    ds = JsonDatabase(db_json)
+    ds = ds.get_dataset(data_set)
+
+    # All ranks execute the code between start and finish
+    backend = get_backend(backend, num_workers, blas_threads).start()
+    segment_example = functools.partial(
+        _segment_example, storage_dir=storage_dir, audio_key=audio_key,
+        device=device, margin=margin, num_writers=num_writers,
+        max_pending_writes=max_pending_writes, output_format=output_format,
+        profile=profile, trace_memory=trace_memory
+    )
+    segmented = {}
+    profiles = {}
+    # The longest examples are processed first to balance the load. All
+    # segments of an example are written when its result is returned.
+    for ex_id, segmented_example, report in backend.map(
+            segment_example, longest_first(ds, get_example_duration)
+    ):
+        segmented.update(segmented_example)
+        if profile:
+            profiles[ex_id] = report
+    report_utilisation(backend)
+    all_segments = backend.gather(segmented)
+    if backend.is_master:
         all_segments_flattened = {}
         for seg in all_segments:
             all_segments_flattened.update(seg)
@@ -191,3 +308,8 @@ def segment_audio(
             all_segments_flattened, segment_json
         )
         print(f'Wrote {segment_json}')
+    if profile:
+        all_profiles = backend.gather(profiles)
+        if backend.is_master:
+            profiling.dump_reports(all_profiles, storage_dir / 'profile.json')
+    backend.finish()
@@ -9,23 +9,63 @@ Example calls:
 python -m libriwasn.reference_system.separate_sources with sys2_libricss db_json=/path/to/libriwasn.json
 python -m libriwasn.reference_system.separate_sources with sys3_libriwasn200 db_json=/path/to/libriwasn.json
 python -m libriwasn.reference_system.separate_sources with sys4_libriwasn800 db_json=/path/to/libriwasn.json
+
+All systems at once (see sweep):
+python -m libriwasn.reference_system.separate_sources sweep with data_set=libriwasn200 db_json=/path/to/libriwasn.json
 """
+import contextlib
+import functools
 from pathlib import Path
 
-import dlp_mpi
 from lazy_dataset.database import JsonDatabase
+import numpy as np
 import paderbox as pb
 from sacred import Experiment
 
-from libriwasn.io.audioread import load_signals
-from libriwasn.synchronization.sro import estimate_sros, compensate_for_sros
+from libriwasn.io.audioread import load_synchronized_signals
+from libriwasn.io.audiowrite import AudioWriter, pack_segments
+from libriwasn.io.checkpoint import (
+    dump_record,
+    dump_stage,
+    get_checkpoint_dir,
+    load_record,
+    load_stage,
+    validate_checkpoints
+)
+from libriwasn.io.shared_memory import (
+    load_shared_synchronized_signals,
+    release_shared_signals,
+    remove_shared_signals
+)
+from libriwasn.mask_estimation.channel_selection import select_channels
 from libriwasn.mask_estimation.initialization import get_initialization
 from libriwasn.mask_estimation.cacgmm import get_tf_masks
-from libriwasn.source_extraction.separation import separate_sources
+from libriwasn.parallel import (
+    get_backend,
+    get_example_duration,
+    longest_first,
+    report_utilisation
+)
+from libriwasn import profiling
+from libriwasn.source_extraction import separation
+from libriwasn.source_extraction.separation import get_segment_index
+from libriwasn.source_extraction.chunked import (
+    chunked_separation,
+    get_bytes_per_frame,
+    get_chunk_size
+)
 
 
 exp = Experiment('Separate sources')
 
+# Devices used for the mask estimation and the beamforming (devices_cacgmm,
+# devices_mvdr) by the systems of the LibriWASN paper (see named configs)
+SYSTEM_DEVICES = {
+    'sys2': ('asnupb4', 'asnupb4'),
+    'sys3': ('asnupb4', None),
+    'sys4': (None, None),
+}
+
 
 @exp.config
 def config():
@@ -35,6 +75,81 @@ def config():
     devices_cacgmm = None
     devices_mvdr = None
     ref_device_sync = 'asnupb4'
+    # Upper limit for the number of channels used for the mask estimation.
+    # If None, all channels are used. The beamformer always uses all channels.
+    max_channels_cacgmm = None
+    # Maximum number of speakers per meeting. The spatial mixture model
+    # additionally has a noise class.
+    num_spk = 8
+    # Calculate the beamforming vectors of batch_size_mvdr segments at once.
+    # The SCMs of a batch require batch_size_mvdr x 513 x (number of
+    # channels)^2 complex values.
+    batched_mvdr = False
+    batch_size_mvdr = 64
+    # Number of threads used to extract the speakers' signals concurrently
+    num_workers_mvdr = 1
+    # Process the meetings in overlapping chunks such that the memory
+    # consumption does not depend on the length of the meetings. The
+    # synchronized signals and the separated streams are stored as
+    # memory-mapped files in storage_dir during the processing. The audio
+    # files are read block-wise and synchronized channel by channel. Hence,
+    # only a few single-channel signals of the full length are held in memory
+    # in addition to the memory budget. The budget has to be large enough
+    # for chunks of more than twice the overlap (see get_bytes_per_frame).
+    chunked = False
+    memory_budget = 4 * 1024 ** 3  # Memory budget per chunk in bytes
+    chunk_overlap = 1875  # Overlap of consecutive chunks in frames
+    # Intermediate results which are stored per example in
+    # storage_dir/checkpoints, such that an interrupted run can be resumed
+    # without recomputing them. Completed examples are always skipped. Note
+    # that the initialization and the masks require a lot of disk space and
+    # are not stored in the chunked mode. Checkpoints (including completed
+    # examples) which were created with other parameters (e.g., other
+    # devices or another num_spk) are removed and recomputed (see
+    # validate_checkpoints).
+    checkpoint_stages = ['sros', 'segment_index']
+    # The enhanced signals are written by num_writers background threads,
+    # which overlap with the remaining processing of the example (e.g., the
+    # beamforming of the next system in a sweep). At most max_pending_writes
+    # signals wait to be written. If num_writers is 0, the signals are
+    # written synchronously.
+    num_writers = 4
+    max_pending_writes = 64
+    # 'segments': Write each enhanced segment into its own audio file.
+    # 'container': Write all segments of a speaker into a single audio file
+    # per session. The entries of the per_utt.json additionally specify the
+    # position of the segment within this file (audio_start, audio_stop).
+    output_format = 'segments'
+    # 'mpi': Distribute the examples via MPI (start the script with mpiexec).
+    # 'processes': Spawn num_workers worker processes on this node (no MPI
+    # needed).
+    # blas_threads limits the number of BLAS threads per process to avoid an
+    # oversubscription of the CPU cores (None: no limit for 'mpi' and the
+    # number of cores divided by num_workers for 'processes').
+    backend = 'mpi'
+    num_workers = None
+    blas_threads = None
+    # Publish the synchronized signals in POSIX shared memory, such that other
+    # runs on the same node which process the same example with the same
+    # devices (e.g., runs with other configs) attach to them instead of
+    # loading and synchronizing them again. Within a run, each example is
+    # processed by a single worker. Hence, only enable this if several runs
+    # share the signals. If unlink_shared_memory is True, the signals are
+    # removed after the example was processed, such that only runs which
+    # process the example at the same time share them. Otherwise, they are
+    # kept for subsequent runs and have to be removed afterwards via the
+    # command remove_shared_memory.
+    shared_memory = False
+    unlink_shared_memory = True
+    # Record the time and the memory consumption of the processing stages
+    # per example (see libriwasn.profiling). The reports of all examples and
+    # a summary are written to storage_dir/profile.json. If trace_memory is
+    # True, the memory allocations are additionally traced via tracemalloc,
+    # which slows down the processing.
+    profile = False
+    trace_memory = False
+    # Systems which are computed by the sweep command (see SYSTEM_DEVICES)
+    systems = ['sys2', 'sys3', 'sys4']
 
 
 @exp.named_config
@@ -87,91 +202,645 @@ def sys4_libriwasn800():
     data_set = 'libriwasn800'
 
 
-@exp.automain
-def separate_sources(
-        db_json, storage_dir, data_set, devices_cacgmm,
-        devices_mvdr, ref_device_sync
+def _get_record(example, segment_index, audio_root, output_format):
+    short_id = f'{example["overlap_condition"]}_{example["session"]}'
+    record = {}
+    for spk_id, segments_spk in enumerate(segment_index):
+        # Position of the segments within the container of the speaker
+        # (see pack_segments)
+        container_offset = 0
+        for idx, (start, stop) in enumerate(segments_spk):
+            segment_id = f'{example["example_id"]}_{spk_id}_{idx}'
+            record[segment_id] = {
+                "dataset": "eval",
+                "short_id": short_id,
+                "speaker_id": str(spk_id),
+                "start_sample": int(start),
+                "stop_sample": int(stop)
+            }
+            if output_format == 'container':
+                record[segment_id].update({
+                    "audio_path": audio_root / f'enhanced{spk_id}.wav',
+                    "audio_start": container_offset,
+                    "audio_stop": container_offset + int(stop - start)
+                })
+                container_offset += int(stop - start)
+            else:
+                record[segment_id]["audio_path"] = \
+                    audio_root / str(spk_id) / f'enhanced{spk_id}_{idx}.wav'
+    return record
+
+
+def _write_enhanced_signals(
+        writer, separated_sigs, record, ex_id, output_format
+):
+    futures = []
+    for spk_id, sigs_spk in enumerate(separated_sigs):
+        if output_format == 'container':
+            if len(sigs_spk) == 0:
+                continue
+            audio_path = record[f'{ex_id}_{spk_id}_0']['audio_path']
+            audio_path.parent.mkdir(parents=True, exist_ok=True)
+            container, _ = pack_segments(sigs_spk)
+            futures.append(
+                writer.submit(container, audio_path, normalize=False)
+            )
+            continue
+        for idx, sig in enumerate(sigs_spk):
+            audio_path = record[f'{ex_id}_{spk_id}_{idx}']['audio_path']
+            audio_path.parent.mkdir(parents=True, exist_ok=True)
+            futures.append(writer.submit(sig, audio_path))
+    return futures
+
+
+def _select_cacgmm_channels(sigs, channels, max_channels_cacgmm):
+    # Select the channels for the mask estimation based on the time domain
+    # signals, such that the STFT of the remaining channels is not needed.
+    if max_channels_cacgmm is None:
+        return channels
+    channels = np.arange(len(sigs))[channels]
+    return channels[select_channels(
+        [sigs[ch] for ch in channels], max_channels_cacgmm
+    )]
+
+
+def _get_stft(sigs, channel_sets):
+    # Calculate the STFT only of the channels which are part of any of the
+    # channel sets and map each channel set to the rows of the STFT
+    indices = [np.arange(len(sigs))[channels] for channels in channel_sets]
+    used = np.unique(np.concatenate(indices))
+    if len(used) == len(sigs):
+        return pb.transform.stft(sigs), list(channel_sets)
+    y = pb.transform.stft(sigs[used])
+    return y, [np.searchsorted(used, index) for index in indices]
+
+
+def _dump_segment_json(ds, storage_dir, segment_json):
+    # The per_utt.json is assembled from the records of the examples, which
+    # survive an interrupted run.
+    all_segments_flattened = {}
+    for example in ds:
+        record = load_record(
+            get_checkpoint_dir(storage_dir, example['example_id'])
+        )
+        assert record is not None, example['example_id']
+        all_segments_flattened.update(record)
+    pb.io.dump_json(
+        all_segments_flattened, segment_json
+    )
+    print(f'Wrote: {segment_json}', flush=True)
+
+
+def _get_checkpoint_config(
+        devices_cacgmm, devices_mvdr, ref_device_sync, max_channels_cacgmm,
+        num_spk, batched_mvdr, batch_size_mvdr, output_format, chunked=False,
+        memory_budget=None, chunk_overlap=None
+):
+    # Parameters which affect the checkpoints of an example (see
+    # validate_checkpoints). The parameters are identical for sweep and the
+    # main command if a system is processed in the same way.
+    config = dict(
+        devices_cacgmm=devices_cacgmm, devices_mvdr=devices_mvdr,
+        ref_device_sync=ref_device_sync,
+        max_channels_cacgmm=max_channels_cacgmm, num_spk=num_spk,
+        batched_mvdr=batched_mvdr, output_format=output_format,
+        chunked=chunked
+    )
+    if batched_mvdr:
+        config['batch_size_mvdr'] = batch_size_mvdr
+    if chunked:
+        config['memory_budget'] = memory_budget
+        config['chunk_overlap'] = chunk_overlap
+    return config
+
+
+def _invalidate_stale_checkpoints(checkpoint_dir, config):
+    if validate_checkpoints(checkpoint_dir, config):
+        print(
+            f'Removed the checkpoints in {checkpoint_dir}, which were '
+            f'created with another configuration', flush=True
+        )
+
+
+@contextlib.contextmanager
+def _temporary_files():
+    # Yields a list to which temporary files can be appended. The files are
+    # removed on exit, also if the processing fails.
+    tmp_files = []
+    try:
+        yield tmp_files
+    finally:
+        for file in tmp_files:
+            file.unlink(missing_ok=True)
+
+
+def _open_streams(tmp_dir, tmp_files, ex_id, shape):
+    # Memory-mapped output streams, one per speaker (see separate_sources),
+    # such that the enhanced signals do not occupy memory in addition to the
+    # STFT and the masks
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    tmp_files.append(tmp_dir / f'{ex_id}_streams.npy')
+    return np.lib.format.open_memmap(
+        tmp_files[-1], mode='w+', dtype=np.float64, shape=shape
+    )
+
+
+def _sweep_example(
+        example, systems, system_devices, storage_dirs, ref_device_sync,
+        max_channels_cacgmm, num_spk, batched_mvdr, batch_size_mvdr,
+        num_workers_mvdr, num_writers, max_pending_writes, output_format,
+        profile, trace_memory
+):
+    # Separate the sources of a single example with all systems (see sweep)
+    # and return its ID and its profile (None if all systems already
+    # completed the example). The enhanced signals and the records of the
+    # example are written before the function returns.
+    ex_id = example['example_id']
+    for system in systems:
+        _invalidate_stale_checkpoints(
+            get_checkpoint_dir(storage_dirs[system], ex_id),
+            _get_checkpoint_config(
+                *system_devices[system], ref_device_sync,
+                max_channels_cacgmm, num_spk, batched_mvdr, batch_size_mvdr,
+                output_format
+            )
+        )
+    todo = [
+        system for system in systems
+        if load_record(get_checkpoint_dir(storage_dirs[system], ex_id))
+        is None
+    ]
+    if len(todo) == 0:
+        return ex_id, None
+
+    records = {}
+    # All enhanced signals are written when the writer is closed at the end
+    # of the with statement. Afterwards, the temporary files are removed.
+    with _temporary_files() as tmp_files, \
+            AudioWriter(num_writers, max_pending_writes) as writer, \
+            profiling.Profiler(profile, trace_memory) as profiler:
+        # Load and synchronize the union of all devices of all systems once.
+        # Each distinct device selection gets its channel indices.
+        device_selections = []
+        for system in todo:
+            for devices in system_devices[system]:
+                selection = (devices, not isinstance(devices, str))
+                if selection not in device_selections:
+                    device_selections.append(selection)
+        sigs, channels = load_synchronized_signals(
+            example, device_selections, ref_device=ref_device_sync
+        )
+        # The channels for the mask estimation are selected per device
+        # selection before the STFT is calculated
+        channels_cacgmm = {}
+        for system in todo:
+            devices_cacgmm = system_devices[system][0]
+            selection = (devices_cacgmm, not isinstance(devices_cacgmm, str))
+            if repr(selection) not in channels_cacgmm:
+                channels_cacgmm[repr(selection)] = _select_cacgmm_channels(
+                    sigs, channels[device_selections.index(selection)],
+                    max_channels_cacgmm
+                )
+        channels_mvdr = {}
+        for system in todo:
+            devices_mvdr = system_devices[system][1]
+            selection = (devices_mvdr, not isinstance(devices_mvdr, str))
+            channels_mvdr[repr(selection)] = \
+                channels[device_selections.index(selection)]
+        with profiling.stage('stft'):
+            y, stft_channels = _get_stft(
+                sigs,
+                list(channels_cacgmm.values()) + list(channels_mvdr.values())
+            )
+        channels_cacgmm = dict(zip(
+            channels_cacgmm.keys(), stft_channels[:len(channels_cacgmm)]
+        ))
+        channels_mvdr = dict(zip(
+            channels_mvdr.keys(), stft_channels[len(channels_cacgmm):]
+        ))
+        num_samples = sigs.shape[-1]
+        del sigs  # reduce memory consumption
+
+        # Estimate the masks once per device selection
+        masks = {}
+        for system in todo:
+            devices_cacgmm = system_devices[system][0]
+            selection = (devices_cacgmm, not isinstance(devices_cacgmm, str))
+            if repr(selection) in masks:
+                continue
+            y_cacgmm = y[channels_cacgmm[repr(selection)]]
+            with profiling.stage('initialization'):
+                mm_init, mm_guide = get_initialization(
+                    y_cacgmm, num_spk=num_spk
+                )
+            with profiling.stage('masks'):
+                masks[repr(selection)] = \
+                    get_tf_masks(y_cacgmm, mm_init, mm_guide)
+            del y_cacgmm, mm_init, mm_guide
+
+        # Beamforming for each system
+        for system in todo:
+            devices_cacgmm, devices_mvdr = system_devices[system]
+            selection = (devices_mvdr, not isinstance(devices_mvdr, str))
+            masks_system, priors = masks[repr(
+                (devices_cacgmm, not isinstance(devices_cacgmm, str))
+            )]
+            with profiling.stage('beamforming'):
+                # The enhanced segments are views of one stream per speaker
+                # (see separate_sources)
+                streams = _open_streams(
+                    storage_dirs[system] / 'tmp', tmp_files, ex_id,
+                    (len(masks_system) - 1, num_samples)
+                )
+                separated_sigs, segment_onsets = separation.separate_sources(
+                    y[channels_mvdr[repr(selection)]],
+                    masks_system, priors, batched=batched_mvdr,
+                    batch_size=batch_size_mvdr, num_workers=num_workers_mvdr,
+                    out=streams
+                )
+            segment_index = get_segment_index(separated_sigs, segment_onsets)
+            audio_root = \
+                storage_dirs[system] / example['overlap_condition'] / ex_id
+            record = _get_record(
+                example, segment_index, audio_root, output_format
+            )
+            with profiling.stage('write'):
+                _write_enhanced_signals(
+                    writer, separated_sigs, record, ex_id, output_format
+                )
+            del separated_sigs, streams
+            records[system] = record
+        # reduce memory consumption
+        del y, masks
+    # The records mark the example as completed and are therefore written
+    # after all enhanced signals.
+    for system, record in records.items():
+        dump_record(get_checkpoint_dir(storage_dirs[system], ex_id), record)
+    return ex_id, profiler.report()
+
+
+@exp.command
+def sweep(
+        db_json, storage_dir, data_set, systems, ref_device_sync,
+        max_channels_cacgmm, num_spk, batched_mvdr, batch_size_mvdr,
+        num_workers_mvdr, num_writers, max_pending_writes, output_format,
+        backend, num_workers, blas_threads, profile, trace_memory
 ):
+    """
+    Separate the sources with several systems at once. The signals of each
+    example are loaded, synchronized and transformed into the STFT domain
+    only once for all systems and the masks are only estimated once for all
+    systems which use the same devices for the mask estimation (e.g., sys2
+    and sys3). Only the beamforming is done for each system. The results of
+    each system are stored in storage_dir/<system>_<data_set> as if the
+    system was run on its own. LibriCSS is not supported, because it only
+    provides the recordings of a single device (see sys2_libricss).
+
+    Example call:
+    python -m libriwasn.reference_system.separate_sources sweep with data_set=libriwasn200 db_json=/path/to/libriwasn.json
+    """
     msg = 'You have to specify, where your LibriWASN database-json is stored.'
     assert db_json is not None, msg
+    assert output_format in ['segments', 'container'], output_format
+    if storage_dir is None:
+        storage_dir = 'separated_sources/'
     storage_dir = Path(storage_dir).absolute()
-    segment_json = storage_dir / 'per_utt.json'
+    if data_set == 'libricss':
+        # LibriCSS only provides the recordings of a single device. Hence,
+        # there is nothing to share between several systems.
+        raise ValueError(
+            'The sweep command does not support LibriCSS. Use the main '
+            'command with the named config sys2_libricss instead.'
+        )
+    system_devices = {system: SYSTEM_DEVICES[system] for system in systems}
+    storage_dirs = {
+        system: storage_dir / f'{system}_{data_set}' for system in systems
+    }
     ds = JsonDatabase(db_json)
     ds = ds.get_dataset(data_set)
 
-    enhanced_segments = {}
-    for example in dlp_mpi.split_managed(ds, allow_single_worker=True):
-        ex_id = example['example_id']
-        audio_root = \
-            storage_dir / example['overlap_condition'] / example["example_id"]
+    # All ranks execute the code between start and finish
+    backend = get_backend(backend, num_workers, blas_threads).start()
+    sweep_example = functools.partial(
+        _sweep_example, systems=systems, system_devices=system_devices,
+        storage_dirs=storage_dirs, ref_device_sync=ref_device_sync,
+        max_channels_cacgmm=max_channels_cacgmm, num_spk=num_spk,
+        batched_mvdr=batched_mvdr, batch_size_mvdr=batch_size_mvdr,
+        num_workers_mvdr=num_workers_mvdr, num_writers=num_writers,
+        max_pending_writes=max_pending_writes, output_format=output_format,
+        profile=profile, trace_memory=trace_memory
+    )
+    completed = []
+    profiles = {}
+    # The longest examples are processed first to balance the load
+    for ex_id, report in backend.map(
+            sweep_example, longest_first(ds, get_example_duration)
+    ):
+        completed.append(ex_id)
+        if report is not None:
+            profiles[ex_id] = report
 
-        # estimate time frequency masks
-        if isinstance(devices_cacgmm, str):
-            single_ch = False
-        else:
-            single_ch = True
+    report_utilisation(backend)
+    backend.gather(completed)
+    if backend.is_master:
+        for system in systems:
+            _dump_segment_json(
+                ds, storage_dirs[system],
+                storage_dirs[system] / 'per_utt.json'
+            )
+    if profile:
+        all_profiles = backend.gather(profiles)
+        if backend.is_master:
+            profiling.dump_reports(all_profiles, storage_dir / 'profile.json')
+    backend.finish()
+
+
+def _separate_example(
+        example, storage_dir, devices_cacgmm, devices_mvdr, ref_device_sync,
+        max_channels_cacgmm, batched_mvdr, batch_size_mvdr, num_workers_mvdr,
+        num_spk, chunked, memory_budget, chunk_overlap, checkpoint_stages,
+        num_writers, max_pending_writes, output_format, shared_memory,
+        unlink_shared_memory, profile, trace_memory
+):
+    # Separate the sources of a single example (see separate_sources) and
+    # return its ID and its profile (None if the example was already
+    # completed). The enhanced signals and the record of the example are
+    # written before the function returns.
+    ex_id = example['example_id']
+    audio_root = storage_dir / example['overlap_condition'] / ex_id
+    checkpoint_dir = get_checkpoint_dir(storage_dir, ex_id)
+    _invalidate_stale_checkpoints(
+        checkpoint_dir,
+        _get_checkpoint_config(
+            devices_cacgmm, devices_mvdr, ref_device_sync,
+            max_channels_cacgmm, num_spk, batched_mvdr, batch_size_mvdr,
+            output_format, chunked=chunked, memory_budget=memory_budget,
+            chunk_overlap=chunk_overlap
+        )
+    )
+    if load_record(checkpoint_dir) is not None:
+        return ex_id, None
 
-        sigs, devices = load_signals(
-            example, devices=devices_cacgmm, single_ch=single_ch,
-            ref_device=ref_device_sync, return_devices=True
+    # If the run was interrupted after all enhanced signals were written,
+    # only the record of the example is missing.
+    stage = load_stage(checkpoint_dir, 'segment_index')
+    if stage is not None:
+        segment_index = \
+            [stage[str(spk_id)] for spk_id in range(len(stage))]
+        record = _get_record(
+            example, segment_index, audio_root, output_format
         )
-        if len(devices) > 1:
-            sros = estimate_sros(sigs)
-            sigs = compensate_for_sros(sigs, sros)
-            del sros  # reduce memory consumption
-        y = pb.transform.stft(sigs)
-
-        mm_init, mm_guide = get_initialization(y)
-        masks, priors = get_tf_masks(y, mm_init, mm_guide)
-
-        # separate sources
-        if devices_cacgmm != devices_mvdr:
-            if isinstance(devices_cacgmm, str):
-                single_ch = False
+        if all([
+            Path(segment['audio_path']).exists()
+            for segment in record.values()
+        ]):
+            dump_record(checkpoint_dir, record)
+            return ex_id, None
+
+    tmp_dir = storage_dir / 'tmp'
+    # All enhanced signals are written when the writer is closed at the end
+    # of the with statement. Afterwards, the memory-mapped files, of which
+    # the enhanced signals are views, are removed.
+    with _temporary_files() as tmp_files, \
+            AudioWriter(num_writers, max_pending_writes) as writer, \
+            profiling.Profiler(profile, trace_memory) as profiler:
+        # The union of the devices used for the mask estimation and the
+        # beamforming is loaded and synchronized only once.
+        device_selections = [
+            (devices, not isinstance(devices, str))
+            for devices in [devices_cacgmm, devices_mvdr]
+        ]
+        sros = load_stage(checkpoint_dir, 'sros')
+        store_sros = sros is None and 'sros' in checkpoint_stages
+        shm = None
+        if shared_memory:
+            sigs, (channels_cacgmm, channels_mvdr), sros, shm = \
+                load_shared_synchronized_signals(
+                    example, device_selections,
+                    ref_device=ref_device_sync, sros=sros
+                )
+        elif chunked:
+            # The signals are synchronized channel by channel into a
+            # memory-mapped file (see load_synchronized_signals).
+            tmp_dir.mkdir(parents=True, exist_ok=True)
+            tmp_files.append(tmp_dir / f'{ex_id}_sigs.npy')
+            sigs, (channels_cacgmm, channels_mvdr), sros = \
+                load_synchronized_signals(
+                    example, device_selections,
+                    ref_device=ref_device_sync,
+                    memmap_path=tmp_files[-1], sros=sros,
+                    return_sros=True
+                )
+        else:
+            sigs, (channels_cacgmm, channels_mvdr), sros = \
+                load_synchronized_signals(
+                    example, device_selections,
+                    ref_device=ref_device_sync, sros=sros,
+                    return_sros=True
+                )
+        # The SROs are not available if the signals were published in
+        # shared memory by another process
+        if store_sros and sros is not None:
+            dump_stage(checkpoint_dir, 'sros', **sros)
+        if chunked:
+            num_channels_cacgmm = \
+                len(np.arange(len(sigs))[channels_cacgmm])
+            if max_channels_cacgmm is not None:
+                num_channels_cacgmm = \
+                    min(num_channels_cacgmm, max_channels_cacgmm)
+            chunk_size = get_chunk_size(
+                len(sigs), memory_budget, num_classes=num_spk + 1,
+                num_channels_cacgmm=num_channels_cacgmm
+            )
+            if chunk_size <= 2 * chunk_overlap:
+                min_memory_budget = (2 * chunk_overlap + 1) \
+                    * get_bytes_per_frame(
+                        len(sigs), num_classes=num_spk + 1,
+                        num_channels_cacgmm=num_channels_cacgmm
+                    )
+                raise ValueError(
+                    f'A memory_budget of {memory_budget} bytes yields '
+                    f'chunks of {chunk_size} frames for {len(sigs)} '
+                    f'channels, which do not exceed twice the '
+                    f'chunk_overlap of {chunk_overlap} frames. Increase '
+                    f'memory_budget to at least {min_memory_budget} '
+                    f'bytes or decrease chunk_overlap.'
+                )
+            streams = _open_streams(
+                tmp_dir, tmp_files, ex_id, (num_spk, sigs.shape[-1])
+            )
+            separated_sigs, segment_onsets = chunked_separation(
+                sigs, streams, chunk_size, chunk_overlap=chunk_overlap,
+                num_spk=num_spk,
+                cacgmm_channels=np.arange(len(sigs))[channels_cacgmm],
+                mvdr_channels=np.arange(len(sigs))[channels_mvdr],
+                max_channels_cacgmm=max_channels_cacgmm,
+                batched=batched_mvdr, batch_size=batch_size_mvdr,
+                num_workers=num_workers_mvdr
+            )
+            del sigs, streams
+            if shm is not None:
+                release_shared_signals(shm, unlink=unlink_shared_memory)
+        else:
+            # The STFT is only calculated for the channels used for the
+            # beamforming and, if the masks are not available yet, for the
+            # channels selected for the mask estimation.
+            stage = load_stage(checkpoint_dir, 'masks')
+            if stage is None:
+                channels_cacgmm = _select_cacgmm_channels(
+                    sigs, channels_cacgmm, max_channels_cacgmm
+                )
+                with profiling.stage('stft'):
+                    y, (channels_cacgmm, channels_mvdr) = \
+                        _get_stft(sigs, [channels_cacgmm, channels_mvdr])
+            else:
+                with profiling.stage('stft'):
+                    y, (channels_mvdr,) = _get_stft(sigs, [channels_mvdr])
+            num_samples = sigs.shape[-1]
+            del sigs  # reduce memory consumption
+            if shm is not None:
+                release_shared_signals(shm, unlink=unlink_shared_memory)
+
+            # estimate time frequency masks
+            if stage is None:
+                y_cacgmm = y[channels_cacgmm]
+                stage = load_stage(checkpoint_dir, 'initialization')
+                if stage is None:
+                    with profiling.stage('initialization'):
+                        mm_init, mm_guide = get_initialization(
+                            y_cacgmm, num_spk=num_spk
+                        )
+                    if 'initialization' in checkpoint_stages:
+                        dump_stage(
+                            checkpoint_dir, 'initialization',
+                            mm_init=mm_init, mm_guide=mm_guide
+                        )
+                else:
+                    mm_init, mm_guide = \
+                        stage['mm_init'], stage['mm_guide']
+                with profiling.stage('masks'):
+                    masks, priors = \
+                        get_tf_masks(y_cacgmm, mm_init, mm_guide)
+                if 'masks' in checkpoint_stages:
+                    dump_stage(
+                        checkpoint_dir, 'masks',
+                        masks=masks, priors=priors
+                    )
+                del y_cacgmm, mm_init, mm_guide
             else:
-                single_ch = True
+                masks, priors = stage['masks'], stage['priors']
+            del stage
 
-            sigs, devices = load_signals(
-                example, devices=devices_mvdr, single_ch=single_ch,
-                ref_device=ref_device_sync, return_devices=True
+            # separate sources. The enhanced segments are overlap-added
+            # into one stream per speaker instead of being allocated
+            # separately. The segments of a speaker are separated by at
+            # least the erosion kernel of the activity estimation (see
+            # estimate_activity). Hence, they do not overlap and the
+            # returned views of the streams are identical to separately
+            # allocated segments.
+            streams = _open_streams(
+                tmp_dir, tmp_files, ex_id, (len(masks) - 1, num_samples)
             )
-            if len(devices) > 1:
-                sros = estimate_sros(sigs)
-                sigs = compensate_for_sros(sigs, sros)
-                del sros  # reduce memory consumption
-            y = pb.transform.stft(sigs)
-        separated_sigs, segment_onsets = separate_sources(y, masks, priors)
-
-        for spk_id in range(len(separated_sigs)):
-            path_sep_sigs_target = audio_root / str(spk_id)
-            sigs_spk = separated_sigs[spk_id]
-            onsets_spk = segment_onsets[spk_id]
-            for idx, sig in enumerate(sigs_spk):
-                if not path_sep_sigs_target.exists():
-                    path_sep_sigs_target.mkdir(parents=True)
-                segment_id = f'{ex_id}_{spk_id}_{idx}'
-                audio_path = \
-                    path_sep_sigs_target / f'enhanced{spk_id}_{idx}.wav'
-                short_id = \
-                    f'{example["overlap_condition"]}_{example["session"]}'
-                enhanced_segments[segment_id] = {
-                    "audio_path": audio_path,
-                    "dataset": "eval",
-                    "short_id": short_id,
-                    "speaker_id": str(spk_id),
-                    "start_sample": onsets_spk[idx],
-                    "stop_sample": onsets_spk[idx] + len(sig)
-                }
-                pb.io.dump_audio(sig, audio_path)
-        # reduce memory consumption
-        del sigs, y, mm_init, mm_guide, masks, priors, separated_sigs
-
-    all_enh_segments = dlp_mpi.gather(enhanced_segments, root=dlp_mpi.MASTER)
-    if dlp_mpi.IS_MASTER:
-        all_segments_flattened = {}
-        for seg in all_enh_segments:
-            all_segments_flattened.update(seg)
-        pb.io.dump_json(
-            all_segments_flattened, segment_json
+            with profiling.stage('beamforming'):
+                separated_sigs, segment_onsets = \
+                    separation.separate_sources(
+                        y[channels_mvdr], masks, priors,
+                        batched=batched_mvdr, batch_size=batch_size_mvdr,
+                        num_workers=num_workers_mvdr, out=streams
+                    )
+            # reduce memory consumption
+            del y, masks, priors, streams
+
+        segment_index = get_segment_index(separated_sigs, segment_onsets)
+        if 'segment_index' in checkpoint_stages:
+            dump_stage(
+                checkpoint_dir, 'segment_index',
+                **{str(spk_id): segments_spk
+                   for spk_id, segments_spk in enumerate(segment_index)}
+            )
+        record = _get_record(
+            example, segment_index, audio_root, output_format
         )
-        print(f'Wrote: {segment_json}', flush=True)
+        # Only the time spent on waiting for free slots of the writer is
+        # recorded, since the signals are written in the background.
+        with profiling.stage('write'):
+            _write_enhanced_signals(
+                writer, separated_sigs, record, ex_id, output_format
+            )
+        # reduce memory consumption
+        del separated_sigs
+    # The record marks the example as completed and is therefore written
+    # after all enhanced signals.
+    dump_record(checkpoint_dir, record)
+    return ex_id, profiler.report()
+
+
+@exp.command
+def remove_shared_memory():
+    """
+    Remove the synchronized signals which were kept in shared memory
+    (shared_memory=True, unlink_shared_memory=False) or left behind by
+    killed processes. Must not be called while other runs use them.
+
+    Example call:
+    python -m libriwasn.reference_system.separate_sources remove_shared_memory
+    """
+    names = remove_shared_signals()
+    print(f'Removed {len(names)} shared memory segments', flush=True)
+
+
+@exp.automain
+def separate_sources(
+        db_json, storage_dir, data_set, devices_cacgmm,
+        devices_mvdr, ref_device_sync, max_channels_cacgmm,
+        batched_mvdr, batch_size_mvdr, num_workers_mvdr, num_spk, chunked,
+        memory_budget, chunk_overlap, checkpoint_stages, num_writers,
+        max_pending_writes, output_format,
+        backend, num_workers, blas_threads, shared_memory,
+        unlink_shared_memory, profile, trace_memory
+):
+    msg = 'You have to specify, where your LibriWASN database-json is stored.'
+    assert db_json is not None, msg
+    assert output_format in ['segments', 'container'], output_format
+    storage_dir = Path(storage_dir).absolute()
+    segment_json = storage_dir / 'per_utt.json'
+    ds = JsonDatabase(db_json)
+    ds = ds.get_dataset(data_set)
+
+    # All ranks execute the code between start and finish
+    backend = get_backend(backend, num_workers, blas_threads).start()
+    separate_example = functools.partial(
+        _separate_example, storage_dir=storage_dir,
+        devices_cacgmm=devices_cacgmm, devices_mvdr=devices_mvdr,
+        ref_device_sync=ref_device_sync,
+        max_channels_cacgmm=max_channels_cacgmm, batched_mvdr=batched_mvdr,
+        batch_size_mvdr=batch_size_mvdr, num_workers_mvdr=num_workers_mvdr,
+        num_spk=num_spk, chunked=chunked, memory_budget=memory_budget,
+        chunk_overlap=chunk_overlap,
+        checkpoint_stages=checkpoint_stages, num_writers=num_writers,
+        max_pending_writes=max_pending_writes, output_format=output_format,
+        shared_memory=shared_memory,
+        unlink_shared_memory=unlink_shared_memory, profile=profile,
+        trace_memory=trace_memory
+    )
+    completed = []
+    profiles = {}
+    # The longest examples are processed first to balance the load
+    for ex_id, report in backend.map(
+            separate_example, longest_first(ds, get_example_duration)
+    ):
+        completed.append(ex_id)
+        if report is not None:
+            profiles[ex_id] = report
+
+    # The per_utt.json is assembled from the records of the examples, which
+    # survive an interrupted run.
+    report_utilisation(backend)
+    backend.gather(completed)
+    if backend.is_master:
+        _dump_segment_json(ds, storage_dir, segment_json)
+    if profile:
+        all_profiles = backend.gather(profiles)
+        if backend.is_master:
+            profiling.dump_reports(all_profiles, storage_dir / 'profile.json')
+    backend.finish()
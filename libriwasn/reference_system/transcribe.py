@@ -4,18 +4,78 @@ Transcribe a set of audio files
 Example calls:
 python -m libriwasn.reference_system.transcribe --json_path /path/to/per_utt.json
 python -m libriwasn.reference_system.transcribe --json_path /path/to/per_utt.json --enable_gpu=True
+python -m libriwasn.reference_system.transcribe --json_path /path/to/per_utt.json --cache_dir /path/to/asr_cache
 
 Call 'python -m libriwasn.reference_system.transcribe --help' to get an overview of all options
 """
+import functools
 from pathlib import Path
 
 import click
-import dlp_mpi
 import lazy_dataset.database
 import paderbox as pb
 from meeteval.io.stm import STMLine, STM
 
 from libriwasn.asr.espnet_wrapper import ESPnetASR
+from libriwasn.parallel import (
+    get_backend,
+    get_segment_duration,
+    longest_first,
+    report_utilisation
+)
+
+
+def _transcribe(asr, utts, batch_size):
+    # Segments stored in a container file or taken from the recording
+    # (virtual segmentation) specify their position within the file.
+    files = [utt['audio_path'] for utt in utts]
+    starts = [utt.get('audio_start', 0) for utt in utts]
+    stops = [utt.get('audio_stop', None) for utt in utts]
+    channels = [utt.get('channel', None) for utt in utts]
+    if batch_size == 1:
+        texts = [
+            asr.apply_asr(file, start=start, stop=stop, channel=channel)
+            for file, start, stop, channel
+            in zip(files, starts, stops, channels)
+        ]
+    else:
+        texts = asr.apply_asr_batch(
+            files, starts, stops, channels, batch_size=batch_size
+        )
+    return [
+        STMLine(
+            filename=utt['short_id'],
+            channel='0',
+            speaker_id=utt['speaker_id'],
+            begin_time=utt['start_sample'],
+            end_time=utt['stop_sample'],
+            transcript=text,
+        )
+        for utt, text in zip(utts, texts)
+    ]
+
+
+@functools.lru_cache(maxsize=None)
+def _get_asr(asr_model_dir, enable_gpu, cache_dir):
+    # The ASR model is loaded only once per process
+    return ESPnetASR(
+        model_dir=asr_model_dir, enable_gpu=enable_gpu, cache_dir=cache_dir
+    )
+
+
+def _transcribe_batch(
+        utts, asr_model_dir, enable_gpu, cache_dir, batch_size
+):
+    # Transcribe a batch of utterances (see _transcribe) and return the STM
+    # lines together with the number of cache hits and misses of the batch
+    asr = _get_asr(asr_model_dir, enable_gpu, cache_dir)
+    if asr.cache is None:
+        return _transcribe(asr, utts, batch_size), (0, 0)
+    num_hits, num_misses = asr.cache.num_hits, asr.cache.num_misses
+    stm_lines = _transcribe(asr, utts, batch_size)
+    return stm_lines, (
+        asr.cache.num_hits - num_hits, asr.cache.num_misses - num_misses
+    )
 
 
 @click.command()
@@ -46,7 +106,51 @@ from libriwasn.asr.espnet_wrapper import ESPnetASR
     default=False,
     help='Enabe GPU-based decoding. GPU-based decoding is disabled by default'
 )
-def main(json_path, output_dir, asr_model_dir, enable_gpu):
+@click.option(
+    '--backend',
+    type=click.Choice(['mpi', 'processes']),
+    default='mpi',
+    help=('Distribute the utterances via MPI (start the script with mpiexec) '
+          'or spawn num_workers worker processes on this node (no MPI '
+          'needed).')
+)
+@click.option(
+    '--num_workers',
+    type=int,
+    default=None,
+    help=('Number of worker processes of the processes backend. Defaults to '
+          'the number of CPU cores.')
+)
+@click.option(
+    '--blas_threads',
+    type=int,
+    default=None,
+    help=('Maximum number of BLAS threads per process. Defaults to no limit '
+          'for mpi and the number of CPU cores divided by num_workers for '
+          'processes.')
+)
+@click.option(
+    '--batch_size',
+    type=int,
+    default=1,
+    help=('Number of utterances which are transcribed together. The segments '
+          'of these utterances are grouped into batches of similar length, '
+          'which are processed by the encoder at once. Defaults to '
+          'transcribing the utterances one by one.')
+)
+@click.option(
+    '--cache_dir',
+    type=str,
+    default=None,
+    help=('Directory of a persistent cache of the transcriptions. Utterances '
+          'whose audio samples, ASR model, decoding and segmentation '
+          'parameters and ESPnet version did not change since a previous run '
+          'are not decoded again. Defaults to no cache.')
+)
+def main(
+        json_path, output_dir, asr_model_dir, enable_gpu, backend, num_workers,
+        blas_threads, batch_size, cache_dir
+):
     msg = ('You have to define the path of the json file containting the '
            'files to be transcribed.')
     assert json_path is not None, msg
@@ -54,24 +158,42 @@ def main(json_path, output_dir, asr_model_dir, enable_gpu):
     if output_dir is not None:
         output_dir = Path(output_dir).absolute()
 
-    apply_asr = \
-        ESPnetASR(model_dir=asr_model_dir, enable_gpu=enable_gpu).apply_asr
-    stm_lines = []
+    # All ranks execute the code between start and finish
+    backend = get_backend(backend, num_workers, blas_threads).start()
+    transcribe_batch = functools.partial(
+        _transcribe_batch, asr_model_dir=asr_model_dir,
+        enable_gpu=enable_gpu, cache_dir=cache_dir, batch_size=batch_size
+    )
     data = lazy_dataset.from_dict(pb.io.load(json_path))
-    for utt in dlp_mpi.split_managed(data, allow_single_worker=True):
-        audio_path = utt['audio_path']
-        text = apply_asr(audio_path)
-        stm_lines.append(STMLine(
-            filename=utt['short_id'],
-            channel='0',
-            speaker_id=utt['speaker_id'],
-            begin_time=utt['start_sample'],
-            end_time=utt['stop_sample'],
-            transcript=text,
-        ))
+    # The longest utterances are transcribed first to balance the load.
+    # Consecutive utterances, which have a similar length, form a batch.
+    utts = longest_first(data, get_segment_duration)
+    batches = [
+        utts[start:start + batch_size]
+        for start in range(0, len(utts), batch_size)
+    ]
+    stm_lines = []
+    num_hits = 0
+    num_misses = 0
+    for stm_lines_batch, (num_hits_batch, num_misses_batch) in backend.map(
+            transcribe_batch, batches
+    ):
+        stm_lines += stm_lines_batch
+        num_hits += num_hits_batch
+        num_misses += num_misses_batch
 
-    stm_lines = dlp_mpi.gather(stm_lines)
-    if dlp_mpi.IS_MASTER:
+    report_utilisation(backend)
+    if cache_dir is not None:
+        cache_stats = backend.gather((num_hits, num_misses))
+    stm_lines = backend.gather(stm_lines)
+    if backend.is_master:
+        if cache_dir is not None:
+            num_hits = sum([hits for hits, _ in cache_stats])
+            num_misses = sum([misses for _, misses in cache_stats])
+            print(
+                f'Transcription cache: {num_hits} of {num_hits + num_misses} '
+                f'utterances were cached', flush=True
+            )
         if output_dir is None:
             file = json_path.parent / 'stm' / 'hyp.stm'
         else:
@@ -86,6 +208,7 @@ def main(json_path, output_dir, asr_model_dir, enable_gpu):
         stm_lines = STM(stm_lines)
         stm_lines.dump(file)
         print(f'Wrote {file}', flush=True)
+    backend.finish()
 
 
 if __name__ == '__main__':
@@ -34,11 +34,9 @@ def estimate_noise_class(
     Returns:
         The index of the class associated with the noise
     """
-    activities = np.zeros_like(priors, bool)
-    for i, prior in enumerate(priors):
-        activities[i] = erode(
-            dilate(prior >= th, dilation_kernel_size), erosion_kernel_size
-        )
+    activities = erode(
+        dilate(priors >= th, dilation_kernel_size), erosion_kernel_size
+    )
     noise_class = np.argmax(np.sum(activities, -1))
     return noise_class
 
@@ -3,12 +3,164 @@ from einops import rearrange
 import numpy as np
 import paderbox as pb
 from pb_bss.extraction.beamformer import get_mvdr_vector_souden
-from pb_bss.extraction.beamformer import get_power_spectral_density_matrix
+from pb_bss.math.solve import stable_solve
+
+
+def get_segment_scms(stft_segment, mask_target):
+    """
+    Estimate the spatial covariance matrices (SCMs) of the target and the
+    interference for one segment. The interference mask is given by one minus
+    the target mask. Thus, the interference SCM is obtained by subtracting
+    the target SCM from the unweighted SCM of the segment, which requires
+    only one additional pass over the segment instead of two. The segment is
+    not copied, i.e., stft_segment can be a view of the whole STFT.
+
+    Args:
+        stft_segment (numpy.ndarray):
+            STFT of the multi-channel speech mixture in the segment (Shape:
+            number of channels x number of frames x FFT size / 2 + 1)
+        mask_target (numpy.ndarray):
+            Time-frequency mask of the target speaker in the segment (Shape:
+            FFT size / 2 + 1 x number of frames)
+
+    Returns:
+        scm_target (numpy.ndarray):
+            SCM of the target (Shape: FFT size / 2 + 1 x number of channels
+            x number of channels)
+        interference_scm (numpy.ndarray):
+            SCM of the interference including a small regularization on the
+            main diagonal (Shape: FFT size / 2 + 1 x number of channels
+            x number of channels)
+    """
+    obs = rearrange(stft_segment, 'c t f -> f c t')
+    obs_hermitian = rearrange(obs.conj(), 'f c t -> f t c')
+    scm = obs @ obs_hermitian
+    scm_target = (obs * mask_target[:, None]) @ obs_hermitian
+    interference_scm = scm - scm_target
+    interference_scm += \
+        np.finfo(np.float64).eps * np.eye(len(stft_segment))[None]
+    return scm_target, interference_scm
+
+
+def get_segments(activity, min_segment_len=40):
+    """
+    Cut the meeting into segments of continuous activity
+
+    Args:
+        activity (array-like):
+            Activity of the target speaker as boolean array
+        min_segment_len (int):
+            Minimum length of continuous activity. Shorter segments are
+            discarded.
+
+    Returns:
+        List of tuples (onset, offset) of the segments
+    """
+    segments = pb.array.interval.ArrayInterval(activity).intervals
+    return [
+        (onset, offset) for (onset, offset) in segments
+        if offset - onset >= min_segment_len
+    ]
+
+
+def get_mvdr_vectors_souden(scms_target, interference_scms):
+    """
+    Batched calculation of MVDR beamforming vectors in the formulation of
+    [Souden2010MVDR] (see segment_wise_beamforming). In contrast to
+    get_mvdr_vector_souden from pb_bss, the reference channel is chosen
+    independently for each entry of the batch, which corresponds to calling
+    get_mvdr_vector_souden separately for each entry.
+
+    Args:
+        scms_target (numpy.ndarray):
+            SCMs of the targets (Shape: ... x FFT size / 2 + 1
+            x number of channels x number of channels)
+        interference_scms (numpy.ndarray):
+            SCMs of the interferences (Shape: ... x FFT size / 2 + 1
+            x number of channels x number of channels)
+
+    Returns:
+        Beamforming vectors (Shape: ... x FFT size / 2 + 1
+        x number of channels)
+    """
+    phi = stable_solve(interference_scms, scms_target)
+    lambda_ = np.trace(phi, axis1=-1, axis2=-2)[..., None, None]
+    eps = np.finfo(lambda_.dtype).tiny
+    mat = phi / np.maximum(lambda_.real, eps)
+
+    # Choose the reference channel which maximizes the SNR after beamforming
+    snr = np.einsum(
+        '...fdr,...fdD,...fDr->...r', mat.conj(), scms_target, mat
+    ) / np.maximum(np.einsum(
+        '...fdr,...fdD,...fDr->...r', mat.conj(), interference_scms, mat
+    ), eps)
+    ref_channels = np.argmax(snr.real, axis=-1)
+    return np.take_along_axis(
+        mat, ref_channels[..., None, None, None], axis=-1
+    )[..., 0]
+
+
+def apply_beamformer(bf_vec, stft_segment, onset, frame_size, frame_shift):
+    """
+    Apply a beamforming vector to a segment and transform the result into the
+    time domain
+
+    Args:
+        bf_vec (numpy.ndarray):
+            Beamforming vector (Shape: FFT size / 2 + 1 x number of channels)
+        stft_segment (numpy.ndarray):
+            STFT of the multi-channel speech mixture in the segment (Shape:
+            number of channels x number of frames x FFT size / 2 + 1)
+        onset (int):
+            Frame index of the onset of the segment
+        frame_size (int):
+            Frame size used to calculate the STFT.
+        frame_shift (int):
+            Frame shift used to calculate the STFT.
+
+    Returns:
+        enh_sig (numpy.ndarray):
+            Enhanced signal of the segment
+        onset_time_domain (int):
+            Onset of the segment in samples
+    """
+    bf_output = np.empty(stft_segment.shape[1:], np.complex128)
+    np.einsum('fc, ctf -> tf', np.conj(bf_vec), stft_segment, out=bf_output)
+    enh_sig = pb.transform.istft(
+        bf_output, size=frame_size, shift=frame_shift, fading=False
+    )
+    onset_time_domain = \
+        pb.transform.module_stft.stft_frame_index_to_sample_index(
+            onset, window_length=frame_size,
+            shift=frame_shift, mode='first'
+        )
+    return enh_sig, onset_time_domain
+
+
+def overlap_add(stream, sig, onset):
+    """
+    Add a signal segment to a stream at the given onset. Samples of the
+    segment exceeding the end of the stream are discarded.
+
+    Args:
+        stream (numpy.ndarray):
+            Preallocated (or memory-mapped) output signal
+        sig (numpy.ndarray):
+            Signal segment
+        onset (int):
+            Onset of the segment in samples
+
+    Returns:
+        View of the stream at the position of the segment
+    """
+    stop = min(onset + len(sig), len(stream))
+    stream[onset:stop] += sig[:stop - onset]
+    return stream[onset:stop]
 
 
 def segment_wise_beamforming(
         target_spk, y, masks, activity, frame_size=1024,
-        frame_shift=256, min_segment_len=40
+        frame_shift=256, min_segment_len=40, out=None
 ):
     """
     Extract the target speaker's signal from a speech mixture. First, the
@@ -47,48 +199,111 @@ def segment_wise_beamforming(
             Frame shift used to calculate the STFT.
         min_segment_len (int):
             Minimum length of continuous activity
+        out (numpy.ndarray):
+            Optional preallocated (or memory-mapped) output stream with the
+            length of the meeting in samples. If given, the extracted segments
+            are overlap-added into this stream instead of being kept as
+            separate arrays.
 
     Returns:
         sig_segments (list of np.ndarrays):
-            List of extracted ``utterances´´ of the given target speaker.
+            List of extracted ``utterances´´ of the given target speaker. If
+            out is given, the segments are views of out.
         segment_onsets (list):
             List of the onsets of the segments on which beamforming was done.
     """
-    segments = pb.array.interval.ArrayInterval(activity).intervals
     sig_segments = []
     segment_onsets = []
-    for (onset, offset) in segments:
-        if offset - onset < min_segment_len:
-            continue
-        stft_buffer = y[:, onset:offset].copy()
+    for (onset, offset) in get_segments(activity, min_segment_len):
+        stft_buffer = y[:, onset:offset]
         mask_target = masks[target_spk, :, onset:offset]
-        interference_mask = 1 - mask_target
-        interference_scm = get_power_spectral_density_matrix(
-            rearrange(stft_buffer, 'c t f -> f c t'),
-            interference_mask,
-            normalize=False
-        )
-        interference_scm += \
-            np.finfo(np.float64).eps * np.eye(y.shape[0])[None]
-        scm_target = get_power_spectral_density_matrix(
-            rearrange(stft_buffer, 'c t f -> f c t'),
-            mask_target,
-            normalize=False
-        )
+        scm_target, interference_scm = \
+            get_segment_scms(stft_buffer, mask_target)
         bf_vec = get_mvdr_vector_souden(scm_target, interference_scm)
-        bf_output = \
-            np.zeros((offset - onset, stft_buffer.shape[-1]), np.complex128)
-        for l in range(offset - onset):
-            bf_output[l] = \
-                np.einsum('fc, cf-> f', np.conj(bf_vec), stft_buffer[:, l])
-        enh_sig = pb.transform.istft(
-            bf_output, size=frame_size, shift=frame_shift, fading=False
+        enh_sig, onset_time_domain = apply_beamformer(
+            bf_vec, stft_buffer, onset, frame_size, frame_shift
         )
+        if out is not None:
+            enh_sig = overlap_add(out, enh_sig, onset_time_domain)
         sig_segments.append(enh_sig)
-        onset_time_domain = \
-            pb.transform.module_stft.stft_frame_index_to_sample_index(
-                onset, window_length=frame_size,
-                shift=frame_shift, mode='first'
-            )
         segment_onsets.append(onset_time_domain)
     return sig_segments, segment_onsets
+
+
+def batched_segment_wise_beamforming(
+        target_spks, y, masks, activities, frame_size=1024,
+        frame_shift=256, min_segment_len=40, batch_size=64, out=None
+):
+    """
+    Batched version of segment_wise_beamforming for multiple target speakers.
+    The SCMs of all segments of all target speakers are stacked and all MVDR
+    beamforming vectors are calculated at once, which replaces many small
+    linear solves by a few large ones.
+
+    Args:
+        target_spks (list):
+            Identifiers of the speakers whose signals should be extracted.
+        y (numpy.ndarray):
+            STFT of the multi-channel speech mixture (Shape: number of channels
+            x number of frames x  FFT size / 2 + 1). Note that only the
+            non-redundant frequencies are used as input.
+        masks (numpy.ndarray):
+            Time-frequency masks (Shape: (number of speakers + 1
+            x FFT size / 2 + 1 x number of frames))
+        activities (list):
+            Activity of each target speaker as boolean array
+        frame_size (int):
+            Frame size used to calculate the STFT.
+        frame_shift (int):
+            Frame shift used to calculate the STFT.
+        min_segment_len (int):
+            Minimum length of continuous activity
+        batch_size (int):
+            Maximum number of segments whose SCMs are stacked at once. The
+            stacked SCMs require batch_size x (FFT size / 2 + 1) x (number of
+            channels)^2 complex values each, e.g., about 440 MB for 64
+            segments of a session with 29 channels.
+        out (numpy.ndarray):
+            Optional preallocated (or memory-mapped) output streams (Shape:
+            number of target speakers x number of samples). If given, the
+            extracted segments are overlap-added into the streams instead of
+            being kept as separate arrays.
+
+    Returns:
+        sig_segments (Nested list):
+            List of lists of enhanced signal segments per target speaker. If
+            out is given, the segments are views of out.
+        segment_onsets (Nested list):
+            List of lists of the onsets of the enhanced signal segments
+            per target speaker.
+    """
+    assert len(target_spks) == len(activities), \
+        (len(target_spks), len(activities))
+    segments = [
+        (i, onset, offset)
+        for i, activity in enumerate(activities)
+        for (onset, offset) in get_segments(activity, min_segment_len)
+    ]
+    assert batch_size >= 1, batch_size
+    sig_segments = [[] for _ in target_spks]
+    segment_onsets = [[] for _ in target_spks]
+    for start in range(0, len(segments), batch_size):
+        batch = segments[start:start + batch_size]
+        scms_target, interference_scms = zip(*[
+            get_segment_scms(
+                y[:, onset:offset], masks[target_spks[i], :, onset:offset]
+            ) for (i, onset, offset) in batch
+        ])
+        bf_vecs = get_mvdr_vectors_souden(
+            np.stack(scms_target), np.stack(interference_scms)
+        )
+        del scms_target, interference_scms
+        for bf_vec, (i, onset, offset) in zip(bf_vecs, batch):
+            enh_sig, onset_time_domain = apply_beamformer(
+                bf_vec, y[:, onset:offset], onset, frame_size, frame_shift
+            )
+            if out is not None:
+                enh_sig = overlap_add(out[i], enh_sig, onset_time_domain)
+            sig_segments[i].append(enh_sig)
+            segment_onsets[i].append(onset_time_domain)
+    return sig_segments, segment_onsets
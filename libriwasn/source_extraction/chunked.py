@@ -0,0 +1,348 @@
+from einops import rearrange
+import numpy as np
+import paderbox as pb
+import scipy.optimize
+
+from libriwasn.mask_estimation.cacgmm import get_tf_masks
+from libriwasn.mask_estimation.channel_selection import select_channels
+from libriwasn.mask_estimation.initialization import (
+    correlation_matrix_distance,
+    get_initialization
+)
+from libriwasn.profiling import stage
+from libriwasn.source_extraction.activity import (
+    estimate_noise_class,
+    estimate_activity
+)
+from libriwasn.source_extraction.beamformer import get_segments
+from libriwasn.source_extraction.separation import separate_sources
+
+
+def get_bytes_per_frame(
+        num_channels, num_classes=9, num_channels_cacgmm=None,
+        frame_size=1024, frame_shift=256
+):
+    """
+    Estimate the memory which is required per frame of a chunk by the arrays
+    of the processing of the chunk (signals, STFT, initialization,
+    posteriors, masks, ...).
+
+    Args:
+        num_channels (int):
+            Number of channels of the signals
+        num_classes (int):
+            Number of classes of the spatial mixture model
+        num_channels_cacgmm (int):
+            Number of channels used for the mask estimation. Defaults to
+            num_channels.
+        frame_size (int):
+            Frame size used to calculate the STFT
+        frame_shift (int):
+            Frame shift used to calculate the STFT
+
+    Returns:
+        Number of bytes per frame
+    """
+    if num_channels_cacgmm is None:
+        num_channels_cacgmm = num_channels
+    num_bins = frame_size // 2 + 1
+    return (
+        # Signals (float64) and separated streams
+        8 * frame_shift * (num_channels + 2 * num_classes)
+        # STFT and its copies within the cACGMM (complex128)
+        + 16 * num_bins * (num_channels + 2 * num_channels_cacgmm)
+        # Initialization, posteriors, quadratic forms, masks (float64)
+        + 8 * num_bins * num_classes * 6
+    )
+
+
+def get_chunk_size(
+        num_channels, memory_budget, num_classes=9, num_channels_cacgmm=None,
+        frame_size=1024, frame_shift=256
+):
+    """
+    Estimate the number of frames per chunk such that the arrays of the
+    processing of one chunk roughly fit into the given memory budget (see
+    get_bytes_per_frame).
+
+    Args:
+        num_channels (int):
+            Number of channels of the signals
+        memory_budget (int):
+            Memory budget in bytes
+        num_classes (int):
+            Number of classes of the spatial mixture model
+        num_channels_cacgmm (int):
+            Number of channels used for the mask estimation. Defaults to
+            num_channels.
+        frame_size (int):
+            Frame size used to calculate the STFT
+        frame_shift (int):
+            Frame shift used to calculate the STFT
+
+    Returns:
+        Number of frames per chunk
+    """
+    bytes_per_frame = get_bytes_per_frame(
+        num_channels, num_classes, num_channels_cacgmm, frame_size,
+        frame_shift
+    )
+    return int(memory_budget // bytes_per_frame)
+
+
+def _get_class_scms(y, masks):
+    # Rank-1 approximation of the mask-weighted SCM of each class (Shape:
+    # number of classes x FFT size / 2 + 1 x number of channels x number of
+    # channels), which represents the position of the source belonging to the
+    # class (see get_initialization).
+    obs = rearrange(y, 'c t f -> f c t')
+    obs_hermitian = rearrange(obs.conj(), 'f c t -> f t c')
+    scms = []
+    for mask in masks:
+        _, eig_vects = np.linalg.eigh((obs * mask[:, None]) @ obs_hermitian)
+        steering_vector = eig_vects[..., -1]
+        scms.append(np.einsum(
+            'f c, f d -> f c d', steering_vector, steering_vector.conj()
+        ))
+    return np.stack(scms)
+
+
+def _align_speakers(
+        scms, activities, signatures, known, prev_activities, max_distance
+):
+    # Cost for assigning a class of the current chunk to a speaker: distance
+    # between the SCM of the class and the last SCM of the speaker, which
+    # reflects the assumption of fixed source positions, reduced by the
+    # intersection over union of the activities within the overlap. Classes
+    # without activity and speakers which were not active yet do not provide
+    # a meaningful SCM. Hence, the distance is set to max_distance for them,
+    # which means that an active class is only assigned to a new speaker if
+    # its SCM does not match any known speaker.
+    active = np.any(activities, axis=-1)
+    cost = np.full((len(scms), len(signatures)), float(max_distance))
+    for i in np.flatnonzero(active):
+        for j in np.flatnonzero(known):
+            cost[i, j] = np.mean(
+                correlation_matrix_distance(scms[i], signatures[j])
+            )
+    overlap = min(len(prev_activities.T), len(activities.T))
+    activities = activities[:, None, :overlap]
+    prev_activities = prev_activities[None, :, :overlap]
+    intersection = np.sum(activities & prev_activities, -1)
+    union = np.sum(activities | prev_activities, -1)
+    cost -= intersection / np.maximum(union, 1)
+    _, permutation = scipy.optimize.linear_sum_assignment(cost.T)
+    return permutation
+
+
+def chunked_separation(
+        sigs, out, chunk_size, chunk_overlap=1875, num_spk=8,
+        cacgmm_channels=None, mvdr_channels=None, max_channels_cacgmm=None,
+        frame_size=1024, frame_shift=256, min_segment_len=40,
+        batched=False, num_workers=1, batch_size=64, max_distance=.5
+):
+    """
+    Separate the speakers of an arbitrarily long meeting by running the STFT,
+    the mask estimation and the beamforming on overlapping chunks. Thus, the
+    memory consumption only depends on the chunk size and not on the length
+    of the meeting.
+
+    The classes of the spatial mixture model are arbitrarily permuted in
+    each chunk. To keep the identity of the speakers consistent across
+    chunks, the classes are assigned to the speakers based on the similarity
+    of their SCMs to the last SCM of each speaker (assuming fixed source
+    positions) and the agreement of the activities within the overlap of
+    consecutive chunks. The separated streams are stitched in the middle of
+    the overlap.
+
+    Args:
+        sigs (array-like):
+            Synchronized signals (Shape: number of channels x number of
+            samples). This can be a memory-mapped array, since only one chunk
+            is read at a time.
+        out (numpy.ndarray):
+            Preallocated (or memory-mapped) zero-initialized output streams
+            (Shape: num_spk x number of samples)
+        chunk_size (int):
+            Number of frames per chunk (see get_chunk_size). It has to exceed
+            twice the chunk overlap, otherwise a ValueError is raised.
+        chunk_overlap (int):
+            Number of frames by which consecutive chunks overlap
+        num_spk (int):
+            Number of speakers
+        cacgmm_channels (array-like):
+            Indices of the channels used for mask estimation. Defaults to all
+            channels.
+        mvdr_channels (array-like):
+            Indices of the channels used for beamforming. Defaults to all
+            channels.
+        max_channels_cacgmm (int):
+            Upper limit for the number of channels used for the mask
+            estimation (see select_channels). The channels are selected based
+            on the first chunk. The STFT is only calculated for the channels
+            used for the mask estimation or the beamforming.
+        frame_size (int):
+            Frame size used to calculate the STFT
+        frame_shift (int):
+            Frame shift used to calculate the STFT
+        min_segment_len (int):
+            Minimum length of continuous activity in frames
+        batched (bool):
+            See separate_sources
+        num_workers (int):
+            See separate_sources
+        batch_size (int):
+            See separate_sources
+        max_distance (float):
+            Maximum correlation matrix distance between the SCM of a class
+            and the SCM of a known speaker up to which the class may be
+            assigned to this speaker rather than to a speaker who was not
+            active so far
+
+    Returns:
+        sig_segments (Nested list):
+            List of lists of enhanced signal segments per speaker, which are
+            views of out.
+        segment_onsets (Nested list):
+            List of lists of the onsets of the enhanced signal segments
+            per speaker.
+    """
+    if chunk_size <= 2 * chunk_overlap:
+        raise ValueError(
+            f'The chunk size ({chunk_size} frames) has to exceed twice the '
+            f'chunk overlap ({chunk_overlap} frames). Increase the memory '
+            f'budget (see get_bytes_per_frame) or decrease the overlap.'
+        )
+    num_samples = sigs.shape[-1]
+    assert out.shape == (num_spk, num_samples), (out.shape, num_spk)
+    hop = chunk_size - chunk_overlap
+    # Frames of the overlap which are owned by the previous chunk
+    half_overlap = chunk_overlap // 2
+    # Upper bound for the number of frames of the STFT of the whole meeting
+    num_frames = \
+        int(np.ceil(num_samples / frame_shift)) + frame_size // frame_shift
+    activities = np.zeros((num_spk, num_frames), bool)
+    prev_activities = None
+    signatures = None
+    known = None
+
+    channels = np.arange(len(sigs))
+    cacgmm_channels = channels if cacgmm_channels is None \
+        else channels[cacgmm_channels]
+    mvdr_channels = channels if mvdr_channels is None \
+        else channels[mvdr_channels]
+    if max_channels_cacgmm is not None:
+        # The channels are selected once based on the first chunk such that
+        # the SCMs used to align the speakers are comparable. The selection
+        # is based on the time domain signals, such that the STFT is only
+        # calculated for the selected channels.
+        stop = min(chunk_size * frame_shift, num_samples)
+        cacgmm_channels = cacgmm_channels[select_channels(
+            [np.asarray(sigs[ch, :stop]) for ch in cacgmm_channels],
+            max_channels_cacgmm
+        )]
+    # Only the channels used for the mask estimation or the beamforming are
+    # transformed into the STFT domain
+    stft_channels = np.union1d(cacgmm_channels, mvdr_channels)
+    cacgmm_channels, mvdr_channels = [
+        # Slices yield views instead of copies of the STFT
+        slice(None) if len(channels) == len(stft_channels)
+        else np.searchsorted(stft_channels, channels)
+        for channels in [cacgmm_channels, mvdr_channels]
+    ]
+    if len(stft_channels) == len(sigs):
+        stft_channels = slice(None)
+    for chunk_onset in range(0, num_frames, hop):
+        start = chunk_onset * frame_shift
+        stop = min((chunk_onset + chunk_size) * frame_shift, num_samples)
+        with stage('stft'):
+            sigs_chunk = np.asarray(sigs[stft_channels, start:stop])
+            y = pb.transform.stft(
+                sigs_chunk, size=frame_size, shift=frame_shift
+            )
+        del sigs_chunk
+
+        y_cacgmm = y[cacgmm_channels]
+        with stage('initialization'):
+            mm_init, mm_guide = get_initialization(y_cacgmm, num_spk=num_spk)
+        with stage('masks'):
+            masks, priors = get_tf_masks(y_cacgmm, mm_init, mm_guide)
+        del mm_init, mm_guide
+
+        # Assign the classes of this chunk to the speakers
+        noise_class = estimate_noise_class(priors)
+        target_spks = \
+            [spk for spk in range(len(priors)) if spk != noise_class]
+        chunk_activities = np.stack(
+            [estimate_activity(priors[spk]) for spk in target_spks]
+        )
+        scms = _get_class_scms(y_cacgmm, masks[target_spks])
+        del y_cacgmm
+        if signatures is None:
+            permutation = np.arange(num_spk)
+            signatures = scms
+            known = np.any(chunk_activities, axis=-1)
+        else:
+            permutation = _align_speakers(
+                scms, chunk_activities, signatures, known, prev_activities,
+                max_distance
+            )
+            for spk, cls in enumerate(permutation):
+                if np.any(chunk_activities[cls]):
+                    signatures[spk] = scms[cls]
+                    known[spk] = True
+        del scms
+
+        y = y[mvdr_channels]
+        chunk_out = np.zeros((num_spk, stop - start), out.dtype)
+        with stage('beamforming'):
+            # The activities were already estimated for the assignment of
+            # the classes
+            separate_sources(
+                y, masks, priors, batched=batched, num_workers=num_workers,
+                batch_size=batch_size, out=chunk_out,
+                activities=chunk_activities
+            )
+        del y, masks, priors
+
+        # Stitch the chunk into the streams. The first half of the overlap
+        # belongs to the previous chunk and the second half to this chunk.
+        own_onset = 0 if chunk_onset == 0 else half_overlap
+        if stop >= num_samples:
+            own_offset = len(chunk_activities.T)
+        else:
+            own_offset = hop + half_overlap
+        activities[:, chunk_onset + own_onset:chunk_onset + own_offset] = \
+            chunk_activities[permutation, own_onset:own_offset]
+        own_start = own_onset * frame_shift
+        own_stop = min(own_offset * frame_shift, stop - start)
+        out[:, start + own_start:start + own_stop] = \
+            chunk_out[permutation, own_start:own_stop]
+        prev_activities = chunk_activities[permutation, hop:]
+        del chunk_out
+        if stop >= num_samples:
+            break
+
+    sig_segments = []
+    segment_onsets = []
+    for stream, activity in zip(out, activities):
+        sig_segments_spk = []
+        segment_onsets_spk = []
+        for (onset, offset) in get_segments(activity, min_segment_len):
+            onset_time_domain = \
+                pb.transform.module_stft.stft_frame_index_to_sample_index(
+                    onset, window_length=frame_size,
+                    shift=frame_shift, mode='first'
+                )
+            offset_time_domain = min(
+                onset_time_domain
+                + (offset - onset - 1) * frame_shift + frame_size,
+                num_samples
+            )
+            sig_segments_spk.append(
+                stream[onset_time_domain:offset_time_domain]
+            )
+            segment_onsets_spk.append(onset_time_domain)
+        sig_segments.append(sig_segments_spk)
+        segment_onsets.append(segment_onsets_spk)
+    return sig_segments, segment_onsets
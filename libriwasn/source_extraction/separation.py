@@ -1,11 +1,23 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+import numpy as np
+
+from libriwasn.parallel import limited_blas_threads
 from libriwasn.source_extraction.activity import (
     estimate_noise_class,
     estimate_activity
 )
-from libriwasn.source_extraction.beamformer import segment_wise_beamforming
+from libriwasn.source_extraction.beamformer import (
+    batched_segment_wise_beamforming,
+    segment_wise_beamforming
+)
 
 
-def separate_sources(y, masks, priors):
+def separate_sources(
+        y, masks, priors, batched=False, num_workers=1, out=None,
+        batch_size=64, activities=None
+):
     """
     Wrapper to extract the signals of all speakers via beamforming
 
@@ -20,23 +32,102 @@ def separate_sources(y, masks, priors):
         priors (numpy.ndarray):
             Prior probabilities of the spatial mixture model (Shape:
             (number of speakers + 1 x number of frames)))
+        batched (bool):
+            If True, the beamforming vectors of the segments of all speakers
+            are calculated in batches (see batched_segment_wise_beamforming).
+        num_workers (int):
+            Number of threads used to extract the speakers' signals
+            concurrently. All threads work on the same y and masks, which are
+            only read and not copied. Since numpy releases the GIL within the
+            costly operations, this utilizes multiple cores. Meanwhile, the
+            BLAS threads are limited to the number of CPU cores divided by
+            num_workers to avoid an oversubscription of the cores (see
+            limited_blas_threads). Only used if batched is False.
+        out (numpy.ndarray):
+            Optional preallocated (or memory-mapped) output streams, one per
+            speaker (Shape: number of speakers x number of samples). If given,
+            the extracted segments are overlap-added into these streams
+            instead of being allocated separately. See get_segment_index for
+            the positions of the segments within the streams.
+        batch_size (int):
+            Maximum number of segments whose beamforming vectors are
+            calculated at once (see batched_segment_wise_beamforming). Only
+            used if batched is True.
+        activities (list):
+            Activities of the speakers, i.e., of all classes except for the
+            noise class in the order of the classes, if they were already
+            estimated (see estimate_activity). Estimated from priors if None.
 
     Returns:
         sig_segments (Nested list):
-            List of lists of enhanced signal segments per speaker.
+            List of lists of enhanced signal segments per speaker. If out is
+            given, the segments are views of out.
         segment_onsets (Nested list):
             List of lists of the onsets of the enhanced signal segments
             per speaker.
     """
     noise_class = estimate_noise_class(priors)
-    sig_segments = []
-    segment_onsets = []
-    for target_spk in range(len(masks)):
-        if target_spk == noise_class:
-            continue
-        activity = estimate_activity(priors[target_spk])
-        sig_segments_spk, segment_onsets_spk = \
-            segment_wise_beamforming(target_spk, y, masks, activity)
-        sig_segments.append(sig_segments_spk)
-        segment_onsets.append(segment_onsets_spk)
+    target_spks = \
+        [target_spk for target_spk in range(len(masks))
+         if target_spk != noise_class]
+    if activities is None:
+        activities = [
+            estimate_activity(priors[target_spk])
+            for target_spk in target_spks
+        ]
+    assert len(activities) == len(target_spks), \
+        (len(activities), len(target_spks))
+    if out is not None:
+        assert len(out) == len(target_spks), (len(out), len(target_spks))
+    if batched:
+        return batched_segment_wise_beamforming(
+            target_spks, y, masks, activities, batch_size=batch_size,
+            out=out
+        )
+    if out is None:
+        out = [None] * len(target_spks)
+
+    def extract(target_spk, activity, stream):
+        return segment_wise_beamforming(
+            target_spk, y, masks, activity, out=stream
+        )
+
+    if num_workers > 1:
+        blas_threads = max((os.cpu_count() or 1) // num_workers, 1)
+        with limited_blas_threads(blas_threads), \
+                ThreadPoolExecutor(num_workers) as executor:
+            results = list(
+                executor.map(extract, target_spks, activities, out)
+            )
+    else:
+        results = list(map(extract, target_spks, activities, out))
+    sig_segments = [sig_segments_spk for sig_segments_spk, _ in results]
+    segment_onsets = [segment_onsets_spk for _, segment_onsets_spk in results]
     return sig_segments, segment_onsets
+
+
+def get_segment_index(sig_segments, segment_onsets):
+    """
+    Get the positions of the extracted segments in samples, e.g., to slice
+    the streams written by separate_sources without copying them.
+
+    Args:
+        sig_segments (Nested list):
+            List of lists of enhanced signal segments per speaker.
+        segment_onsets (Nested list):
+            List of lists of the onsets of the enhanced signal segments
+            per speaker.
+
+    Returns:
+        List of arrays with the start and stop sample of each segment per
+        speaker (Shape of each array: number of segments x 2)
+    """
+    return [
+        np.array(
+            [(onset, onset + len(sig))
+             for sig, onset in zip(sig_segments_spk, segment_onsets_spk)],
+            dtype=np.int64
+        ).reshape(-1, 2)
+        for sig_segments_spk, segment_onsets_spk
+        in zip(sig_segments, segment_onsets)
+    ]
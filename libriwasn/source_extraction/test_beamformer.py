@@ -0,0 +1,176 @@
+"""
+Check the segment-wise SCM estimation (get_segment_scms) against the
+mask-weighted power spectral density matrices of pb_bss, which were used
+before, and the batched beamforming against the beamforming of each segment
+on its own.
+
+python -m pytest libriwasn/source_extraction/test_beamformer.py
+"""
+from einops import rearrange
+import numpy as np
+import pytest
+
+pytest.importorskip('pb_bss')
+from pb_bss.extraction.beamformer import (  # noqa: E402
+    get_power_spectral_density_matrix
+)
+
+from libriwasn.source_extraction.beamformer import (  # noqa: E402
+    batched_segment_wise_beamforming,
+    get_segment_scms,
+    segment_wise_beamforming
+)
+
+
+def _get_segment_scms_psd(stft_segment, mask_target):
+    # Previous implementation, which estimates the SCMs of the target and the
+    # interference separately from a copy of the segment
+    stft_buffer = stft_segment.copy()
+    interference_scm = get_power_spectral_density_matrix(
+        rearrange(stft_buffer, 'c t f -> f c t'),
+        1 - mask_target,
+        normalize=False
+    )
+    interference_scm += \
+        np.finfo(np.float64).eps * np.eye(stft_segment.shape[0])[None]
+    scm_target = get_power_spectral_density_matrix(
+        rearrange(stft_buffer, 'c t f -> f c t'),
+        mask_target,
+        normalize=False
+    )
+    return scm_target, interference_scm
+
+
+def _get_stft_and_masks(rng, num_channels, num_frames, num_bins=65):
+    y = rng.standard_normal((num_channels, num_frames, num_bins)) \
+        + 1j * rng.standard_normal((num_channels, num_frames, num_bins))
+    masks = rng.uniform(size=(3, num_bins, num_frames))
+    # Masks which are exactly zero or one for some time-frequency bins
+    masks[:, :, :num_frames // 4] = np.round(masks[:, :, :num_frames // 4])
+    masks /= np.maximum(np.sum(masks, 0), 1e-10)
+    return y, masks
+
+
+@pytest.mark.parametrize('seed', range(30))
+def test_identical_to_psd(seed):
+    rng = np.random.default_rng(seed)
+    num_channels = int(rng.integers(1, 7))
+    num_frames = int(rng.integers(2, 200))
+    y, masks = _get_stft_and_masks(rng, num_channels, num_frames)
+    onset = int(rng.integers(0, num_frames - 1))
+    offset = int(rng.integers(onset + 1, num_frames + 1))
+    # The segment is a (non-contiguous) view of the STFT
+    stft_segment = y[:, onset:offset]
+    mask_target = masks[1, :, onset:offset]
+    scm_target, interference_scm = \
+        get_segment_scms(stft_segment, mask_target)
+    scm_target_ref, interference_scm_ref = \
+        _get_segment_scms_psd(stft_segment, mask_target)
+    # The interference SCM is obtained by a subtraction. Hence, the
+    # tolerance refers to the scale of the unweighted SCM.
+    scale = np.max(np.abs(scm_target_ref + interference_scm_ref))
+    np.testing.assert_allclose(
+        scm_target, scm_target_ref, rtol=0, atol=1e-12 * scale
+    )
+    np.testing.assert_allclose(
+        interference_scm, interference_scm_ref, rtol=0, atol=1e-12 * scale
+    )
+    # The segment is not modified
+    np.testing.assert_equal(stft_segment, y[:, onset:offset])
+
+
+@pytest.mark.parametrize('mask_value', [0., 1.])
+def test_binary_masks(mask_value):
+    # If the target mask is zero (one), the target (interference) SCM only
+    # contains the regularization.
+    rng = np.random.default_rng(0)
+    y, _ = _get_stft_and_masks(rng, 4, 50)
+    mask_target = np.full((y.shape[-1], y.shape[1]), mask_value)
+    scm_target, interference_scm = get_segment_scms(y, mask_target)
+    scm_target_ref, interference_scm_ref = \
+        _get_segment_scms_psd(y, mask_target)
+    scale = np.max(np.abs(scm_target_ref + interference_scm_ref))
+    np.testing.assert_allclose(
+        scm_target, scm_target_ref, rtol=0, atol=1e-12 * scale
+    )
+    np.testing.assert_allclose(
+        interference_scm, interference_scm_ref, rtol=0, atol=1e-12 * scale
+    )
+
+
+def _get_activities(rng, num_spks, num_frames):
+    activities = np.zeros((num_spks, num_frames), bool)
+    for activity in activities:
+        onset = 0
+        while onset < num_frames:
+            length = int(rng.integers(20, 120))
+            activity[onset:onset + length] = rng.uniform() < .6
+            onset += length
+    return activities
+
+
+@pytest.mark.parametrize('batch_size', [1, 3, 64])
+def test_batched_beamforming(batch_size):
+    rng = np.random.default_rng(0)
+    num_frames = 600
+    y, masks = _get_stft_and_masks(rng, 4, num_frames, num_bins=513)
+    activities = _get_activities(rng, 2, num_frames)
+    target_spks = [1, 2]
+    sig_segments, segment_onsets = batched_segment_wise_beamforming(
+        target_spks, y, masks, activities, batch_size=batch_size
+    )
+    assert sum([len(segments) for segments in sig_segments]) > 3
+    for i, target_spk in enumerate(target_spks):
+        sig_segments_ref, segment_onsets_ref = segment_wise_beamforming(
+            target_spk, y, masks, activities[i]
+        )
+        assert segment_onsets[i] == segment_onsets_ref
+        for sig, sig_ref in zip(sig_segments[i], sig_segments_ref):
+            np.testing.assert_allclose(
+                sig, sig_ref, rtol=0, atol=1e-8 * np.max(np.abs(sig_ref))
+            )
+
+
+@pytest.mark.parametrize('batched', [False, True])
+def test_overlap_add_into_streams(batched):
+    # The segments of a speaker are separated by more than three frames.
+    # Hence, overlap-adding them into a stream yields the same segments as
+    # allocating them separately, except for the samples exceeding the end
+    # of the stream.
+    rng = np.random.default_rng(1)
+    num_frames = 600
+    y, masks = _get_stft_and_masks(rng, 3, num_frames, num_bins=513)
+    activities = _get_activities(rng, 2, num_frames)
+    activities[0, -50:] = True  # a segment which reaches the end
+    num_samples = num_frames * 256 - 1000
+    target_spks = [1, 2]
+    streams = np.zeros((len(target_spks), num_samples))
+    if batched:
+        sig_segments, segment_onsets = batched_segment_wise_beamforming(
+            target_spks, y, masks, activities, out=streams
+        )
+        sig_segments_ref, segment_onsets_ref = \
+            batched_segment_wise_beamforming(
+                target_spks, y, masks, activities
+            )
+    else:
+        sig_segments, segment_onsets = zip(*[
+            segment_wise_beamforming(
+                target_spk, y, masks, activity, out=stream
+            ) for target_spk, activity, stream
+            in zip(target_spks, activities, streams)
+        ])
+        sig_segments_ref, segment_onsets_ref = zip(*[
+            segment_wise_beamforming(target_spk, y, masks, activity)
+            for target_spk, activity in zip(target_spks, activities)
+        ])
+    assert list(segment_onsets) == list(segment_onsets_ref)
+    for i in range(len(target_spks)):
+        for sig, sig_ref, onset in zip(
+                sig_segments[i], sig_segments_ref[i], segment_onsets[i]
+        ):
+            assert np.shares_memory(sig, streams[i])
+            assert len(sig) == min(len(sig_ref), num_samples - onset)
+            np.testing.assert_equal(sig, sig_ref[:len(sig)])
+    # The last segment of the first speaker exceeds the end of the stream
+    assert len(sig_segments[0][-1]) < len(sig_segments_ref[0][-1])
@@ -0,0 +1,103 @@
+"""
+Check the chunked separation on a synthetic meeting against the processing
+of the whole meeting at once. If the whole meeting fits into one chunk, both
+are identical. Otherwise, the stitched streams have to agree with the
+single-pass streams up to a permutation of the speakers.
+
+python -m pytest libriwasn/source_extraction/test_chunked.py
+"""
+import numpy as np
+import paderbox as pb
+import pytest
+
+pytest.importorskip('pb_bss')
+from libriwasn.benchmark.synthetic import generate_meeting  # noqa: E402
+from libriwasn.mask_estimation.cacgmm import get_tf_masks  # noqa: E402
+from libriwasn.mask_estimation.initialization import (  # noqa: E402
+    get_initialization
+)
+from libriwasn.source_extraction.chunked import (  # noqa: E402
+    chunked_separation,
+    get_bytes_per_frame,
+    get_chunk_size
+)
+from libriwasn.source_extraction.separation import (  # noqa: E402
+    get_segment_index,
+    separate_sources
+)
+from libriwasn.utils import solve_permutation  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def meeting(tmp_path_factory):
+    example = generate_meeting(
+        tmp_path_factory.mktemp('meeting'), num_devices=1, num_channels=4,
+        num_speakers=3, duration=40, seed=0
+    )
+    sigs = pb.io.load_audio(example['audio_path']['observation']['device0'])
+    y = pb.transform.stft(sigs)
+    mm_init, mm_guide = get_initialization(y)
+    masks, priors = get_tf_masks(y, mm_init, mm_guide)
+    streams = np.zeros((len(masks) - 1, sigs.shape[-1]))
+    sig_segments, segment_onsets = \
+        separate_sources(y, masks, priors, out=streams)
+    return sigs, streams, get_segment_index(sig_segments, segment_onsets)
+
+
+def _to_activities(segment_index, num_samples):
+    activities = np.zeros((len(segment_index), num_samples), bool)
+    for activity, segments in zip(activities, segment_index):
+        for start, stop in segments:
+            activity[start:stop] = True
+    return activities
+
+
+def test_single_chunk_identical(meeting):
+    sigs, streams_ref, segment_index_ref = meeting
+    num_frames = pb.transform.stft(sigs[0]).shape[0]
+    streams = np.zeros_like(streams_ref)
+    sig_segments, segment_onsets = chunked_separation(
+        sigs, streams, num_frames + 4, chunk_overlap=0
+    )
+    np.testing.assert_equal(streams, streams_ref)
+    for segments, segments_ref in zip(
+            get_segment_index(sig_segments, segment_onsets),
+            segment_index_ref
+    ):
+        np.testing.assert_equal(segments, segments_ref)
+
+
+@pytest.mark.parametrize(
+    'chunk_size,chunk_overlap', [(1000, 250), (800, 300)]
+)
+def test_multiple_chunks_equivalent(meeting, chunk_size, chunk_overlap):
+    sigs, streams_ref, segment_index_ref = meeting
+    streams = np.zeros_like(streams_ref)
+    sig_segments, segment_onsets = chunked_separation(
+        sigs, streams, chunk_size, chunk_overlap=chunk_overlap
+    )
+    activities = _to_activities(
+        get_segment_index(sig_segments, segment_onsets), sigs.shape[-1]
+    )
+    activities_ref = _to_activities(segment_index_ref, sigs.shape[-1])
+    activities = activities[solve_permutation(activities, activities_ref)]
+    # The classes of the three speakers of the meeting are the most active
+    # ones. The remaining classes capture spurious activity, which is not
+    # expected to be consistent.
+    for spk in np.argsort(np.sum(activities_ref, -1))[-3:]:
+        agreement = np.mean(activities[spk] == activities_ref[spk])
+        assert agreement > .8, (spk, agreement)
+
+
+def test_chunk_size_exceeding_overlap(meeting):
+    sigs, streams_ref, _ = meeting
+    with pytest.raises(ValueError, match='chunk overlap'):
+        chunked_separation(
+            sigs, np.zeros_like(streams_ref), 500, chunk_overlap=250
+        )
+
+
+def test_chunk_size():
+    bytes_per_frame = get_bytes_per_frame(29)
+    assert get_chunk_size(29, 1000 * bytes_per_frame) == 1000
+    assert get_chunk_size(29, 1000 * bytes_per_frame - 1) == 999
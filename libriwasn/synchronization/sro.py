@@ -42,7 +42,31 @@ def estimate_sros(sigs):
     return sros
 
 
-def compensate_for_sros(sigs, sros):
+def compensate_for_sro(sig, sro, out):
+    """
+    Compensate a single channel for the given SRO via an STFT-resampling
+
+    Args:
+        sig:
+            Audio channel
+        sro:
+            SRO-trajectory of the channel
+        out:
+            Array (e.g., a row of a memory-mapped array) into which the
+            synchronized signal is written. The synchronized signal is cut or
+            zero-padded to the length of out.
+
+    Returns:
+        out
+    """
+    synced_sig = compensate_sro(sig, sro)
+    length = min(len(synced_sig), len(out))
+    out[:length] = synced_sig[:length]
+    out[length:] = 0
+    return out
+
+
+def compensate_for_sros(sigs, sros, out=None):
     """
     Compensate for the given SROs via an STFT-resampling
 
@@ -51,18 +75,20 @@ def compensate_for_sros(sigs, sros):
             List of N audio channels
         sros:
             Lift of N-1 SRO-trajectories
+        out:
+            Optional array (e.g., a memory-mapped array) of shape
+            (N x length of the first channel) into which the synchronized
+            signals are written.
 
     Returns:
         Signals after compensation for SROs
     """
-    synced_sigs = np.zeros((len(sigs), len(sigs[0])))
-    synced_sigs[0] = sigs[0].copy()
+    if out is None:
+        synced_sigs = np.zeros((len(sigs), len(sigs[0])))
+    else:
+        assert out.shape == (len(sigs), len(sigs[0])), out.shape
+        synced_sigs = out
+    synced_sigs[0] = sigs[0]
     for ch_id, sro in enumerate(sros):
-        synced_sig = compensate_sro(sigs[ch_id + 1], sro)
-        if len(synced_sig) > synced_sigs.shape[-1]:
-            synced_sigs[ch_id + 1] = synced_sig[:synced_sigs.shape[-1]]
-        elif len(synced_sig) < synced_sigs.shape[-1]:
-            synced_sigs[ch_id + 1, :len(synced_sig)] = synced_sig
-        else:
-            synced_sigs[ch_id + 1] = synced_sig
+        compensate_for_sro(sigs[ch_id + 1], sro, out=synced_sigs[ch_id + 1])
     return synced_sigs
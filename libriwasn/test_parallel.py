@@ -0,0 +1,73 @@
+"""
+Check that the process backend distributes the work items to its worker
+processes, returns all results and propagates the exceptions of the workers,
+and that the BLAS threads are limited temporarily.
+
+python -m pytest libriwasn/test_parallel.py
+"""
+import functools
+import os
+
+import numpy as np
+import pytest
+
+from libriwasn.parallel import ProcessBackend, limited_blas_threads
+
+
+# The functions are defined at module level such that they can be pickled
+# for the worker processes.
+def _square(item, offset=0):
+    return item ** 2 + offset, os.getpid()
+
+
+def _fail_on(item, failing_item):
+    if item == failing_item:
+        raise ValueError(f'Failing item {item}')
+    return item
+
+
+def test_map_and_gather():
+    with ProcessBackend(num_workers=2, blas_threads=1) as backend:
+        results = list(
+            backend.map(functools.partial(_square, offset=1), range(20))
+        )
+        assert backend.is_master
+        gathered = backend.gather([result for result, _ in results])
+        stats = backend.get_utilisation()
+    assert len(gathered) == 1
+    assert sorted(gathered[0]) == [item ** 2 + 1 for item in range(20)]
+    # The items are processed by the worker processes and not by the
+    # calling process
+    pids = {pid for _, pid in results}
+    assert os.getpid() not in pids
+    assert 1 <= len(pids) <= 2
+    assert len(stats) == len(pids)
+    assert sum([s['num_items'] for s in stats]) == 20
+
+
+def test_failure_propagation():
+    backend = ProcessBackend(num_workers=2, blas_threads=1)
+    with pytest.raises(ValueError, match='Failing item 3'):
+        list(backend.map(
+            functools.partial(_fail_on, failing_item=3), range(10)
+        ))
+    # The backend can be used again after a failure
+    assert sorted(backend.map(
+        functools.partial(_fail_on, failing_item=None), range(4)
+    )) == [0, 1, 2, 3]
+
+
+def test_limited_blas_threads():
+    threadpoolctl = pytest.importorskip('threadpoolctl')
+    np.ones((2, 2)) @ np.ones((2, 2))  # load BLAS
+    num_threads = [
+        pool['num_threads'] for pool in threadpoolctl.threadpool_info()
+    ]
+    with limited_blas_threads(1):
+        assert all([
+            pool['num_threads'] == 1
+            for pool in threadpoolctl.threadpool_info()
+        ])
+    assert [
+        pool['num_threads'] for pool in threadpoolctl.threadpool_info()
+    ] == num_threads
@@ -0,0 +1,325 @@
+"""
+Check that the vectorized activity operations (erode, dilate,
+solve_permutation) are identical to the implementations they replaced and
+that the choice of the cuts of segment_audio (see get_max_min_cuts) is
+identical to the evaluation of all combinations and stays fast for long,
+pause-rich signals.
+
+python -m pytest libriwasn/test_utils.py
+"""
+import itertools
+import time
+
+import numpy as np
+import paderbox as pb
+import pytest
+import scipy.optimize
+
+from libriwasn.utils import (
+    IntervalActivity,
+    _greedy_cuts,
+    _overlap_matrix,
+    dilate,
+    erode,
+    get_max_min_cuts,
+    solve_permutation
+)
+
+
+# The previous implementations passed activity.shape, i.e., an array with
+# one element, as offset, which numpy 2 no longer converts to a scalar.
+# Hence, the length of the activity is used instead.
+def _erode_intervals(activity, kernel_size):
+    # Previous implementation, which loops over the intervals of activity
+    activity_eroded = pb.array.interval.zeros(shape=activity.shape)
+    activity_intervals = \
+        pb.array.interval.ArrayInterval(activity).normalized_intervals
+    for (onset, offset) in activity_intervals:
+        onset += (kernel_size - 1) // 2
+        onset = np.maximum(onset, 0)
+        offset -= (kernel_size - 1) // 2
+        offset = np.minimum(offset, len(activity))
+        activity_eroded.add_intervals([slice(onset, offset)])
+    return np.asarray(activity_eroded)
+
+
+def _dilate_intervals(activity, kernel_size):
+    # Previous implementation, which loops over the intervals of activity
+    activity_dilated = pb.array.interval.zeros(shape=activity.shape)
+    activity_intervals = \
+        pb.array.interval.ArrayInterval(activity).normalized_intervals
+    for (onset, offset) in activity_intervals:
+        onset -= (kernel_size - 1) // 2
+        onset = np.maximum(onset, 0)
+        offset += (kernel_size - 1) // 2
+        offset = np.minimum(offset, len(activity))
+        activity_dilated.add_intervals([slice(onset, offset)])
+    return np.asarray(activity_dilated)
+
+
+def _get_activity(rng, length, mean_interval_len):
+    # Alternating intervals of activity and inactivity with random lengths,
+    # which may start active and may be active until the end
+    activity = []
+    active = bool(rng.integers(2))
+    while len(activity) < length:
+        activity += \
+            [active] * int(rng.integers(1, 2 * mean_interval_len + 1))
+        active = not active
+    return np.array(activity[:length])
+
+
+def _remove_wrapping_intervals(activity, kernel_size):
+    # The previous implementation of erode wraps the negative offset of an
+    # eroded interval, which ends within the first (kernel_size - 1) // 2
+    # samples, around to the end of the activity (see
+    # test_erode_short_first_interval). These intervals vanish due to the
+    # erosion and are removed for the comparison.
+    activity = activity.copy()
+    for (onset, offset) in \
+            pb.array.interval.ArrayInterval(activity).normalized_intervals:
+        if offset - (kernel_size - 1) // 2 < 0:
+            activity[onset:offset] = False
+    return activity
+
+
+@pytest.mark.parametrize('seed', range(200))
+def test_erode_dilate_identical_to_intervals(seed):
+    rng = np.random.default_rng(seed)
+    length = int(rng.integers(1, 400))
+    kernel_size = 2 * int(rng.integers(0, 15)) + 1
+    activity = _get_activity(rng, length, int(rng.integers(1, 30)))
+    np.testing.assert_equal(
+        dilate(activity, kernel_size), _dilate_intervals(activity, kernel_size)
+    )
+    np.testing.assert_equal(
+        erode(activity, kernel_size),
+        _erode_intervals(
+            _remove_wrapping_intervals(activity, kernel_size), kernel_size
+        )
+    )
+
+
+@pytest.mark.parametrize('kernel_size', [1, 3, 5, 11])
+def test_erode_dilate_edges(kernel_size):
+    length = 20
+    for activity in [
+        np.zeros(length, bool),
+        np.ones(length, bool),
+        np.arange(length) < 7,  # active at the start
+        np.arange(length) >= 13,  # active at the end
+        np.arange(length) == 10,  # single sample
+    ]:
+        np.testing.assert_equal(
+            dilate(activity, kernel_size),
+            _dilate_intervals(activity, kernel_size)
+        )
+        np.testing.assert_equal(
+            erode(activity, kernel_size),
+            _erode_intervals(activity, kernel_size)
+        )
+
+
+def test_erode_short_first_interval():
+    # The first interval ends within the first (kernel_size - 1) // 2
+    # samples. It is eroded completely, whereas the previous implementation
+    # used slice(2, -1) and activated everything except for the last sample.
+    activity = np.zeros(30, bool)
+    activity[:1] = True
+    activity[10:20] = True
+    expected = np.zeros(30, bool)
+    expected[12:18] = True
+    np.testing.assert_equal(erode(activity, 5), expected)
+    np.testing.assert_equal(
+        np.flatnonzero(_erode_intervals(activity, 5)), np.arange(2, 29)
+    )
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_erode_dilate_batched(seed):
+    # Stacked activities yield the same result as each activity on its own
+    rng = np.random.default_rng(seed)
+    kernel_size = 2 * int(rng.integers(0, 10)) + 1
+    activities = np.stack(
+        [_get_activity(rng, 300, 20) for _ in range(6)]
+    ).reshape(2, 3, 300)
+    for operation in [erode, dilate]:
+        result = operation(activities, kernel_size)
+        assert result.shape == activities.shape, result.shape
+        for index in np.ndindex(activities.shape[:-1]):
+            np.testing.assert_equal(
+                result[index], operation(activities[index], kernel_size)
+            )
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_interval_activity_erode_dilate(seed):
+    rng = np.random.default_rng(seed)
+    kernel_size = 2 * int(rng.integers(0, 10)) + 1
+    activity = _get_activity(
+        rng, int(rng.integers(1, 400)), int(rng.integers(1, 30))
+    )
+    intervals = IntervalActivity.from_dense(activity)
+    np.testing.assert_equal(
+        intervals.erode(kernel_size).to_dense(), erode(activity, kernel_size)
+    )
+    np.testing.assert_equal(
+        intervals.dilate(kernel_size).to_dense(),
+        dilate(activity, kernel_size)
+    )
+
+
+def _solve_permutation_pairwise(activities, ref_activities):
+    # Previous implementation, which pads the smaller set of activities and
+    # compares all pairs of activities sample by sample
+    if len(ref_activities) < len(activities):
+        ref_activities = np.pad(
+            ref_activities,
+            ((0, len(activities) - len(ref_activities)), (0, 0)),
+            'constant'
+        )
+    elif len(ref_activities) > len(activities):
+        activities = np.pad(
+            activities,
+            ((0, len(ref_activities) - len(activities)), (0, 0)),
+            'constant'
+        )
+    equal_values = np.zeros((len(activities), len(activities)))
+    for i, act in enumerate(activities):
+        for j, ref_act in enumerate(ref_activities):
+            equal_values[i, j] = np.sum(act == ref_act)
+    _, best_permutation = \
+        scipy.optimize.linear_sum_assignment(equal_values.T, maximize=True)
+    return np.asarray(best_permutation)
+
+
+def _get_activities(rng, num_sources, length):
+    activities = np.stack([
+        _get_activity(rng, length, int(rng.integers(1, 50)))
+        for _ in range(num_sources)
+    ])
+    # Inactive sources and sources, which are always active, occur in
+    # practice (e.g., the noise class) and produce ties.
+    if num_sources > 2 and rng.uniform() < .5:
+        activities[rng.integers(num_sources)] = False
+    if num_sources > 2 and rng.uniform() < .3:
+        activities[rng.integers(num_sources)] = True
+    return activities
+
+
+@pytest.mark.parametrize('seed', range(200))
+def test_solve_permutation_identical_to_pairwise(seed):
+    rng = np.random.default_rng(seed)
+    length = int(rng.integers(1, 1000))
+    activities = _get_activities(rng, int(rng.integers(1, 8)), length)
+    ref_activities = _get_activities(rng, int(rng.integers(1, 8)), length)
+    expected = _solve_permutation_pairwise(activities, ref_activities)
+    # Chunk sizes which do not divide the length, which divide it, which
+    # equal it and which exceed it
+    for chunk_size in [1, 7, 64, length, length + 1, 2 ** 16]:
+        np.testing.assert_equal(
+            solve_permutation(activities, ref_activities, chunk_size),
+            expected
+        )
+    intervals = [IntervalActivity.from_dense(act) for act in activities]
+    ref_intervals = \
+        [IntervalActivity.from_dense(act) for act in ref_activities]
+    np.testing.assert_equal(
+        solve_permutation(intervals, ref_intervals), expected
+    )
+    # Mixed dense and interval representation
+    np.testing.assert_equal(
+        solve_permutation(activities, ref_intervals), expected
+    )
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_overlap_matrix(seed):
+    rng = np.random.default_rng(seed)
+    length = int(rng.integers(1, 1000))
+    activities = _get_activities(rng, int(rng.integers(1, 6)), length)
+    ref_activities = _get_activities(rng, int(rng.integers(1, 6)), length)
+    expected = np.array([
+        [np.sum(act & ref_act) for ref_act in ref_activities]
+        for act in activities
+    ])
+    for inputs in [
+        (activities, ref_activities),
+        (
+            [IntervalActivity.from_dense(act) for act in activities],
+            [IntervalActivity.from_dense(act) for act in ref_activities]
+        ),
+    ]:
+        for chunk_size in [1, 13, length]:
+            overlap, sums, ref_sums, length_ = \
+                _overlap_matrix(*inputs, chunk_size)
+            np.testing.assert_equal(overlap, expected)
+            np.testing.assert_equal(sums, np.sum(activities, -1))
+            np.testing.assert_equal(ref_sums, np.sum(ref_activities, -1))
+            assert length_ == length, (length_, length)
+
+
+def test_solve_permutation_known_permutation():
+    rng = np.random.default_rng(0)
+    ref_activities = _get_activities(rng, 5, 500)
+    permutation = np.array([3, 0, 4, 1, 2])
+    activities = ref_activities[permutation]
+    np.testing.assert_equal(
+        activities[solve_permutation(activities, ref_activities)],
+        ref_activities
+    )
+
+
+def _get_max_min_cuts_exhaustive(points, num_cuts, length):
+    # Previous implementation of segment_audio, which evaluates all
+    # combinations of cuts
+    combinations = []
+    min_lens = []
+    for combination in itertools.combinations(points, r=num_cuts):
+        combination = [0, ] + list(combination) + [length, ]
+        min_lens.append(np.min(np.diff(combination)))
+        combinations.append(combination[1:-1])
+    choice = np.argmax(min_lens)
+    return combinations[choice], min_lens[choice]
+
+
+def _get_points(rng, num_points, length):
+    return sorted(
+        rng.choice(np.arange(1, length), num_points, replace=False).tolist()
+    )
+
+
+@pytest.mark.parametrize('seed', range(200))
+def test_max_min_cuts_identical_to_exhaustive_search(seed):
+    rng = np.random.default_rng(seed)
+    length = int(rng.integers(100, 2000))
+    points = _get_points(rng, int(rng.integers(1, 12)), length)
+    num_cuts = int(rng.integers(1, len(points) + 1))
+    cuts, min_len = get_max_min_cuts(points, num_cuts, length)
+    assert (cuts, min_len) == \
+        _get_max_min_cuts_exhaustive(points, num_cuts, length)
+
+
+def test_ties_choose_earliest_cuts():
+    # Cutting at 20 or 30 yields the same minimum length
+    assert get_max_min_cuts([10, 20, 30, 40], 1, 50) == ([20], 20)
+    # All combinations yield a minimum length of 10
+    assert get_max_min_cuts([10, 20, 30, 40], 2, 50) == ([10, 20], 10)
+
+
+def test_max_min_cuts_long_input():
+    # Four hours at 16 kHz with a pause every 3 s on average, which has to be
+    # cut into segments of at most 12 s. The evaluation of all combinations
+    # would not finish.
+    rng = np.random.default_rng(0)
+    length = 4 * 3600 * 16000
+    points = _get_points(rng, 4800, length)
+    num_cuts = int(np.ceil(length / 192000) - 1)
+    start = time.perf_counter()
+    cuts, min_len = get_max_min_cuts(points, num_cuts, length)
+    duration = time.perf_counter() - start
+    assert len(cuts) == num_cuts
+    assert np.min(np.diff([0] + cuts + [length])) == min_len
+    # The minimum length is optimal, i.e., a longer one is not feasible
+    assert _greedy_cuts(points, num_cuts, length, min_len + 1) is None
+    assert duration < 5, duration
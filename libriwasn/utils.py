@@ -1,6 +1,18 @@
 import numpy as np
 import scipy
-import paderbox as pb
+
+
+def _windowed_count(activity, kernel_size):
+    """
+    Count the number of active samples within a centered window of length
+    kernel_size for each sample of the activities along the last axis. Samples
+    outside the activity are treated as inactive.
+    """
+    activity = np.asarray(activity, bool)
+    half_width = (kernel_size - 1) // 2
+    padding = [(0, 0)] * (activity.ndim - 1) + [(half_width + 1, half_width)]
+    cum_sum = np.cumsum(np.pad(activity, padding), axis=-1, dtype=np.int64)
+    return cum_sum[..., kernel_size:] - cum_sum[..., :-kernel_size]
 
 
 def erode(activity, kernel_size):
@@ -9,7 +21,10 @@ def erode(activity, kernel_size):
 
     Args:
         activity:
-            Boolean array indicating the activity of a source
+            Boolean array indicating the activity of a source. Activities of
+            multiple sources can be processed at once by stacking them
+            (Shape: (... x number of samples)). The erosion is applied along
+            the last axis.
         kernel_size:
             Size of the erosion kernel. kernel_size must be an odd number.
 
@@ -17,16 +32,7 @@ def erode(activity, kernel_size):
         Activity after applying the erosion operation
     """
     assert kernel_size % 2 != 0, f'kernel_size ({kernel_size}) must be odd.'
-    activity_eroded = pb.array.interval.zeros(shape=activity.shape)
-    activity_intervals = \
-        pb.array.interval.ArrayInterval(activity).normalized_intervals
-    for (onset, offset) in activity_intervals:
-        onset += (kernel_size - 1) // 2
-        onset = np.maximum(onset, 0)
-        offset -= (kernel_size - 1) // 2
-        offset = np.minimum(offset, activity.shape)
-        activity_eroded.add_intervals([slice(onset, offset)])
-    return np.asarray(activity_eroded)
+    return _windowed_count(activity, kernel_size) == kernel_size
 
 
 def dilate(activity, kernel_size):
@@ -35,7 +41,10 @@ def dilate(activity, kernel_size):
 
     Args:
         activity:
-            Boolean array indicating the activity of a source
+            Boolean array indicating the activity of a source. Activities of
+            multiple sources can be processed at once by stacking them
+            (Shape: (... x number of samples)). The dilation is applied along
+            the last axis.
         kernel_size:
             Size of the dilation kernel. kernel_size must be an odd number.
 
@@ -43,49 +52,320 @@ def dilate(activity, kernel_size):
         Activity after applying the dilation operation
     """
     assert kernel_size % 2 != 0, f'kernel_size ({kernel_size}) must be odd.'
-    activity_dilated = pb.array.interval.zeros(shape=activity.shape)
-    activity_intervals = \
-        pb.array.interval.ArrayInterval(activity).normalized_intervals
-    for (onset, offset) in activity_intervals:
-        onset -= (kernel_size - 1) // 2
-        onset = np.maximum(onset, 0)
-        offset += (kernel_size - 1) // 2
-        offset = np.minimum(offset, activity.shape)
-        activity_dilated.add_intervals([slice(onset, offset)])
-    return np.asarray(activity_dilated)
-
-
-def solve_permutation(activities, ref_activities):
+    return _windowed_count(activity, kernel_size) > 0
+
+
+class IntervalActivity:
+    def __init__(self, intervals, length):
+        """
+        Compact representation of the activity of a source as a set of
+        sorted, non-overlapping intervals [onset, offset). Compared to a
+        boolean array at sample resolution, only a few hundred intervals have
+        to be stored for a whole meeting. A dense boolean array can be obtained
+        on demand via to_dense() or numpy.asarray().
+
+        Args:
+            intervals (array-like):
+                Intervals of activity as pairs of onset and offset (Shape:
+                (number of intervals x 2)). The intervals may be unsorted
+                and overlapping. They are clipped to [0, length) and merged.
+            length (int):
+                Length of the corresponding dense activity
+        """
+        self.length = int(length)
+        intervals = np.asarray(intervals, dtype=np.int64).reshape(-1, 2)
+        intervals = np.clip(intervals, 0, self.length)
+        intervals = intervals[intervals[:, 0] < intervals[:, 1]]
+        intervals = intervals[np.argsort(intervals[:, 0], kind='stable')]
+        if len(intervals) > 1:
+            # Merge overlapping and adjacent intervals
+            max_offsets = np.maximum.accumulate(intervals[:, 1])
+            new_interval = np.concatenate(
+                [[True], intervals[1:, 0] > max_offsets[:-1]]
+            )
+            group_ends = np.concatenate(
+                [np.flatnonzero(new_interval)[1:] - 1, [len(intervals) - 1]]
+            )
+            intervals = np.stack(
+                [intervals[new_interval, 0], max_offsets[group_ends]], axis=-1
+            )
+        self.intervals = intervals
+
+    @classmethod
+    def from_dense(cls, activity):
+        """
+        Create the interval representation of a boolean activity array
+
+        Args:
+            activity:
+                Boolean array indicating the activity of a source
+
+        Returns:
+            IntervalActivity corresponding to activity
+        """
+        activity = np.asarray(activity, bool)
+        assert activity.ndim == 1, activity.shape
+        changes = np.flatnonzero(
+            np.diff(np.pad(activity.astype(np.int8), 1))
+        )
+        return cls(changes.reshape(-1, 2), len(activity))
+
+    @property
+    def shape(self):
+        return (self.length,)
+
+    @property
+    def onsets(self):
+        return self.intervals[:, 0]
+
+    @property
+    def offsets(self):
+        return self.intervals[:, 1]
+
+    def __len__(self):
+        return self.length
+
+    def __repr__(self):
+        return (f'{self.__class__.__name__}(num_intervals='
+                f'{len(self.intervals)}, length={self.length})')
+
+    def __array__(self, dtype=None, copy=None):
+        activity = self.to_dense()
+        if dtype is not None:
+            activity = activity.astype(dtype)
+        return activity
+
+    def to_dense(self):
+        """
+        Convert the activity to a boolean array at sample resolution
+        """
+        changes = np.zeros(self.length + 1, np.int8)
+        np.add.at(changes, self.onsets, 1)
+        np.add.at(changes, self.offsets, -1)
+        return np.cumsum(changes[:-1]) > 0
+
+    def sum(self):
+        """
+        Number of active samples
+        """
+        return int(np.sum(self.offsets - self.onsets))
+
+    def _cumulative_activity(self, positions):
+        # Number of active samples before each of the given positions. Must
+        # not be called for an activity without any interval.
+        lengths = self.offsets - self.onsets
+        cum_lengths = np.concatenate([[0], np.cumsum(lengths)])
+        idx = np.searchsorted(self.onsets, positions, side='right') - 1
+        partial = np.clip(
+            positions - self.onsets[np.maximum(idx, 0)],
+            0, lengths[np.maximum(idx, 0)]
+        )
+        return np.where(idx >= 0, cum_lengths[idx] + partial, 0)
+
+    def overlap(self, other):
+        """
+        Number of samples in which both activities are active
+
+        Args:
+            other (IntervalActivity):
+                Activity to be compared with
+
+        Returns:
+            Size of the intersection of both activities
+        """
+        if len(self.intervals) == 0 or len(other.intervals) == 0:
+            return 0
+        return int(np.sum(
+            other._cumulative_activity(self.offsets)
+            - other._cumulative_activity(self.onsets)
+        ))
+
+    def agreement(self, other):
+        """
+        Number of samples in which both activities have the same value,
+        i.e., which are either active or inactive in both activities.
+
+        Args:
+            other (IntervalActivity):
+                Activity to be compared with (must have the same length)
+
+        Returns:
+            Number of agreeing samples
+        """
+        assert self.length == other.length, (self.length, other.length)
+        return (self.length - self.sum() - other.sum()
+                + 2 * self.overlap(other))
+
+    def erode(self, kernel_size):
+        """
+        Applies an erosion operation to the activity (see erode)
+
+        Args:
+            kernel_size:
+                Size of the erosion kernel. kernel_size must be an odd number.
+
+        Returns:
+            IntervalActivity after applying the erosion operation
+        """
+        assert kernel_size % 2 != 0, \
+            f'kernel_size ({kernel_size}) must be odd.'
+        half_width = (kernel_size - 1) // 2
+        return self.__class__(
+            self.intervals + [half_width, -half_width], self.length
+        )
+
+    def dilate(self, kernel_size):
+        """
+        Applies a dilation operation to the activity (see dilate)
+
+        Args:
+            kernel_size:
+                Size of the dilation kernel. kernel_size must be an odd number.
+
+        Returns:
+            IntervalActivity after applying the dilation operation
+        """
+        assert kernel_size % 2 != 0, \
+            f'kernel_size ({kernel_size}) must be odd.'
+        half_width = (kernel_size - 1) // 2
+        return self.__class__(
+            self.intervals + [-half_width, half_width], self.length
+        )
+
+
+def _overlap_matrix(activities, ref_activities, chunk_size):
+    # Number of samples in which activities[i] and ref_activities[j] are both
+    # active. Dense activities are processed in chunks along the time axis
+    # using a matrix product.
+    if (any(isinstance(act, IntervalActivity) for act in activities)
+            or any(isinstance(act, IntervalActivity)
+                   for act in ref_activities)):
+        activities = [
+            act if isinstance(act, IntervalActivity)
+            else IntervalActivity.from_dense(act) for act in activities
+        ]
+        ref_activities = [
+            act if isinstance(act, IntervalActivity)
+            else IntervalActivity.from_dense(act) for act in ref_activities
+        ]
+        lengths = {act.length for act in activities + ref_activities}
+        assert len(lengths) == 1, lengths
+        overlap = np.array(
+            [[act.overlap(ref_act) for ref_act in ref_activities]
+             for act in activities], dtype=np.float64
+        ).reshape(len(activities), len(ref_activities))
+        sums = np.array([act.sum() for act in activities], np.float64)
+        ref_sums = np.array([act.sum() for act in ref_activities], np.float64)
+        return overlap, sums, ref_sums, lengths.pop()
+
+    activities = np.asarray(activities, bool)
+    ref_activities = np.asarray(ref_activities, bool)
+    assert activities.shape[-1] == ref_activities.shape[-1], \
+        (activities.shape, ref_activities.shape)
+    length = activities.shape[-1]
+    overlap = np.zeros((len(activities), len(ref_activities)))
+    sums = np.zeros(len(activities))
+    ref_sums = np.zeros(len(ref_activities))
+    for start in range(0, length, chunk_size):
+        # float32 represents the counts of one chunk exactly
+        chunk = activities[:, start:start + chunk_size].astype(np.float32)
+        ref_chunk = \
+            ref_activities[:, start:start + chunk_size].astype(np.float32)
+        overlap += chunk @ ref_chunk.T
+        sums += np.sum(chunk, axis=-1)
+        ref_sums += np.sum(ref_chunk, axis=-1)
+    return overlap, sums, ref_sums, length
+
+
+def solve_permutation(activities, ref_activities, chunk_size=2**16):
     """
     Solve the permutation between two sets of source activities
 
     Args:
         activities:
-            Activities whose permutation should be solved
+            Activities whose permutation should be solved. Either a boolean
+            array (Shape: (number of sources x number of samples)) or a list
+            of IntervalActivity objects.
         ref_activities:
-            Reference activities
+            Reference activities. Either a boolean array or a list of
+            IntervalActivity objects. The number of reference activities may
+            differ from the number of activities. In this case, the smaller
+            set is treated as if it was padded with inactive sources.
+        chunk_size (int):
+            Number of samples which are processed at once when comparing
+            dense activities. Must not exceed 2**24.
 
     Returns:
         Permutation needed to reorder "activities"
     """
-    if len(ref_activities) < len(activities):
-        ref_activities = np.pad(
-            ref_activities,
-            ((0, len(activities) - len(ref_activities)), (0, 0)),
-            'constant'
-        )
-    elif len(ref_activities) > len(activities):
-        activities = np.pad(
-            activities,
-            ((0, len(ref_activities) - len(activities)), (0, 0)),
-            'constant'
-        )
-    assert len(ref_activities) == len(activities), \
-        (len(ref_activities), len(activities))
-    equal_values = np.zeros((len(activities), len(activities)))
-    for i, act in enumerate(activities):
-        for j, ref_act in enumerate(ref_activities):
-            equal_values[i, j] = np.sum(act == ref_act)
+    assert 0 < chunk_size <= 2**24, chunk_size
+    overlap, sums, ref_sums, length = \
+        _overlap_matrix(activities, ref_activities, chunk_size)
+
+    # Number of samples in which both activities have the same value. Inactive
+    # sources, which are used to pad the smaller set of activities, agree
+    # with an activity in all samples in which the activity is inactive.
+    num_sources = max(len(sums), len(ref_sums))
+    equal_values = np.full((num_sources, num_sources), float(length))
+    equal_values[:len(sums)] -= sums[:, None]
+    equal_values[:, :len(ref_sums)] -= ref_sums[None]
+    equal_values[:len(sums), :len(ref_sums)] += 2 * overlap
     _, best_permutation = \
         scipy.optimize.linear_sum_assignment(equal_values.T, maximize=True)
     return np.asarray(best_permutation)
+
+
+def _greedy_cuts(points, num_cuts, length, min_len):
+    # Take the earliest point which keeps a distance of at least min_len to
+    # the previous cut. This yields the earliest possible position for each
+    # cut. Hence, the cuts are feasible if and only if the greedy cuts are.
+    cuts = []
+    prev = 0
+    for point in points:
+        if point - prev >= min_len:
+            cuts.append(point)
+            prev = point
+            if len(cuts) == num_cuts:
+                break
+    if len(cuts) < num_cuts or length - prev < min_len:
+        return None
+    return cuts
+
+
+def get_max_min_cuts(points, num_cuts, length):
+    """
+    Choose num_cuts out of the possible points to cut a signal such that the
+    shortest of the resulting segments is as long as possible. The longest
+    feasible minimum segment length is found by a binary search, where
+    the feasibility of a minimum segment length is checked greedily in linear
+    time. Hence, the complexity is O(len(points) * log(length)) instead of
+    the binomial coefficient of len(points) and num_cuts for the evaluation of
+    all combinations. If several choices are optimal, the choice with the
+    earliest cuts is returned, which is the first optimal combination in the
+    order of itertools.combinations.
+
+    Args:
+        points (list):
+            Sorted positions where the signal may be cut
+        num_cuts (int):
+            Number of cuts, which must not exceed the number of points
+        length (int):
+            Length of the signal
+
+    Returns:
+        cuts (list):
+            Chosen positions
+        min_len (int):
+            Length of the shortest segment
+    """
+    assert 0 < num_cuts <= len(points), (num_cuts, len(points))
+    # A minimum segment length of 0 is always feasible
+    low = 0
+    high = length
+    while low < high:
+        min_len = (low + high + 1) // 2
+        if _greedy_cuts(points, num_cuts, length, min_len) is None:
+            high = min_len - 1
+        else:
+            low = min_len
+    return _greedy_cuts(points, num_cuts, length, low), low